@@ -3,9 +3,43 @@ import time
 import csv
 import os
 import logging
-from requests.adapters import HTTPAdapter
+import gzip
+import mmap
+import queue
+import tempfile
+import threading
+import itertools
+import random
+import contextlib
+import collections
+import multiprocessing
 from urllib3.util.retry import Retry
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from journal import JOURNAL_DIR, JobJournal, discard_request
+from report_cache import DayCache
+from rate_limit import RateLimitedAdapter, TokenBuckets
+from metadata_cache import MetadataCache
+from timings import start_span, timed_iter
+
+# pyarrow нужен только для выгрузки в Parquet и загружается при первой
+# выгрузке (load_pyarrow), чтобы не замедлять импорт модуля
+pa = None
+pq = None
+
+def load_pyarrow():
+    """Импорт pyarrow при первом обращении"""
+    global pa, pq
+    if pq is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Для сохранения в Parquet установите пакет pyarrow")
+        pa = pyarrow
+        pq = pyarrow.parquet
 
 # Добавляем после импортов, перед основным кодом
 def format_date(date_str):
@@ -27,32 +61,111 @@ def format_date(date_str):
             return date_str
     return date_str
 
-# Настройка логирования
-log_dir = 'logs'
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-logging.basicConfig(
-    filename=os.path.join(log_dir, f'metrika_{datetime.now().strftime("%Y%m%d")}.log'),
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Настройка логирования
+def setup_logging(log_dir='logs', level=logging.INFO):
+    """
+    Запись логов в файл log_dir/metrika_YYYYMMDD.log.
+    Вызывается приложением (GUI, CLI), а не при импорте модуля.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    handler = logging.FileHandler(
+        os.path.join(log_dir, f'metrika_{datetime.now().strftime("%Y%m%d")}.log'), encoding='utf-8'
+    )
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    if root_logger.level == logging.NOTSET or root_logger.level > level:
+        root_logger.setLevel(level)
+    return handler
+
+# Базовый URL API управления Яндекс.Метрики. Переменная окружения
+# METRIKA_API_URL подменяет его, например, локальным mock_server.py
+API_BASE_URL = os.environ.get("METRIKA_API_URL", "https://api-metrika.yandex.net/management/v1").rstrip("/")
+
 # Константы для задержек
 API_DELAY = 1.0      # Базовая задержка 1 секунда между запросами
 RETRY_DELAY = 10.0   # Увеличенная задержка до 10 секунд при повторе
 MAX_RETRIES = 3      # Максимальное количество попыток
 
+# Опрос статуса запросов: первые проверки частые, дальше интервал растет
+# экспоненциально (со случайным разбросом) до POLL_MAX_DELAY
+POLL_INITIAL_DELAY = 1.0       # Первая проверка через 1 секунду
+POLL_BACKOFF = 1.5             # Множитель интервала после каждой проверки
+POLL_MAX_DELAY = 60.0          # Максимальный интервал между проверками
+POLL_TIMEOUT = 6 * 60 * 60     # Общее время ожидания готовности запроса
+
+# Количество потоков для параллельной загрузки частей отчета
+DOWNLOAD_WORKERS = 4
+
+# Размер блока при потоковом чтении ответа API (байт)
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Потоковая выгрузка: строки передаются между потоками пачками,
+# у каждой части в очереди не больше STREAM_QUEUE_SIZE пачек
+STREAM_BATCH_ROWS = 1000
+STREAM_QUEUE_SIZE = 8
+
+# Разбор TSV в пуле процессов (parse_workers): строки передаются процессам
+# блоками по PARSE_BLOCK_SIZE байт, у каждой части в работе
+# не больше PARSE_PENDING_BLOCKS блоков
+PARSE_BLOCK_SIZE = 1024 * 1024
+PARSE_PENDING_BLOCKS = 2
+
+# Форматы файлов частей в режиме spool: как отдает API (gzip)
+# или без сжатия (plain, разбор через mmap)
+SPOOL_FORMATS = ('gzip', 'plain')
+
+# Количество строк в одной группе строк (row group) Parquet
+PARQUET_ROW_GROUP_SIZE = 100000
+
+# Как часто сохранять в журнал позицию загрузки части (байт)
+JOURNAL_SAVE_BYTES = 8 * 1024 * 1024
+
+# Сколько запросов логов готовятся на стороне API одновременно
+MAX_CONCURRENT_REQUESTS = 3
+
+# Лимит частоты запросов к API на токен, общий для всех потоков и процессов
+# (состояние в файле токена в RATE_LIMIT_DIR): в среднем API_RATE_LIMIT
+# запросов в секунду, пачкой не больше API_RATE_BURST
+API_RATE_LIMIT = 10.0
+API_RATE_BURST = 20
+
 # Настройка повторных попыток для requests
 retry_strategy = Retry(
     total=3,
     backoff_factor=3,  # Увеличиваем множитель для экспоненциальной задержки
     status_forcelist=[429, 500, 502, 503, 504]
 )
-adapter = HTTPAdapter(max_retries=retry_strategy)
+# Ответы 429 повторяет RateLimitedAdapter с общей паузой по Retry-After,
+# остальные коды из retry_strategy - urllib3 (без учета Retry-After, иначе
+# urllib3 сам повторял бы ответы 429 с этим заголовком в обход ограничителя)
+rate_limiter = TokenBuckets(API_RATE_LIMIT, API_RATE_BURST)
+adapter = RateLimitedAdapter(
+    rate_limiter,
+    rate_limit_retries=MAX_RETRIES,
+    rate_limit_delay=RETRY_DELAY,
+    max_retries=retry_strategy.new(
+        status_forcelist=[code for code in retry_strategy.status_forcelist if code != 429],
+        respect_retry_after_header=False
+    )
+)
 session = requests.Session()
 session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+# Кеш метаданных (список счетчиков, цели), общий для заданий и процессов
+metadata_cache = MetadataCache()
+
+def _invalidate_metadata_on_auth_error(response, *args, **kwargs):
+    # Токен отозван или потерял доступ: кешированные метаданные больше не верны
+    if response.status_code in (401, 403):
+        authorization = response.request.headers.get("Authorization", "")
+        if authorization.startswith("OAuth "):
+            metadata_cache.invalidate(authorization[len("OAuth "):])
+
+session.hooks["response"].append(_invalidate_metadata_on_auth_error)
 
 # Константы для атрибуции
 ATTRIBUTION_TYPES = {
@@ -237,6 +350,195 @@ HITS_METRICS = [
     "ym:pv:paramsLevel6", "ym:pv:paramsLevel7", "ym:pv:paramsLevel8"
 ]
 
+# Типы полей (имя поля без префикса ym:s: / ym:pv: и без <attribution>).
+# Поля, которых нет в списках, остаются строками.
+INTEGER_FIELDS = {
+    "visitID", "watchID", "counterID", "clientID", "pageViews", "visitDuration",
+    "bounce", "isNewUser", "dateTimeUTC", "regionCountryID", "regionCityID",
+    "browserMajorVersion", "browserMinorVersion", "cookieEnabled", "javascriptEnabled",
+    "screenColors", "screenOrientation", "screenWidth", "screenHeight",
+    "physicalScreenWidth", "physicalScreenHeight", "windowClientWidth", "windowClientHeight",
+    "pageHeight", "pageWidth", "viewportHeight", "viewportWidth", "flashMajor", "flashMinor",
+    "link", "download", "notBounce", "artificial", "hasGCLID"
+}
+# Целочисленные идентификаторы: в Logs API это UInt64, значения
+# могут быть не меньше 2**63 и не помещаются в знаковый int64
+ID_FIELDS = {"visitID", "watchID", "counterID", "clientID", "regionCountryID", "regionCityID"}
+DATETIME_FIELDS = {"dateTime"}
+DATE_FIELDS = {"date"}
+
+# Строковые поля с небольшим числом различных значений:
+# одинаковые значения хранятся в памяти одним объектом
+CATEGORY_FIELDS = {
+    "regionCountry", "regionCity", "browser", "browserEngine", "browserLanguage",
+    "browserCountry", "operatingSystem", "operatingSystemRoot", "deviceCategory",
+    "deviceBrand", "mobilePhone", "mobilePhoneModel", "networkType", "screenFormat",
+    "screenOrientationName", "clientTimeZone", "pageCharset", "TrafficSource", "AdvEngine",
+    "SearchEngine", "SearchEngineRoot", "SocialNetwork", "Messenger", "RecommendationSystem",
+    "DirectPlatformType", "DirectConditionType", "UTMSource", "UTMMedium",
+    "lastTrafficSource", "lastSearchEngine", "lastSearchEngineRoot", "lastAdvEngine",
+    "lastSocialNetwork", "eventType"
+}
+
+def field_base_name(field):
+    """Имя поля без префикса ym:s: / ym:pv: и без <attribution>"""
+    return field.replace('ym:s:', '').replace('ym:pv:', '').replace('<attribution>', '')
+
+def field_type(field):
+    """Тип значений поля: int, datetime, date, category или str"""
+    name = field_base_name(field)
+    if name in INTEGER_FIELDS:
+        return 'int'
+    if name in DATETIME_FIELDS:
+        return 'datetime'
+    if name in DATE_FIELDS:
+        return 'date'
+    if name in CATEGORY_FIELDS:
+        return 'category'
+    return 'str'
+
+def is_id_field(field):
+    """Поле - идентификатор UInt64 (ID_FIELDS)"""
+    return field_base_name(field) in ID_FIELDS
+
+def _parse_int(value):
+    if value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def _parse_datetime(value):
+    if value == '':
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+def _parse_date(value):
+    if value == '':
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return value
+
+def _category_parser():
+    # Кеш значений своего столбца: повторяющиеся строки хранятся один раз
+    values = {}
+    return lambda value: values.setdefault(value, value)
+
+class LogRow(Mapping):
+    """
+    Строка отчета. Значения хранятся в кортеже, а словарь
+    "заголовок -> позиция" общий для всех строк одной части,
+    поэтому заголовки не повторяются в каждой строке.
+    Поддерживает чтение как обычный словарь.
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def values_tuple(self):
+        """Значения строки в порядке заголовков"""
+        return self._values
+
+    def values_for(self, columns):
+        """Значения строки по именам столбцов columns (в их порядке)"""
+        index = self._index
+        values = self._values
+        return [values[index[column]] for column in columns]
+
+    def __repr__(self):
+        return f"LogRow({dict(self)!r})"
+
+def make_row_parser(columns):
+    """
+    Разбор строк TSV в типизированные LogRow для заданных заголовков.
+    Возвращает функцию: строка TSV -> LogRow (или None для некорректной строки).
+    """
+    index = {column: position for position, column in enumerate(columns)}
+    parse_values = make_values_parser(columns)
+
+    def parse_line(line):
+        values = parse_values(line)
+        if values is None:
+            return None
+        return LogRow(index, values)
+
+    return parse_line
+
+def make_values_parser(columns):
+    """
+    Разбор строк TSV в кортежи типизированных значений (без LogRow).
+    Возвращает функцию: строка TSV -> кортеж (или None для некорректной строки).
+    """
+    parsers = {
+        'int': _parse_int,
+        'datetime': _parse_datetime,
+        'date': _parse_date,
+    }
+    typed_columns = []
+    for position, column in enumerate(columns):
+        kind = field_type(column)
+        if kind == 'category':
+            typed_columns.append((position, _category_parser()))
+        elif kind in parsers:
+            typed_columns.append((position, parsers[kind]))
+    column_count = len(columns)
+
+    def parse_line(line):
+        values = line.split('\t')
+        if len(values) != column_count:
+            return None
+        for position, parse in typed_columns:
+            values[position] = parse(values[position])
+        return tuple(values)
+
+    return parse_line
+
+def parse_tsv_block(columns, block):
+    """
+    Разбор блока целых строк TSV (bytes или memoryview) в список кортежей значений.
+    Выполняется в процессах пула разбора (parse_workers), поэтому это функция
+    верхнего уровня модуля: аргументы и результат передаются через pickle.
+    Одинаковые значения категорий внутри блока передаются один раз.
+    """
+    parse_values = make_values_parser(columns)
+    batch = []
+    for line in str(block, 'utf-8').split('\n'):
+        if not line:
+            continue
+        values = parse_values(line)
+        if values is not None:
+            batch.append(values)
+    return batch
+
+def parse_tsv_file_range(path, columns, start, end):
+    """
+    Разбор байт [start, end) несжатого файла части в процессе пула:
+    процессу передаются только путь и границы, файл читается через mmap.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view, view[start:end] as block:
+            return parse_tsv_block(columns, block)
+
 def get_available_metrics(report_type='visits'):
     """Returns available metrics based on report type with validation"""
     if not isinstance(report_type, str):
@@ -290,13 +592,67 @@ def validate_fields(fields, report_type='visits'):
     logger.info(f"Field validation successful for {actual_report_type}")
     return actual_report_type
 
-# Создание запроса на выгрузку
-def create_log_request(token, counter_id, fields, date1, date2, attribution='last'):
-    """Создание запроса к Logs API"""
-    base_url = f"https://api-metrika.yandex.net/management/v1/counter/{counter_id}/logrequests"
+def report_source(fields):
+    """Источник логов (visits или hits) по префиксам полей"""
+    return "visits" if any(f.startswith("ym:s:") for f in fields) else "hits"
+
+# Оценка возможности создания запроса
+def evaluate_log_request(token, counter_id, fields, date1, date2):
+    """
+    Оценка запроса через logrequests/evaluate до его создания.
+    Возвращает словарь с ключами possible и max_possible_day_quantity.
+    """
+    url = f"{API_BASE_URL}/counter/{counter_id}/logrequests/evaluate"
+    params, _ = build_log_request(fields, date1, date2)
+    headers = {
+        "Authorization": f"OAuth {token}",
+    }
+    response = session.get(url, params=params, headers=headers, timeout=30)
+    response.raise_for_status()
+    evaluation = response.json().get("log_request_evaluation", {})
+    logger.info(
+        f"Оценка запроса {params['date1']} - {params['date2']}: "
+        f"possible={evaluation.get('possible')}, "
+        f"max_possible_day_quantity={evaluation.get('max_possible_day_quantity')}"
+    )
+    return evaluation
+
+# Выбор размера интервала по оценке API
+def plan_chunk_days(token, counter_id, fields, date1, date2, concurrency=1):
+    """
+    Размер интервала в днях и количество одновременно готовящихся запросов,
+    при которых запросы укладываются в ограничения API: (None, concurrency) -
+    период можно выгрузить одним запросом.
+    Оценка API - квота для одного запроса, поэтому max_possible_day_quantity
+    делится между concurrency запросами, которые готовятся одновременно.
+    """
+    evaluation = evaluate_log_request(token, counter_id, fields, date1, date2)
+    return chunk_days_from_evaluation(evaluation, concurrency)
+
+def chunk_days_from_evaluation(evaluation, concurrency=1):
+    """Размер интервала и количество одновременных запросов по оценке API (см. plan_chunk_days)"""
+    if evaluation.get("possible"):
+        return None, concurrency
     
+    max_days = evaluation.get("max_possible_day_quantity") or 0
+    if max_days < 1:
+        raise ValueError(
+            "Запрос невозможен даже для одного дня: превышены ограничения Logs API. "
+            "Уменьшите набор полей или освободите квоту"
+        )
+    concurrency = max(1, min(concurrency, max_days))
+    chunk_days = max_days // concurrency
+    logger.info(
+        f"Запрос слишком большой, период будет разбит на интервалы по {chunk_days} дн., "
+        f"одновременно готовится не больше {concurrency} запросов"
+    )
+    return chunk_days, concurrency
+
+# Параметры запроса на выгрузку
+def build_log_request(fields, date1, date2, attribution='last'):
+    """Параметры URL и тело запроса на создание выгрузки"""
     # Определяем тип источника
-    source = "visits" if any(f.startswith("ym:s:") for f in fields) else "hits"
+    source = report_source(fields)
     
     # Форматируем даты
     formatted_date1 = format_date(date1)
@@ -321,6 +677,30 @@ def create_log_request(token, counter_id, fields, date1, date2, attribution='las
         'fields': fields,
         'attribution': attribution
     }
+    return params, request_data
+
+def format_api_error(status_code, error_details=None, text=''):
+    """Текст ошибки API по коду ответа и телу ответа (если это JSON)"""
+    error_msg = f"Ошибка API {status_code}"
+    if isinstance(error_details, dict):
+        if 'message' in error_details:
+            error_msg += f": {error_details['message']}"
+        if 'errors' in error_details:
+            for error in error_details['errors']:
+                if 'message' in error:
+                    error_msg += f"\n- {error['message']}"
+    else:
+        error_msg += f": {text}"
+    return error_msg
+
+# Создание запроса на выгрузку
+def create_log_request(token, counter_id, fields, date1, date2, attribution='last'):
+    """Создание запроса к Logs API"""
+    base_url = f"{API_BASE_URL}/counter/{counter_id}/logrequests"
+    params, request_data = build_log_request(fields, date1, date2, attribution)
+    source = params['source']
+    formatted_date1 = params['date1']
+    formatted_date2 = params['date2']
     
     headers = {
         "Authorization": f"OAuth {token}",
@@ -343,17 +723,10 @@ def create_log_request(token, counter_id, fields, date1, date2, attribution='las
         )
         
         if response.status_code != 200:
-            error_msg = f"Ошибка API {response.status_code}"
             try:
-                error_details = response.json()
-                if 'message' in error_details:
-                    error_msg += f": {error_details['message']}"
-                if 'errors' in error_details:
-                    for error in error_details['errors']:
-                        if 'message' in error:
-                            error_msg += f"\n- {error['message']}"
-            except:
-                error_msg += f": {response.text}"
+                error_msg = format_api_error(response.status_code, response.json())
+            except ValueError:
+                error_msg = format_api_error(response.status_code, text=response.text)
             logger.error(error_msg)
             raise ValueError(error_msg)
             
@@ -370,81 +743,721 @@ def create_log_request(token, counter_id, fields, date1, date2, attribution='las
         logger.error(f"Ошибка сети: {str(e)}")
         raise
 
-# Проверка статуса готовности запроса
-def wait_for_request_ready(token, counter_id, request_id):
-    url = f"https://api-metrika.yandex.net/management/v1/counter/{counter_id}/logrequest/{request_id}"
+# Получение информации о запросе
+def get_log_request(token, counter_id, request_id):
+    """Получение описания запроса (статус, список частей)"""
+    url = f"{API_BASE_URL}/counter/{counter_id}/logrequest/{request_id}"
     headers = {
         "Authorization": f"OAuth {token}",
     }
+    response = session.get(url, headers=headers)
+    response.raise_for_status()
+    return response.json()["log_request"]
 
-    while True:
-        time.sleep(API_DELAY)  # Добавляем задержку перед каждым запросом
-        response = session.get(url, headers=headers)
-        response.raise_for_status()
-        status = response.json()["log_request"]["status"]
-        logger.info(f"Статус: {status}")
+# Статусы запросов, к которым можно подключиться вместо создания нового
+REUSABLE_STATUSES = ("processed", "created", "processing")
+
+# Список существующих запросов счетчика
+def list_log_requests(token, counter_id):
+    """Описания всех запросов счетчика, которые еще хранятся в API"""
+    url = f"{API_BASE_URL}/counter/{counter_id}/logrequests"
+    headers = {
+        "Authorization": f"OAuth {token}",
+    }
+    response = session.get(url, headers=headers, timeout=30)
+    response.raise_for_status()
+    return response.json().get("requests", [])
+
+def matches_log_request(log_request, fields, date1, date2, attribution='last'):
+    """Совпадает ли существующий запрос по полям, датам, источнику и атрибуции"""
+    _, request_data = build_log_request(fields, date1, date2, attribution)
+    return (
+        log_request.get("source") == request_data["source"]
+        and log_request.get("date1") == request_data["date1"]
+        and log_request.get("date2") == request_data["date2"]
+        and set(log_request.get("fields") or []) == set(request_data["fields"])
+        and str(log_request.get("attribution", "")).lower() == attribution.lower()
+    )
+
+def find_log_request(log_requests, fields, date1, date2, attribution='last'):
+    """
+    ID подходящего существующего запроса или None.
+    Готовые запросы предпочтительнее тех, что еще готовятся.
+    """
+    candidates = [
+        log_request for log_request in log_requests
+        if log_request.get("status") in REUSABLE_STATUSES
+        and matches_log_request(log_request, fields, date1, date2, attribution)
+    ]
+    if not candidates:
+        return None
+    candidates.sort(key=lambda log_request: log_request["status"] != "processed")
+    return candidates[0]["request_id"]
+
+def next_poll_delay(delay, backoff=POLL_BACKOFF, max_delay=POLL_MAX_DELAY):
+    """Следующий интервал опроса и пауза до проверки"""
+    delay = min(delay * backoff, max_delay)
+    # Случайный разброс, чтобы проверки разных запросов не совпадали
+    return delay, random.uniform(delay / 2, delay)
+
+# Отмена выгрузки
+class ReportCancelled(Exception):
+    """Выгрузка отменена через CancelToken"""
+
+class CancelToken:
+    """
+    Признак отмены выгрузки, общий для потока выгрузки и того, кто ее
+    запустил (GUI, CLI, пакетная выгрузка). Проверяется при создании
+    запросов, в паузах между опросами статуса и при загрузке частей.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        """Выбрасывает ReportCancelled, если выгрузка отменена"""
+        if self._event.is_set():
+            raise ReportCancelled("Выгрузка отменена")
+
+    def sleep(self, seconds):
+        """Пауза, которая прерывается отменой (тогда выбрасывается ReportCancelled)"""
+        self._event.wait(seconds)
+        self.check()
+
+# Опрос статуса запросов
+class LogRequestPoller:
+    """
+    Ожидание готовности нескольких запросов в одном цикле.
+    У каждого запроса свой интервал опроса: первая проверка через
+    initial_delay, дальше интервал умножается на backoff (со случайным
+    разбросом) до max_delay. Если запрос не готов за timeout секунд,
+    выбрасывается TimeoutError, при отмене через cancel - ReportCancelled.
+    Ошибка опроса запроса выбрасывается только из wait, который ждет
+    именно этот запрос: ожидание других запросов она не прерывает.
+    """
+
+    def __init__(self, token, initial_delay=None, backoff=None, max_delay=None, timeout=None, cancel=None):
+        self.token = token
+        self.cancel = cancel
+        # Значения по умолчанию читаются при создании, чтобы константы POLL_*
+        # можно было изменить (например, для локального сервера в benchmark.py)
+        self.initial_delay = POLL_INITIAL_DELAY if initial_delay is None else initial_delay
+        self.backoff = POLL_BACKOFF if backoff is None else backoff
+        self.max_delay = POLL_MAX_DELAY if max_delay is None else max_delay
+        self.timeout = POLL_TIMEOUT if timeout is None else timeout
+        self.ready = {}      # (counter_id, request_id) -> описание готового запроса
+        self._pending = {}   # (counter_id, request_id) -> [время проверки, интервал, крайний срок]
+        self.errors = {}     # (counter_id, request_id) -> ошибка опроса, которую еще никто не ждал
+        self.poll_count = 0
+
+    def add(self, counter_id, request_id):
+        """Добавить запрос в опрос"""
+        key = (counter_id, request_id)
+        if key not in self.ready and key not in self._pending and key not in self.errors:
+            now = time.monotonic()
+            self._pending[key] = [now + self.initial_delay, self.initial_delay, now + self.timeout]
+        return key
+
+    def discard(self, counter_id, request_id):
+        """Убрать запрос из опроса"""
+        key = (counter_id, request_id)
+        self._pending.pop(key, None)
+        self.ready.pop(key, None)
+        self.errors.pop(key, None)
+
+    def _poll(self, key):
+        counter_id, request_id = key
+        next_time, delay, deadline = self._pending[key]
+        log_request = get_log_request(self.token, counter_id, request_id)
+        self.poll_count += 1
+        status = log_request["status"]
+        logger.info(f"Статус запроса {request_id}: {status}")
         
         if status == "processed":
-            return
+            del self._pending[key]
+            self.ready[key] = log_request
         elif status == "created" or status == "processing":
-            time.sleep(RETRY_DELAY)  # Увеличенная задержка при ожидании обработки
+            now = time.monotonic()
+            if now >= deadline:
+                del self._pending[key]
+                logger.error(f"Запрос {request_id} не готов за {self.timeout:.0f} секунд")
+                raise TimeoutError(f"Запрос {request_id} не готов за {self.timeout:.0f} секунд")
+            delay, pause = next_poll_delay(delay, self.backoff, self.max_delay)
+            next_time = now + pause
+            self._pending[key] = [min(next_time, deadline), delay, deadline]
         else:
+            del self._pending[key]
             logger.error(f"Неожиданный статус запроса: {status}")
             raise Exception(f"Неожиданный статус запроса: {status}")
 
-# Загрузка данных
-def download_parts(token, counter_id, request_id):
-    """Загрузка данных отчета согласно документации"""
-    try:
-        headers = {
-            "Authorization": f"OAuth {token}",
-            "Accept-Encoding": "gzip"  # Поддержка сжатия
-        }
+    def wait(self, keys=None):
+        """
+        Ожидание готовности запросов keys (по умолчанию всех добавленных).
+        Пока ждем, опрашиваются все запросы, у которых подошло время проверки.
+        Возвращает словарь описаний готовых запросов.
+        """
+        keys = list(self._pending) + list(self.ready) + list(self.errors) if keys is None else list(keys)
+        for key in keys:
+            self.add(*key)
         
-        # URL для прямой загрузки данных
-        download_url = f"https://api-metrika.yandex.net/management/v1/counter/{counter_id}/logrequest/{request_id}/part/0/download"
+        while any(key not in self.ready for key in keys):
+            failed = next((key for key in keys if key in self.errors), None)
+            if failed is not None:
+                raise self.errors.pop(failed)
+            # Ближайшая по времени проверка среди всех ожидающих запросов
+            key = min(self._pending, key=lambda pending_key: self._pending[pending_key][0])
+            pause = self._pending[key][0] - time.monotonic()
+            if self.cancel is not None:
+                self.cancel.sleep(max(pause, 0))
+            elif pause > 0:
+                time.sleep(pause)
+            try:
+                self._poll(key)
+            except Exception as e:
+                if key in keys:
+                    raise
+                # Запрос, которого сейчас не ждут: ошибка достанется тому, кто будет его ждать
+                self._pending.pop(key, None)
+                self.errors[key] = e
+        
+        return {key: self.ready[key] for key in keys}
+
+# Проверка статуса готовности запроса
+def wait_for_request_ready(token, counter_id, request_id, timeout=POLL_TIMEOUT, cancel=None):
+    """Ожидание готовности запроса, возвращает описание запроса со списком частей"""
+    poller = LogRequestPoller(token, timeout=timeout, cancel=cancel)
+    key = poller.add(counter_id, request_id)
+    return poller.wait([key])[key]
+
+# Ожидание готовности нескольких запросов
+def wait_for_requests_ready(token, requests_to_wait, timeout=POLL_TIMEOUT, cancel=None):
+    """
+    Ожидание готовности нескольких запросов в одном цикле.
+    requests_to_wait - список пар (counter_id, request_id).
+    Возвращает словарь (counter_id, request_id) -> описание запроса.
+    """
+    poller = LogRequestPoller(token, timeout=timeout, cancel=cancel)
+    keys = [poller.add(counter_id, request_id) for counter_id, request_id in requests_to_wait]
+    return poller.wait(keys)
+
+# Открытие потока с данными части отчета
+def open_part_stream(token, counter_id, request_id, part_number=0, max_attempts=3, offset=0, compressed=True):
+    """
+    Открывает потоковый ответ с TSV данными части отчета (с повторными попытками).
+    offset - запросить данные начиная с этого байта (заголовок Range);
+    если offset не меньше размера части, возвращается ответ 416 (без повторов).
+    compressed=False - запросить данные без сжатия.
+    """
+    headers = {
+        "Authorization": f"OAuth {token}",
+        "Accept-Encoding": "gzip" if compressed else "identity"  # Поддержка сжатия
+    }
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    
+    # URL для прямой загрузки данных
+    download_url = f"{API_BASE_URL}/counter/{counter_id}/logrequest/{request_id}/part/{part_number}/download"
+    
+    logger.info(f"Попытка загрузки данных с URL: {download_url}")
+    
+    for attempt in range(max_attempts):
+        try:
+            logger.info(f"Часть {part_number}: попытка загрузки {attempt + 1}/{max_attempts}")
+            
+            response = session.get(
+                download_url, 
+                headers=headers,
+                stream=True  # Потоковая загрузка для больших файлов
+            )
+            if offset and response.status_code == 416:
+                return response
+            response.raise_for_status()
+            return response
+            
+        except requests.exceptions.RequestException as e:
+            if attempt == max_attempts - 1:
+                raise
+            logger.warning(f"Попытка {attempt + 1} не удалась, повтор через {RETRY_DELAY} секунд")
+            time.sleep(RETRY_DELAY)
+
+def split_tsv_chunk(tail, chunk):
+    """
+    Разбиение очередного блока ответа на строки.
+    Возвращает готовые строки и неполный остаток, который
+    нужно передать вместе со следующим блоком.
+    """
+    if not chunk:
+        return [], tail
+    lines = (tail + chunk).split(b'\n')
+    # Последний фрагмент может быть неполной строкой
+    tail = lines.pop()
+    return [line.decode('utf-8') for line in lines], tail
+
+# Построчное чтение потокового ответа
+def iter_tsv_lines(response, chunk_size=STREAM_CHUNK_SIZE, progress=None, span=None):
+    """
+    Построчное чтение TSV из потокового ответа.
+    gzip распаковывается urllib3 по мере чтения блоков, поэтому
+    в памяти одновременно находится не больше одного блока.
+    progress - функция, которой передается размер каждого прочитанного блока (байт).
+    span - замер этапа download: в него добавляются байты (bytes) и время
+    ожидания блоков (network_seconds).
+    """
+    tail = b''
+    for chunk in iter_response_chunks(response, chunk_size, progress, span):
+        lines, tail = split_tsv_chunk(tail, chunk)
+        yield from lines
+    if tail:
+        yield tail.decode('utf-8')
+
+def iter_response_chunks(response, chunk_size=STREAM_CHUNK_SIZE, progress=None, span=None):
+    """Распакованные блоки потокового ответа с учетом progress и замера span (см. iter_tsv_lines)"""
+    chunks = response.iter_content(chunk_size=chunk_size)
+    if span is not None:
+        chunks = timed_iter(chunks, span, 'network_seconds')
+    for chunk in chunks:
+        if progress is not None:
+            progress(len(chunk))
+        if span is not None:
+            span.add('bytes', len(chunk))
+        yield chunk
+
+# Блоки целых строк для разбора в пуле процессов
+def iter_tsv_blocks(chunks, block_size=PARSE_BLOCK_SIZE):
+    """
+    Склейка блоков ответа или файла в блоки не меньше block_size байт,
+    которые заканчиваются на границе строки. Последний блок может
+    не заканчиваться переводом строки.
+    """
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size < block_size:
+            continue
+        data = b''.join(pending)
+        cut = data.rfind(b'\n') + 1
+        if cut:
+            yield data[:cut]
+            data = data[cut:]
+        pending = [data]
+        pending_size = len(data)
+    data = b''.join(pending)
+    if data:
+        yield data
+
+def iter_pool_rows(blocks, parse_pool, pending_blocks=PARSE_PENDING_BLOCKS):
+    """
+    Генератор LogRow из блоков TSV (первая строка - заголовки): блоки
+    разбираются в пуле процессов parse_pool (parse_tsv_block), строки
+    отдаются в исходном порядке. Одновременно в работе не больше
+    pending_blocks блоков, поэтому память не зависит от размера части.
+    """
+    blocks = iter(blocks)
+    first = next(blocks, b'')
+    header_end = first.find(b'\n')
+    header = (first if header_end < 0 else first[:header_end]).decode('utf-8')
+    if not header:
+        logger.warning("Получен пустой ответ")
+        return
+    columns = header.split('\t')
+    logger.info(f"Получены заголовки: {columns}")
+    index = {column: position for position, column in enumerate(columns)}
+    
+    def tasks():
+        if header_end >= 0 and header_end + 1 < len(first):
+            yield parse_tsv_block, columns, first[header_end + 1:]
+        for block in blocks:
+            yield parse_tsv_block, columns, block
+    
+    for batch in iter_pool_batches(tasks(), parse_pool, pending_blocks):
+        for values in batch:
+            yield LogRow(index, values)
+
+def iter_pool_batches(tasks, parse_pool, pending_blocks=PARSE_PENDING_BLOCKS):
+    """
+    Результаты задач (функция, аргументы...) в пуле parse_pool в порядке задач.
+    Одновременно в работе не больше pending_blocks задач.
+    """
+    pending = collections.deque()
+    try:
+        for task in tasks:
+            pending.append(parse_pool.submit(*task))
+            if len(pending) >= max(1, pending_blocks):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Чтение прервано: задачи, которые еще не начали выполняться, отменяются
+        for future in pending:
+            future.cancel()
+
+# Разбор строк TSV
+def iter_tsv_rows(lines):
+    """Генератор LogRow из строк TSV: первая строка - заголовки"""
+    lines = iter(lines)
+    
+    # Первая строка - заголовки
+    header_line = next(lines, None)
+    if not header_line:
+        logger.warning("Получен пустой ответ")
+        return
+    columns = header_line.split('\t')
+    logger.info(f"Получены заголовки: {columns}")
+    parse_line = make_row_parser(columns)
+    
+    # Остальные строки - данные
+    for line in lines:
+        if not line:
+            continue
+        row = parse_line(line)
+        if row is not None:
+            yield row
+
+# Потоковое чтение строк части отчета
+def iter_part_rows(token, counter_id, request_id, part_number=0, progress=None, trace=None, parse_pool=None):
+    """
+    Генератор строк одной части отчета, строки отдаются по одной.
+    trace - PipelineTrace: для части записываются этапы download (открытие
+    ответа и ожидание данных, bytes) и parse (разбор строк, rows).
+    parse_pool - пул процессов, в котором разбираются блоки ответа (iter_pool_rows).
+    """
+    if trace is None:
+        response = open_part_stream(token, counter_id, request_id, part_number)
+        try:
+            yield from iter_response_rows(response, progress, parse_pool=parse_pool)
+        finally:
+            # Закрываем соединение, даже если чтение прервано
+            response.close()
+        return
+    
+    download = trace.span('download', request_id=request_id, part=part_number)
+    parse = trace.span('parse', request_id=request_id, part=part_number)
+    started = time.perf_counter()
+    response = open_part_stream(token, counter_id, request_id, part_number)
+    open_seconds = time.perf_counter() - started
+    try:
+        rows = iter_response_rows(response, progress, download, parse_pool)
+        yield from timed_iter(rows, parse, 'row_seconds', 'rows')
+    finally:
+        response.close()
+        # Разбор - время в генераторе строк без ожидания данных
+        network_seconds = download.values.pop('network_seconds', 0.0)
+        download.finish(open_seconds + network_seconds)
+        parse.finish(parse.values.pop('row_seconds', 0.0) - network_seconds)
+
+def iter_response_rows(response, progress=None, span=None, parse_pool=None):
+    """Строки из потокового ответа: разбор в текущем потоке или в пуле процессов parse_pool"""
+    if parse_pool is None:
+        return iter_tsv_rows(iter_tsv_lines(response, progress=progress, span=span))
+    chunks = iter_response_chunks(response, progress=progress, span=span)
+    return iter_pool_rows(iter_tsv_blocks(chunks), parse_pool)
+
+# Загрузка части отчета в файл с докачкой
+def download_part_to_file(token, counter_id, request_id, part_number, journal, progress=None, cancel=None,
+                          trace=None, compressed=True):
+    """
+    Загрузка части в файл журнала без распаковки. Если файл уже частично
+    загружен, запрашивается продолжение (Range); если сервер не поддерживает
+    докачку, часть загружается заново. Позиция периодически сохраняется в журнал.
+    trace - PipelineTrace для замера этапа download (bytes - сжатые байты).
+    compressed=False - запросить часть без сжатия (файл можно разбирать через mmap).
+    """
+    with start_span(trace, 'download', request_id=request_id, part=part_number) as span:
+        _download_part_to_file(token, counter_id, request_id, part_number, journal, progress, cancel, span, compressed)
+
+def _download_part_to_file(token, counter_id, request_id, part_number, journal, progress, cancel, span, compressed):
+    path = journal.part_path(part_number)
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    response = open_part_stream(token, counter_id, request_id, part_number, offset=offset, compressed=compressed)
+    try:
+        if offset and response.status_code == 416:
+            # Файл уже дошел до конца части, но процесс остановился до отметки done
+            if content_range_total(response.headers.get("Content-Range")) == offset:
+                journal.update_part(part_number, offset=offset, done=True)
+                logger.info(f"Часть {part_number}: файл уже загружен полностью ({offset} байт)")
+                return
+            logger.info(f"Часть {part_number}: позиция {offset} за концом части, загрузка заново")
+            response.close()
+            offset = 0
+            response = open_part_stream(token, counter_id, request_id, part_number, compressed=compressed)
+        if offset and response.status_code != 206:
+            logger.info(f"Часть {part_number}: сервер не поддерживает докачку, загрузка заново")
+            offset = 0
+        elif offset:
+            logger.info(f"Часть {part_number}: докачка с позиции {offset}")
         
-        logger.info(f"Попытка загрузки данных с URL: {download_url}")
+        encoding = response.headers.get("Content-Encoding", "")
+        if offset:
+            encoding = journal.part_state(part_number).get("encoding", encoding)
+        journal.update_part(part_number, encoding=encoding, offset=offset, done=False)
         
-        all_rows = []
-        max_attempts = 3
+        written = offset
+        saved = offset
+        with open(path, 'ab' if offset else 'wb') as f:
+            # Данные пишутся как есть (сжатыми), распаковка - при чтении
+            for chunk in response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+                f.write(chunk)
+                written += len(chunk)
+                span.add('bytes', len(chunk))
+                if progress is not None:
+                    progress(len(chunk))
+                if cancel is not None:
+                    cancel.check()
+                if written - saved >= JOURNAL_SAVE_BYTES:
+                    f.flush()
+                    journal.update_part(part_number, offset=written)
+                    saved = written
         
-        for attempt in range(max_attempts):
+        journal.update_part(part_number, offset=written, done=True)
+        logger.info(f"Часть {part_number}: загружено {written} байт в {path}")
+    finally:
+        response.close()
+
+def content_range_total(value):
+    """Полный размер из заголовка Content-Range (bytes */N или bytes a-b/N), None если не разобрать"""
+    if not value or '/' not in value:
+        return None
+    try:
+        return int(value.rsplit('/', 1)[1])
+    except ValueError:
+        return None
+
+# Чтение строк из файла части
+def iter_part_file_rows(path, encoding='', parse_pool=None):
+    """
+    Генератор строк из загруженного файла части: gzip распаковывается
+    при чтении, несжатый файл читается через mmap (iter_mmap_rows).
+    parse_pool - пул процессов, в котором разбираются блоки файла.
+    """
+    if encoding != 'gzip':
+        yield from iter_mmap_rows(path, parse_pool)
+        return
+    with gzip.open(path, 'rb') as f:
+        if parse_pool is not None:
+            chunks = iter(lambda: f.read(PARSE_BLOCK_SIZE), b'')
+            yield from iter_pool_rows(iter_tsv_blocks(chunks), parse_pool)
+            return
+        yield from iter_tsv_rows(line.rstrip(b'\n').decode('utf-8') for line in f)
+
+def iter_mmap_rows(path, parse_pool=None, block_size=PARSE_BLOCK_SIZE):
+    """
+    Генератор строк из несжатого файла части через mmap. Файл делится
+    на диапазоны около block_size байт по границам строк (tsv_line_ranges).
+    Без пула диапазоны разбираются в текущем потоке, строки декодируются
+    прямо из отображения файла без промежуточных копий. С пулом процессам
+    передаются только путь и границы диапазонов (parse_tsv_file_range).
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            logger.warning("Получен пустой ответ")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            header_end = mapped.find(b'\n')
+            if header_end < 0:
+                header_end = len(mapped)
+            columns = mapped[:header_end].decode('utf-8').split('\t')
+            logger.info(f"Получены заголовки: {columns}")
+            ranges = tsv_line_ranges(mapped, header_end + 1, block_size)
+            
+            if parse_pool is not None:
+                index = {column: position for position, column in enumerate(columns)}
+                tasks = ((parse_tsv_file_range, path, columns, start, end) for start, end in ranges)
+                for batch in iter_pool_batches(tasks, parse_pool):
+                    for values in batch:
+                        yield LogRow(index, values)
+                return
+            
+            parse_line = make_row_parser(columns)
+            with memoryview(mapped) as view:
+                for start, end in ranges:
+                    with view[start:end] as block:
+                        text = str(block, 'utf-8')
+                    for line in text.split('\n'):
+                        if not line:
+                            continue
+                        row = parse_line(line)
+                        if row is not None:
+                            yield row
+
+def tsv_line_ranges(data, start=0, block_size=PARSE_BLOCK_SIZE):
+    """Границы [start, end) диапазонов около block_size байт, которые заканчиваются на границе строки"""
+    size = len(data)
+    while start < size:
+        end = start + block_size
+        if end < size:
+            newline = data.find(b'\n', end)
+            end = size if newline < 0 else newline + 1
+        else:
+            end = size
+        yield start, end
+        start = end
+
+# Загрузка частей через журнал
+def iter_journal_rows(token, counter_id, request_id, parts, journal, max_workers=DOWNLOAD_WORKERS, progress=None,
+                      cancel=None, trace=None, parse_pool=None, compressed=True):
+    """
+    Загрузка недостающих частей в файлы журнала (параллельно), затем
+    чтение строк из файлов в порядке номеров частей.
+    compressed=False - части запрашиваются без сжатия и разбираются через mmap.
+    """
+    part_numbers = get_part_numbers(token, counter_id, request_id, parts)
+    missing = [part_number for part_number in part_numbers if not journal.is_part_done(part_number)]
+    logger.info(
+        f"Запрос {request_id}: частей {len(part_numbers)}, "
+        f"загружено ранее {len(part_numbers) - len(missing)}"
+    )
+    
+    if missing:
+        workers = max(1, min(max_workers, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() пробрасывает ошибки загрузки
+            list(executor.map(
+                lambda part_number: download_part_to_file(
+                    token, counter_id, request_id, part_number, journal, progress, cancel, trace, compressed
+                ),
+                missing
+            ))
+    
+    for part_number in part_numbers:
+        encoding = journal.part_state(part_number).get("encoding", "")
+        rows = iter_part_file_rows(journal.part_path(part_number), encoding, parse_pool)
+        if trace is None:
+            yield from rows
+            continue
+        parse = trace.span('parse', request_id=request_id, part=part_number)
+        try:
+            yield from timed_iter(rows, parse, 'row_seconds', 'rows')
+        finally:
+            parse.finish(parse.values.pop('row_seconds', 0.0))
+
+# Загрузка одной части отчета
+def download_part(token, counter_id, request_id, part_number=0):
+    """Загрузка одной части отчета в список строк"""
+    rows = list(iter_part_rows(token, counter_id, request_id, part_number))
+    logger.info(f"Часть {part_number}: загружено {len(rows)} строк")
+    return rows
+
+# Номера частей отчета
+def get_part_numbers(token, counter_id, request_id, parts=None):
+    """Номера частей отчета в порядке склейки"""
+    # Список частей берем из описания запроса, если он не передан
+    if parts is None:
+        parts = get_log_request(token, counter_id, request_id).get("parts")
+    return sorted_part_numbers(parts)
+
+def sorted_part_numbers(parts):
+    """Номера частей из списка parts описания запроса"""
+    return sorted(part["part_number"] for part in parts or []) or [0]
+
+# Потоковая загрузка всех частей
+def iter_parts_rows(token, counter_id, request_id, parts=None, max_workers=DOWNLOAD_WORKERS, progress=None,
+                    cancel=None, trace=None, parse_pool=None):
+    """
+    Генератор строк всех частей отчета в порядке номеров частей.
+    Части скачиваются параллельно (не более max_workers потоков), каждая
+    часть пишет строки в свою ограниченную очередь, поэтому объем памяти
+    не зависит от размера отчета.
+    progress - функция, которой передается количество загруженных байт
+    (вызывается из потоков загрузки).
+    cancel - CancelToken: после отмены потоки загрузки останавливаются,
+    соединения закрываются, выбрасывается ReportCancelled.
+    trace - PipelineTrace для замеров загрузки и разбора частей.
+    parse_pool - пул процессов для разбора TSV (см. iter_report_rows).
+    """
+    part_numbers = get_part_numbers(token, counter_id, request_id, parts)
+    logger.info(f"Количество частей для загрузки: {len(part_numbers)}")
+    
+    workers = max(1, min(max_workers, len(part_numbers)))
+    if workers == 1:
+        for part_number in part_numbers:
+            yield from iter_part_rows(token, counter_id, request_id, part_number, progress, trace, parse_pool)
+        return
+    
+    queues = {part_number: queue.Queue(maxsize=STREAM_QUEUE_SIZE) for part_number in part_numbers}
+    stop = threading.Event()
+    end_of_part = object()
+    
+    def put(part_queue, item):
+        # Ожидание места в очереди прерывается, если чтение остановлено
+        while not stop.is_set():
             try:
-                logger.info(f"Попытка загрузки данных {attempt + 1}/{max_attempts}")
-                
-                response = session.get(
-                    download_url, 
-                    headers=headers,
-                    stream=True  # Потоковая загрузка для больших файлов
-                )
-                response.raise_for_status()
-                
-                # Обработка TSV данных построчно
-                lines = response.text.strip().split('\n')
-                if not lines:
-                    logger.warning("Получен пустой ответ")
-                    continue
-                    
-                # Первая строка - заголовки
-                headers = lines[0].split('\t')
-                logger.info(f"Получены заголовки: {headers}")
-                
-                # Остальные строки - данные
-                for line in lines[1:]:
-                    values = line.split('\t')
-                    if len(values) == len(headers):
-                        row = dict(zip(headers, values))
-                        all_rows.append(row)
-                        
-                logger.info(f"Успешно загружено {len(all_rows)} строк")
-                return all_rows
-                
-            except requests.exceptions.RequestException as e:
-                if attempt == max_attempts - 1:
-                    raise
-                logger.warning(f"Попытка {attempt + 1} не удалась, повтор через {RETRY_DELAY} секунд")
-                time.sleep(RETRY_DELAY)
+                part_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce(part_number):
+        part_queue = queues[part_number]
+        if stop.is_set():
+            return
+        rows = iter_part_rows(token, counter_id, request_id, part_number, progress, trace, parse_pool)
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= STREAM_BATCH_ROWS:
+                    if cancel is not None and cancel.cancelled:
+                        return
+                    if not put(part_queue, batch):
+                        return
+                    batch = []
+            if batch and not put(part_queue, batch):
+                return
+            put(part_queue, end_of_part)
+        except Exception as e:
+            put(part_queue, e)
+        finally:
+            # Закрывает соединение части, если загрузка остановлена
+            rows.close()
+    
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for part_number in part_numbers:
+            executor.submit(produce, part_number)
+        
+        for part_number in part_numbers:
+            part_queue = queues[part_number]
+            while True:
+                if cancel is None:
+                    item = part_queue.get()
+                else:
+                    # Ожидание пачки прерывается отменой
+                    try:
+                        item = part_queue.get(timeout=0.5)
+                    except queue.Empty:
+                        cancel.check()
+                        continue
+                    cancel.check()
+                if item is end_of_part:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+# Загрузка данных
+def download_parts(token, counter_id, request_id, parts=None, max_workers=DOWNLOAD_WORKERS):
+    """
+    Загрузка всех частей отчета.
+    Части скачиваются параллельно (не более max_workers потоков)
+    и склеиваются в порядке номеров частей.
+    """
+    try:
+        all_rows = list(iter_parts_rows(token, counter_id, request_id, parts, max_workers))
+        logger.info(f"Успешно загружено {len(all_rows)} строк")
+        return all_rows
                 
     except Exception as e:
         logger.error(f"Ошибка при загрузке данных: {str(e)}")
@@ -452,181 +1465,991 @@ def download_parts(token, counter_id, request_id):
 
 # Удаление запроса после загрузки
 def clean_up_request(token, counter_id, request_id):
-    url = f"https://api-metrika.yandex.net/management/v1/counter/{counter_id}/logrequest/{request_id}"
+    url = f"{API_BASE_URL}/counter/{counter_id}/logrequest/{request_id}"
     headers = {
         "Authorization": f"OAuth {token}",
     }
     response = session.delete(url, headers=headers)
     if response.status_code != 204:
         logger.warning("Не удалось удалить запрос.")
+    
+    # Журнал выгрузки по этому запросу больше не нужен
+    discard_request(counter_id, request_id)
 
-# Основная функция
-def fetch_report(login, token, counter_id, report_type, metrics, date1="7daysAgo", date2="today", attribution="last"):
+def clean_up_request_safely(token, counter_id, request_id):
+    """Удаление запроса без исключений (ошибка только логируется)"""
     try:
-        if not validate_token(token):
-            raise ValueError("Invalid token")
-            
-        # Validate fields and get actual report type
-        actual_report_type = validate_fields(metrics, report_type)
-        if actual_report_type != report_type:
-            logger.info(f"Report type adjusted from {report_type} to {actual_report_type} based on metrics")
-            report_type = actual_report_type
-        
-        # Проверяем формат дат
-        validate_dates(date1, date2)
-        
-        fields = metrics
-        logger.info(f"Начало выгрузки отчета для counter_id: {counter_id}")
-        logger.info(f"Период: с {date1} по {date2}")
-        logger.info(f"Выбранные метрики: {', '.join(fields)}")
+        clean_up_request(token, counter_id, request_id)
+        logger.info(f"Запрос {request_id} успешно очищен")
+    except Exception as e:
+        logger.warning(f"Ошибка при очистке запроса: {str(e)}")
+
+# Отмена запроса, который еще готовится
+def cancel_log_request(token, counter_id, request_id):
+    """Отмена запроса в статусе created/processing (освобождает квоту без ожидания подготовки)"""
+    url = f"{API_BASE_URL}/counter/{counter_id}/logrequest/{request_id}/cancel"
+    headers = {
+        "Authorization": f"OAuth {token}",
+    }
+    response = session.post(url, headers=headers, timeout=30)
+    response.raise_for_status()
+    
+    # Журнал выгрузки по этому запросу больше не нужен
+    discard_request(counter_id, request_id)
+
+def cancel_log_request_safely(token, counter_id, request_id):
+    """Отмена запроса без исключений (ошибка только логируется)"""
+    try:
+        cancel_log_request(token, counter_id, request_id)
+        logger.info(f"Запрос {request_id} отменен")
+    except Exception as e:
+        logger.warning(f"Ошибка при отмене запроса: {str(e)}")
+
+# Проверка параметров отчета
+def validate_report_params(token, report_type, metrics, date1, date2):
+    """Проверка токена, полей и дат, возвращает фактический тип отчета"""
+    if not validate_token(token):
+        raise ValueError("Invalid token")
         
+    # Validate fields and get actual report type
+    actual_report_type = validate_fields(metrics, report_type)
+    if actual_report_type != report_type:
+        logger.info(f"Report type adjusted from {report_type} to {actual_report_type} based on metrics")
+    
+    # Проверяем формат дат
+    validate_dates(date1, date2)
+    return actual_report_type
+
+# Разбиение периода на интервалы
+def split_date_range(date1, date2, chunk_days):
+    """Разбиение периода на интервалы не длиннее chunk_days дней (в формате YYYY-MM-DD)"""
+    if chunk_days < 1:
+        raise ValueError("Размер интервала должен быть не меньше одного дня")
+    
+    start_date = parse_date(date1)
+    end_date = parse_date(date2)
+    chunks = []
+    while start_date <= end_date:
+        chunk_end = min(start_date + timedelta(days=chunk_days - 1), end_date)
+        chunks.append((start_date.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+        start_date = chunk_end + timedelta(days=1)
+    return chunks
+
+# Строки отчета по интервалам дат
+def iter_report_rows(token, counter_id, fields, date1, date2, attribution="last", max_workers=DOWNLOAD_WORKERS,
+                     chunk_days="auto", max_concurrent_requests=MAX_CONCURRENT_REQUESTS, resume=False,
+                     journal_dir=JOURNAL_DIR, reuse_requests=True, progress=None, cancel=None, trace=None,
+                     parse_workers=0, spool=None, clean_up_reused=False):
+    """
+    Генератор строк отчета за период (параметры уже проверены).
+    
+    Если задан chunk_days, период разбивается на интервалы, по каждому
+    создается отдельный запрос. Запросы готовятся на стороне API параллельно
+    (не более max_concurrent_requests одновременно), их статусы опрашиваются
+    в одном цикле (LogRequestPoller), а строки отдаются в порядке дат.
+    Каждый запрос очищается сразу после загрузки.
+    
+    chunk_days="auto" - размер интервала выбирается по оценке API
+    (plan_chunk_days): допустимое количество дней делится между
+    max_concurrent_requests запросами, которые готовятся одновременно.
+    None - один запрос на весь период без оценки.
+    
+    resume=True - вести журнал выгрузки (JobJournal) в journal_dir: части
+    сохраняются на диск, а при повторном запуске после сбоя используется
+    уже созданный запрос и докачиваются только недостающие части.
+    При ошибке запросы в этом режиме не очищаются.
+    
+    reuse_requests=True - перед созданием запроса искать среди существующих
+    запросов счетчика (list_log_requests) готовый или готовящийся запрос
+    с теми же полями, датами и атрибуцией (например, оставшийся после сбоя
+    или созданный коллегой) и загружать его. Очищаются и отменяются только
+    запросы, созданные этой выгрузкой: чужой запрос после загрузки остается
+    на стороне API, если не передан clean_up_reused=True.
+    
+    progress - функция, которой передается количество загруженных байт.
+    
+    cancel - CancelToken: при отмене выбрасывается ReportCancelled, потоки
+    загрузки останавливаются, готовящиеся запросы отменяются на стороне API
+    (cancel_log_request), а готовые очищаются - в том числе в режиме resume.
+    
+    trace - PipelineTrace: замеры этапов create, poll (polls - число
+    проверок статуса), download и parse.
+    
+    parse_workers - разбирать TSV в пуле из parse_workers процессов
+    (create_parse_pool): потоки загрузки передают процессам блоки байт
+    по PARSE_BLOCK_SIZE, обратно приходят пачки кортежей значений.
+    0 - разбор в потоках загрузки.
+    
+    spool - сначала сохранить все части запроса в файлы журнала в journal_dir
+    без распаковки, затем разобрать их (включает resume: если разбор прерван,
+    при повторном запуске части не загружаются заново). "gzip" - части
+    хранятся сжатыми, как их отдает API (resume=True делает то же самое);
+    "plain" - части запрашиваются без сжатия и разбираются через mmap
+    диапазонами по границам строк (iter_mmap_rows).
+    """
+    if spool is not None and spool not in SPOOL_FORMATS:
+        raise ValueError(f"Неизвестный формат spool: {spool}. Допустимые значения: {', '.join(SPOOL_FORMATS)}")
+    resume = resume or spool is not None
+    # Относительные даты (yesterday, 7daysAgo) фиксируются в начале выгрузки:
+    # по ним строятся ключ журнала и поиск существующего запроса, и повторный
+    # запуск на следующий день не должен подхватить запрос за другой период
+    date1 = parse_date(date1).strftime("%Y-%m-%d")
+    date2 = parse_date(date2).strftime("%Y-%m-%d")
+    if cancel is not None:
+        cancel.check()
+    if chunk_days == "auto":
         try:
-            request_id = create_log_request(
-                token=token, 
-                counter_id=counter_id, 
-                fields=fields, 
-                date1=date1, 
-                date2=date2,
-                attribution=attribution
+            chunk_days, max_concurrent_requests = plan_chunk_days(
+                token, counter_id, fields, date1, date2, max(1, max_concurrent_requests)
             )
-            logger.info(f"Создан запрос с ID: {request_id}, атрибуция: {ATTRIBUTION_TYPES[attribution]}")
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка при создании запроса: {str(e)}")
-            raise
-
+            # Без оценки пробуем выгрузить период одним запросом
+            logger.warning(f"Не удалось оценить запрос: {str(e)}")
+            chunk_days = None
+    
+    if chunk_days:
+        chunks = split_date_range(date1, date2, chunk_days)
+    else:
+        chunks = [(date1, date2)]
+    logger.info(f"Количество запросов для периода {date1} - {date2}: {len(chunks)}")
+    
+    poller = LogRequestPoller(token, cancel=cancel)
+    parse_pool = create_parse_pool(parse_workers)
+    request_ids = []  # ID запросов в порядке интервалов
+    journals = []     # журналы интервалов (в режиме resume)
+    created = set()   # ID запросов, созданных этой выгрузкой (в том числе до сбоя)
+    consumed = 0
+    existing_requests = None  # существующие запросы счетчика (читаются один раз)
+    
+    def existing_request(chunk_date1, chunk_date2):
+        nonlocal existing_requests
+        if existing_requests is None:
+            try:
+                existing_requests = list_log_requests(token, counter_id)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Не удалось получить список запросов счетчика: {str(e)}")
+                existing_requests = []
+        request_id = find_log_request(
+            [log_request for log_request in existing_requests if log_request.get("request_id") not in request_ids],
+            fields, chunk_date1, chunk_date2, attribution
+        )
+        if request_id is not None:
+            logger.info(f"Используется существующий запрос {request_id} ({chunk_date1} - {chunk_date2})")
+        return request_id
+    
+    def resumable_request(journal):
+        # Запрос из журнала используется, если он еще существует на стороне API
+        if journal.request_id is None:
+            return None
         try:
-            wait_for_request_ready(token, counter_id, request_id)
-            logger.info("Данные готовы к загрузке")
-        except Exception as e:
-            logger.error(f"Ошибка при ожидании готовности данных: {str(e)}")
-            raise
+            status = get_log_request(token, counter_id, journal.request_id)["status"]
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Запрос {journal.request_id} из журнала недоступен: {str(e)}")
+            return None
+        if status in ("created", "processing", "processed"):
+            logger.info(f"Продолжение выгрузки по запросу {journal.request_id} (статус {status})")
+            if journal.request_created:
+                created.add(journal.request_id)
+            return journal.request_id
+        logger.info(f"Запрос {journal.request_id} из журнала в статусе {status}, будет создан новый")
+        return None
+    
+    def fill_window():
+        # Держим не больше max_concurrent_requests запросов, готовящихся на стороне API
+        while len(request_ids) < len(chunks) and len(request_ids) - consumed < max(1, max_concurrent_requests):
+            if cancel is not None:
+                cancel.check()
+            chunk_date1, chunk_date2 = chunks[len(request_ids)]
+            journal = None
+            request_id = None
+            if resume:
+                journal = JobJournal.open(counter_id, fields, chunk_date1, chunk_date2, attribution, journal_dir)
+                request_id = resumable_request(journal)
+            if request_id is None and reuse_requests:
+                request_id = existing_request(chunk_date1, chunk_date2)
+                if request_id is not None and journal is not None:
+                    journal.set_request(request_id, created=False)
+            if request_id is None:
+                with start_span(trace, 'create', date1=chunk_date1, date2=chunk_date2) as span:
+                    request_id = create_log_request(
+                        token=token,
+                        counter_id=counter_id,
+                        fields=fields,
+                        date1=chunk_date1,
+                        date2=chunk_date2,
+                        attribution=attribution
+                    )
+                    span.label(request_id=request_id)
+                logger.info(f"Создан запрос с ID: {request_id}, атрибуция: {ATTRIBUTION_TYPES[attribution]}")
+                created.add(request_id)
+                if journal is not None:
+                    journal.set_request(request_id)
+            request_ids.append(request_id)
+            journals.append(journal)
+            poller.add(counter_id, request_id)
+    
+    def releasable(request_id):
+        # Чужие запросы, найденные через reuse_requests, не трогаем без явной просьбы
+        return clean_up_reused or request_id in created
+    
+    try:
+        while consumed < len(chunks):
+            fill_window()
+            request_id = request_ids[consumed]
+            journal = journals[consumed]
+            # Пока ждем текущий интервал, опрашиваются и следующие
+            key = (counter_id, request_id)
+            with start_span(trace, 'poll', request_id=request_id) as span:
+                poll_count = poller.poll_count
+                log_request = poller.wait([key])[key]
+                span.set(polls=poller.poll_count - poll_count)
+            poller.discard(counter_id, request_id)
+            chunk_date1, chunk_date2 = chunks[consumed]
+            consumed += 1
+            logger.info(f"Данные запроса {request_id} ({chunk_date1} - {chunk_date2}) готовы к загрузке")
+            
+            if journal is not None:
+                journal.set_status("processed")
+                rows = iter_journal_rows(
+                    token, counter_id, request_id, log_request.get("parts"), journal, max_workers, progress, cancel,
+                    trace, parse_pool, compressed=spool != 'plain'
+                )
+            else:
+                rows = iter_parts_rows(
+                    token, counter_id, request_id, log_request.get("parts"), max_workers, progress, cancel, trace,
+                    parse_pool
+                )
+            
+            completed = False
+            try:
+                row_count = 0
+                for row in rows:
+                    row_count += 1
+                    if cancel is not None and not row_count % STREAM_BATCH_ROWS:
+                        cancel.check()
+                    yield row
+                logger.info(f"Запрос {request_id}: загружено {row_count} строк данных")
+                completed = True
+            finally:
+                rows.close()
+                # В режиме resume незавершенный запрос сохраняется для повторного запуска
+                if completed or journal is None or (cancel is not None and cancel.cancelled):
+                    if releasable(request_id):
+                        clean_up_request_safely(token, counter_id, request_id)
+                    if journal is not None:
+                        journal.remove()
+        logger.info(f"Проверок статуса запросов: {poller.poll_count}")
+    finally:
+        # Запросы, до которых не дошла загрузка: готовые очищаются,
+        # готовящиеся отменяются, чтобы сразу освободить квоту
+        if not resume or (cancel is not None and cancel.cancelled):
+            for request_id, journal in zip(request_ids[consumed:], journals[consumed:]):
+                if releasable(request_id):
+                    if (counter_id, request_id) in poller.ready:
+                        clean_up_request_safely(token, counter_id, request_id)
+                    else:
+                        cancel_log_request_safely(token, counter_id, request_id)
+                if journal is not None:
+                    journal.remove()
+        if parse_pool is not None:
+            parse_pool.shutdown(wait=True)
 
-        try:
-            data = download_parts(token, counter_id, request_id)
-            logger.info(f"Загружено {len(data) if data else 0} строк данных")
-        except Exception as e:
-            logger.error(f"Ошибка при загрузке данных: {str(e)}")
-            raise
+def create_parse_pool(parse_workers):
+    """
+    Пул процессов для разбора TSV или None, если parse_workers=0.
+    Процессы запускаются методом spawn на всех платформах: загрузка идет
+    в потоках, а fork многопоточного процесса может зависнуть на блокировке,
+    захваченной другим потоком. Поэтому скрипт, который вызывает выгрузку
+    с parse_workers, должен запускать ее под if __name__ == "__main__".
+    """
+    if not parse_workers:
+        return None
+    return ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context('spawn'))
+
+# Получение списка целей счетчика
+def get_counter_goals(token, counter_id):
+    """
+    Список ID целей счетчика из API управления (включая шаги составных целей).
+    Результат кешируется в metadata_cache.
+    """
+    def load():
+        url = f"{API_BASE_URL}/counter/{counter_id}/goals"
+        headers = {
+            "Authorization": f"OAuth {token}",
+        }
+        response = session.get(url, headers=headers, timeout=30)
+        response.raise_for_status()
+        return parse_counter_goals(response.json())
+    
+    goals_ids = metadata_cache.cached(token, f"goals_{counter_id}", load)
+    logger.info(f"Получено целей счетчика: {len(goals_ids)}")
+    return goals_ids
 
+def parse_counter_goals(payload):
+    """ID целей из ответа API управления, включая шаги составных целей"""
+    goals_ids = []
+    pending = list(payload.get("goals", []))
+    while pending:
+        goal = pending.pop()
+        goals_ids.append(str(goal["id"]))
+        pending.extend(goal.get("steps") or [])
+    return sorted(goals_ids)
+
+# Дни младше этого возраста не кешируются: Метрика еще может дописать данные
+CACHE_MIN_AGE_DAYS = 2
+
+def format_tsv_value(value):
+    """Значение LogRow обратно в строку TSV (None - пустая строка)"""
+    if value is None:
+        return ''
+    return str(value)
+
+def project_rows(rows, fields):
+    """
+    Строки в порядке полей fields. Файл дня в кеше общий для любого порядка
+    полей, а найденный существующий запрос (reuse_requests) может иметь
+    другой порядок полей, поэтому порядок проверяется для каждой части:
+    строки одной части используют общий словарь позиций.
+    """
+    fields = list(fields)
+    index = {field: position for position, field in enumerate(fields)}
+    last_index, in_order = None, False
+    for row in rows:
+        row_index = getattr(row, '_index', None)
+        if row_index is None or row_index is not last_index:
+            last_index, in_order = row_index, list(row.keys()) == fields
+        yield row if in_order else LogRow(index, tuple(row[field] for field in fields))
+
+def iter_cached_report_rows(token, counter_id, fields, date1, date2, attribution="last", cache=None, **options):
+    """
+    Генератор строк отчета с локальным кешем по дням (DayCache).
+    
+    Дни, которые уже есть в кеше, читаются с диска, за остальные
+    (непрерывными отрезками) создаются запросы через iter_report_rows,
+    а полученные строки раскладываются в кеш по значению поля даты.
+    Кешируются только закрытые дни (старше CACHE_MIN_AGE_DAYS) и только
+    если среди полей есть дата визита или просмотра. День попадает
+    в кеш, только если его отрезок загружен полностью.
+    """
+    if cache is None:
+        cache = DayCache()
+    date_field = next((field for field in fields if field_base_name(field) == 'date'), None)
+    if date_field is None:
+        logger.info("Среди полей нет даты, кеш не используется")
+        yield from iter_report_rows(token, counter_id, fields, date1, date2, attribution, **options)
+        return
+    
+    start_date = parse_date(date1)
+    end_date = parse_date(date2)
+    last_cached_date = counter_today(token, counter_id) - timedelta(days=CACHE_MIN_AGE_DAYS)
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    
+    def cached_path(day):
+        if day > last_cached_date:
+            return None
+        return cache.find(counter_id, fields, day, attribution)
+    
+    paths = {day: cached_path(day) for day in days}
+    logger.info(f"Дней в кеше: {sum(1 for path in paths.values() if path)} из {len(days)}")
+    
+    for cached, group in itertools.groupby(days, key=lambda day: paths[day] is not None):
+        group = list(group)
+        if cached:
+            for day in group:
+                yield from project_rows(iter_tsv_rows(cache.iter_lines(paths[day])), fields)
+            continue
+        
+        writers = {day: cache.writer(counter_id, fields, day, attribution)
+                   for day in group if day <= last_cached_date}
+        completed = False
         try:
-            clean_up_request(token, counter_id, request_id)
-            logger.info("Запрос успешно очищен")
-        except Exception as e:
-            logger.warning(f"Ошибка при очистке запроса: {str(e)}")
+            header_written = False
+            rows = iter_report_rows(token, counter_id, fields, group[0].strftime("%Y-%m-%d"),
+                                    group[-1].strftime("%Y-%m-%d"), attribution, **options)
+            for row in project_rows(rows, fields):
+                if writers:
+                    if not header_written:
+                        header = '\t'.join(fields)
+                        for writer in writers.values():
+                            writer.write_line(header)
+                        header_written = True
+                    day = row[date_field]
+                    writer = writers.get(parse_date(day) if isinstance(day, str) else day)
+                    if writer is not None:
+                        writer.write_line('\t'.join(format_tsv_value(row[field]) for field in fields))
+                yield row
+            if not header_written:
+                # Пустой день тоже кешируется, чтобы не запрашивать его повторно
+                for writer in writers.values():
+                    writer.write_line('\t'.join(fields))
+            completed = True
+        finally:
+            for writer in writers.values():
+                if completed:
+                    writer.commit()
+                else:
+                    writer.discard()
+        if writers:
+            logger.info(f"В кеш сохранено дней: {len(writers)}")
+    
+    cache.evict()
 
+# Основная функция
+def fetch_report(login, token, counter_id, report_type, metrics, date1="7daysAgo", date2="today", attribution="last",
+                 max_workers=DOWNLOAD_WORKERS, chunk_days="auto", max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                 resume=False, use_cache=False, reuse_requests=True, progress=None, cancel=None, trace=None,
+                 parse_workers=0, spool=None, journal_dir=JOURNAL_DIR, clean_up_reused=False):
+    """
+    Выгрузка отчета в список строк.
+    chunk_days - разбить период на интервалы и готовить их параллельно
+    ("auto" - размер интервала по оценке API, None - без разбиения).
+    resume - вести журнал выгрузки и продолжать ее после сбоя.
+    use_cache - брать закрытые дни из локального кеша и запрашивать только недостающие
+    (True или экземпляр DayCache).
+    reuse_requests - загружать подходящий существующий запрос вместо создания нового.
+    clean_up_reused - очищать и найденные существующие запросы (по умолчанию
+    очищаются только созданные этой выгрузкой).
+    progress - функция, которой передается количество загруженных байт.
+    cancel - CancelToken для отмены выгрузки на любом этапе (выбрасывается ReportCancelled).
+    trace - PipelineTrace для замеров этапов выгрузки (timings.py).
+    parse_workers - количество процессов для разбора TSV (0 - разбор в потоках загрузки).
+    spool - сначала сохранить части на диск без распаковки ("gzip" или "plain"), затем разобрать.
+    journal_dir - каталог журнала и файлов частей (resume, spool).
+    """
+    try:
+        data = list(fetch_report_stream(
+            login, token, counter_id, report_type, metrics, date1, date2, attribution,
+            max_workers=max_workers,
+            chunk_days=chunk_days,
+            max_concurrent_requests=max_concurrent_requests,
+            resume=resume,
+            use_cache=use_cache,
+            reuse_requests=reuse_requests,
+            progress=progress,
+            cancel=cancel,
+            trace=trace,
+            parse_workers=parse_workers,
+            spool=spool,
+            journal_dir=journal_dir,
+            clean_up_reused=clean_up_reused
+        ))
+        logger.info(f"Загружено {len(data) if data else 0} строк данных")
         return data
 
     except Exception as e:
         logger.error(f"Критическая ошибка в fetch_report: {str(e)}")
         raise
 
+# Потоковая выгрузка отчета
+def fetch_report_stream(login, token, counter_id, report_type, metrics, date1="7daysAgo", date2="today",
+                        attribution="last", max_workers=DOWNLOAD_WORKERS, chunk_days="auto",
+                        max_concurrent_requests=MAX_CONCURRENT_REQUESTS, resume=False, use_cache=False,
+                        reuse_requests=True, progress=None, cancel=None, trace=None, parse_workers=0, spool=None,
+                        journal_dir=JOURNAL_DIR, clean_up_reused=False):
+    """
+    Потоковый вариант fetch_report: генератор строк отчета.
+    Данные не накапливаются в памяти, созданные запросы очищаются после
+    чтения (в том числе если чтение прервано).
+    """
+    try:
+        validate_report_params(token, report_type, metrics, date1, date2)
+    except Exception as e:
+        logger.error(f"Критическая ошибка в fetch_report_stream: {str(e)}")
+        raise
+    
+    fields = metrics
+    logger.info(f"Начало выгрузки отчета для counter_id: {counter_id}")
+    logger.info(f"Период: с {date1} по {date2}")
+    logger.info(f"Выбранные метрики: {', '.join(fields)}")
+    
+    options = {
+        'max_workers': max_workers,
+        'chunk_days': chunk_days,
+        'max_concurrent_requests': max_concurrent_requests,
+        'resume': resume,
+        'reuse_requests': reuse_requests,
+        'progress': progress,
+        'cancel': cancel,
+        'trace': trace,
+        'parse_workers': parse_workers,
+        'spool': spool,
+        'journal_dir': journal_dir,
+        'clean_up_reused': clean_up_reused,
+    }
+    if use_cache:
+        # Вместо True можно передать свой DayCache (другой каталог или размер)
+        cache = use_cache if isinstance(use_cache, DayCache) else None
+        yield from iter_cached_report_rows(token, counter_id, fields, date1, date2, attribution, cache=cache, **options)
+    else:
+        yield from iter_report_rows(token, counter_id, fields, date1, date2, attribution, **options)
+
+# Поле с ID целей
+GOALS_FIELD = 'ym:s:goalsID'
+
+# Очистка заголовка
+def clean_header(header, attribution='last'):
+    """Убирает префиксы ym:s: и ym:pv: и заменяет <attribution> на значение атрибуции"""
+    # Убираем префиксы ym:s: и ym:pv:
+    header = header.replace('ym:s:', '').replace('ym:pv:', '')
+    # Заменяем <attribution> на значение атрибуции
+    return header.replace('<attribution>', attribution)
+
+# Разбор списка целей
+def parse_goals(value):
+    """Разбор значения вида [1,2,3] в список ID целей"""
+    # Удаляем квадратные скобки и пробелы, разделяем по запятой
+    ids = value.strip('[]').replace(' ', '').split(',')
+    # Оставляем только непустые ID
+    return [goal_id for goal_id in ids if goal_id]
+
+# Столбцы целей
+def goal_columns(goals_ids):
+    """Заголовки столбцов целей и индекс: ID цели -> позиция столбца"""
+    ordered_ids = sorted(str(goal_id) for goal_id in goals_ids)
+    goals_headers = [f"goalsID_{goal_id}" for goal_id in ordered_ids]
+    goal_index = {goal_id: position for position, goal_id in enumerate(ordered_ids)}
+    return goals_headers, goal_index
+
+# Развертывание целей строки в столбцы
+def expand_goals(value, goal_index, empty_flags):
+    """
+    Отметки целей одной строки: '1' для достигнутых целей, '--' для остальных.
+    Список целей строки разбирается один раз, позиция столбца ищется по индексу.
+    """
+    flags = list(empty_flags)
+    if value:
+        for goal_id in parse_goals(value):
+            position = goal_index.get(goal_id)
+            if position is not None:
+                flags[position] = '1'
+    return flags
+
+# Предварительный проход по данным
+def scan_rows(rows, spool=None, collect_goals=True):
+    """
+    Один проход по строкам: собирает заголовки, ID целей и столбцы,
+    в которых есть хотя бы одно непустое значение.
+    Если передан spool (csv.writer), строки дописываются в него.
+    """
+    headers = None
+    goals_ids = set()
+    used_columns = set()
+    row_count = 0
+    
+    for row in rows:
+        if headers is None:
+            # Заголовки берем из первой строки данных
+            headers = list(row.keys())
+            if spool is not None:
+                spool.writerow(headers)
+        
+        if collect_goals and GOALS_FIELD in row and row[GOALS_FIELD]:
+            goals_ids.update(parse_goals(row[GOALS_FIELD]))
+        
+        for header in headers:
+            value = row[header]
+            if value is not None and value != '':
+                used_columns.add(header)
+        
+        if spool is not None:
+            spool.writerow([row[header] for header in headers])
+        row_count += 1
+    
+    return headers, goals_ids, used_columns, row_count
+
+# Запись CSV
+def write_csv(rows, filepath, headers, goals_ids, used_columns=None, attribution='last', span=None):
+    """
+    Запись строк в CSV с очисткой заголовков и столбцами целей.
+    used_columns - исходные столбцы, которые попадут в файл (по умолчанию все).
+    filepath - путь или открытый текстовый файл (например, stdout).
+    span - замер этапа save, в него записывается количество столбцов.
+    Возвращает количество записанных строк.
+    """
+    # Очищаем заголовки от префиксов и заменяем <attribution> на значение атрибуции
+    clean_headers = [clean_header(header, attribution) for header in headers]
+    
+    # Определяем только те заголовки, которые реально используются в данных
+    data_columns = {}
+    for old_key, new_key in zip(headers, clean_headers):
+        if used_columns is None or old_key in used_columns:
+            data_columns[new_key] = old_key
+    data_headers = sorted(data_columns)
+    source_columns = [data_columns[header] for header in data_headers]
+    
+    # Столбцы целей идут в конце
+    goals_headers, goal_index = goal_columns(goals_ids)
+    empty_flags = ['--'] * len(goals_headers)
+    has_goals = bool(goals_headers) and GOALS_FIELD in headers
+    used_headers = data_headers + goals_headers
+    
+    row_count = 0
+    # Записываем в CSV только используемые заголовки и непустые данные
+    if hasattr(filepath, 'write'):
+        output = contextlib.nullcontext(filepath)
+    else:
+        output = open(filepath, 'w', encoding='utf-8', newline='')
+    with output as f:
+        # Используем другой диалект CSV для лучшей совместимости с DataLens
+        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL)
+        
+        # Записываем заголовки в первую строку
+        writer.writerow(used_headers)
+        
+        # Записываем данные построчно, в том же порядке, что и заголовки
+        for row in rows:
+            row_values = [row[column] for column in source_columns]
+            if None in row_values:
+                row_values = ['' if value is None else value for value in row_values]
+            if goals_headers:
+                goals_value = row[GOALS_FIELD] if has_goals else ''
+                row_values.extend(expand_goals(goals_value, goal_index, empty_flags))
+            writer.writerow(row_values)
+            row_count += 1
+    
+    logger.info(f"Данные успешно сохранены в {getattr(filepath, 'name', filepath)}")
+    logger.info(f"Количество столбцов в файле: {len(used_headers)}")
+    logger.info(f"Добавлено столбцов целей: {len(goals_headers)}")
+    if span is not None:
+        span.set(columns=len(used_headers))
+    return row_count
+
 # Сохранение в CSV
-def save_to_csv(data, filepath, attribution='last'):
-    """Сохранение данных в CSV файл с очисткой заголовков и подстановкой атрибуции"""
+def save_to_csv(data, filepath, attribution='last', goals_ids=None):
+    """
+    Сохранение данных в CSV файл с очисткой заголовков и подстановкой атрибуции.
+    goals_ids - известный список целей (например, из get_counter_goals),
+    без него цели собираются предварительным проходом по данным.
+    """
     try:
         if not data:
             logger.warning("Нет данных для сохранения")
             return
-            
-        # Получаем заголовки из первой строки данных
-        headers = list(data[0].keys())
         
-        # Очищаем заголовки от префиксов и заменяем <attribution> на значение атрибуции
-        clean_headers = []
-        for header in headers:
-            # Убираем префиксы ym:s: и ym:pv:
-            header = header.replace('ym:s:', '').replace('ym:pv:', '')
-            # Заменяем <attribution> на значение атрибуции
-            header = header.replace('<attribution>', attribution)
-            clean_headers.append(header)
-        
-        # Создаем новый список словарей с очищенными заголовками
-        clean_data = []
-        
-        # Собираем все уникальные ID целей
-        goals_ids = set()
-        goals_field = 'ym:s:goalsID'  # Поле с ID целей
-        
-        for row in data:
-            if goals_field in row and row[goals_field]:
-                # Удаляем квадратные скобки и пробелы, разделяем по запятой
-                ids = row[goals_field].strip('[]').replace(' ', '').split(',')
-                # Добавляем только непустые ID
-                goals_ids.update(id for id in ids if id)
-        
-        # Добавляем новые заголовки для каждого ID цели
-        goals_headers = [f"goalsID_{goal_id}" for goal_id in sorted(goals_ids)]
-        all_headers = clean_headers + goals_headers
-        
-        # Обрабатываем данные с учетом новых столбцов целей
-        for row in data:
-            clean_row = {}
-            # Копируем основные данные
-            for old_key, new_key in zip(headers, clean_headers):
-                clean_row[new_key] = row[old_key]
-            
-            # Обрабатываем цели
-            if goals_field in row and row[goals_field]:
-                current_goals = row[goals_field].strip('[]').replace(' ', '').split(',')
-                for goal_id in goals_ids:
-                    field_name = f"goalsID_{goal_id}"
-                    clean_row[field_name] = '1' if goal_id in current_goals else '--'
-            else:
-                # Если поле целей отсутствует или пустое, заполняем все столбцы целей значением '--'
-                for goal_id in goals_ids:
-                    field_name = f"goalsID_{goal_id}"
-                    clean_row[field_name] = '--'
-            
-            clean_data.append(clean_row)
-        
-        # Очищаем данные от пустых значений
-        clean_data_no_empty = []
-        for row in clean_data:
-            row_no_empty = {k: v for k, v in row.items() if v is not None and v != ''}
-            clean_data_no_empty.append(row_no_empty)
-        
-        # Определяем только те заголовки, которые реально используются в данных
-        used_headers = set()
-        for row in clean_data_no_empty:
-            used_headers.update(row.keys())
-        used_headers = list(used_headers)
-        
-        # Сортируем заголовки, чтобы столбцы целей шли в конце
-        used_headers.sort(key=lambda x: (x.startswith('goalsID_'), x))        # Записываем в CSV только используемые заголовки и непустые данные
-        with open(filepath, 'w', encoding='utf-8', newline='') as f:
-            # Используем другой диалект CSV для лучшей совместимости с DataLens
-            writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-            
-            # Записываем заголовки в первую строку
-            writer.writerow(used_headers)
-            
-            # Записываем данные построчно
-            for row in clean_data_no_empty:
-                # Для каждой строки записываем значения в том же порядке, что и заголовки
-                row_values = [row.get(header, '') for header in used_headers]
-                writer.writerow(row_values)
-            
-        logger.info(f"Данные успешно сохранены в {filepath}")
-        logger.info(f"Количество столбцов в файле: {len(used_headers)}")
-        logger.info(f"Добавлено столбцов целей: {len(goals_headers)}")
+        headers, found_goals, used_columns, row_count = scan_rows(data, collect_goals=goals_ids is None)
+        if goals_ids is None:
+            goals_ids = found_goals
+        write_csv(data, filepath, headers, goals_ids, used_columns, attribution)
         
     except Exception as e:
         logger.error(f"Ошибка при сохранении в CSV: {str(e)}")
         raise
 
-# Валидация токена
-def validate_token(token):
+# Потоковое сохранение в CSV
+def save_stream_to_csv(rows, filepath, attribution='last', goals_ids=None, drop_empty_columns=True, trace=None):
+    """
+    Сохранение потока строк в CSV без накопления данных в памяти.
+    
+    Если список целей передан и пустые столбцы удалять не нужно, строки
+    пишутся за один проход. Иначе столбцы целей и пустые столбцы известны
+    только после полного прохода, поэтому строки сначала пишутся во
+    временный файл рядом с результатом.
+    trace - PipelineTrace для замера этапа save (rows, columns); время
+    ожидания строк от загрузки в длительность этапа не входит.
+    Возвращает количество сохраненных строк.
+    """
+    span = start_span(trace, 'save', format='csv')
+    if trace is not None:
+        rows = timed_iter(rows, span, exclude=True)
+    with span:
+        row_count = _save_stream_to_csv(rows, filepath, attribution, goals_ids, drop_empty_columns, span)
+        span.set(rows=row_count)
+    return row_count
+
+def _save_stream_to_csv(rows, filepath, attribution, goals_ids, drop_empty_columns, span):
+    if goals_ids is not None and not drop_empty_columns:
+        try:
+            rows = iter(rows)
+            first_row = next(rows, None)
+            if first_row is None:
+                logger.warning("Нет данных для сохранения")
+                return 0
+            headers = list(first_row.keys())
+            return write_csv(
+                itertools.chain([first_row], rows), filepath, headers, goals_ids, None, attribution, span
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении в CSV: {str(e)}")
+            raise
+    
+    # Временный файл - рядом с результатом (для открытого файла - во временном каталоге)
+    spool_dir = None if hasattr(filepath, 'write') else os.path.dirname(os.path.abspath(filepath))
+    fd, spool_path = tempfile.mkstemp(prefix='.metrika_', suffix='.tmp', dir=spool_dir)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as spool_file:
+            headers, found_goals, used_columns, row_count = scan_rows(
+                rows, csv.writer(spool_file), collect_goals=goals_ids is None
+            )
+        
+        if not row_count:
+            logger.warning("Нет данных для сохранения")
+            return 0
+        if goals_ids is None:
+            goals_ids = found_goals
+        if not drop_empty_columns:
+            used_columns = None
+        
+        with open(spool_path, 'r', encoding='utf-8', newline='') as spool_file:
+            reader = csv.reader(spool_file)
+            next(reader)  # заголовки уже известны
+            spooled_rows = (dict(zip(headers, values)) for values in reader)
+            write_csv(spooled_rows, filepath, headers, goals_ids, used_columns, attribution, span)
+        
+        return row_count
+        
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении в CSV: {str(e)}")
+        raise
+    finally:
+        os.remove(spool_path)
+
+# Потоковая выгрузка отчета в CSV
+def export_report_to_csv(filepath, login, token, counter_id, report_type, metrics, date1="7daysAgo",
+                         date2="today", attribution="last", goals_ids=None, use_counter_goals=False,
+                         drop_empty_columns=True, **options):
+    """
+    Выгрузка отчета напрямую в CSV, без промежуточного списка строк.
+    use_counter_goals - взять список целей из API управления вместо
+    предварительного прохода по данным.
+    Остальные параметры (max_workers, chunk_days, ...) передаются в fetch_report_stream.
+    """
+    if goals_ids is None and use_counter_goals:
+        goals_ids = get_counter_goals(token, counter_id)
+    
+    rows = fetch_report_stream(
+        login, token, counter_id, report_type, metrics,
+        date1=date1, date2=date2, attribution=attribution, **options
+    )
+    try:
+        return save_stream_to_csv(
+            rows, filepath, attribution, goals_ids, drop_empty_columns, trace=options.get('trace')
+        )
+    finally:
+        rows.close()
+
+# Схема Parquet
+def parquet_schema(headers, attribution='last', goals_ids=None):
+    """
+    Схема Arrow для заданных полей: тип столбца определяется по описанию
+    поля (field_type), идентификаторы (ID_FIELDS) - uint64,
+    заголовки очищаются так же, как в CSV.
+    """
+    load_pyarrow()
+    arrow_types = {
+        'int': pa.int64(),
+        'datetime': pa.timestamp('s'),
+        'date': pa.date32(),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'str': pa.string(),
+    }
+    schema_fields = [
+        pa.field(clean_header(header, attribution),
+                 pa.uint64() if is_id_field(header) else arrow_types[field_type(header)])
+        for header in headers
+    ]
+    if goals_ids is not None:
+        goals_headers, _ = goal_columns(goals_ids)
+        schema_fields.extend(pa.field(header, pa.bool_()) for header in goals_headers)
+    return pa.schema(schema_fields)
+
+def _parquet_column(values, kind, arrow_type, column_name):
+    """Столбец Arrow из значений; строковые значения типизированных полей разбираются"""
+    parsers = {'int': _parse_int, 'datetime': _parse_datetime, 'date': _parse_date}
+    if kind in parsers:
+        parse = parsers[kind]
+        values = [parse(value) if isinstance(value, str) else value for value in values]
+    elif kind in ('category', 'str'):
+        values = [None if value is None else str(value) for value in values]
     try:
-        url = "https://api-metrika.yandex.net/management/v1/counters"
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # Значения, не подходящие под тип поля или вне его диапазона, записываются как пустые
+        logger.warning(f"Столбец {column_name}: значения не типа {arrow_type} заменены пустыми")
+        return pa.array([_arrow_value(value, arrow_type) for value in values], type=arrow_type)
+
+def _arrow_value(value, arrow_type):
+    """Значение, если оно представимо в типе Arrow, иначе None"""
+    try:
+        pa.scalar(value, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return None
+    return value
+
+def _parquet_table(batch, headers, schema, goal_index):
+    """Таблица Arrow из пачки строк"""
+    columns = []
+    for position, header in enumerate(headers):
+        schema_field = schema.field(position)
+        columns.append(_parquet_column(
+            [row[header] for row in batch], field_type(header), schema_field.type, schema_field.name
+        ))
+    if goal_index is not None:
+        flags = [[False] * len(batch) for _ in goal_index]
+        if GOALS_FIELD in headers:
+            for row_number, row in enumerate(batch):
+                value = row[GOALS_FIELD]
+                if value:
+                    for goal_id in parse_goals(value):
+                        position = goal_index.get(goal_id)
+                        if position is not None:
+                            flags[position][row_number] = True
+        columns.extend(pa.array(column, type=pa.bool_()) for column in flags)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+# Потоковое сохранение в Parquet
+def save_stream_to_parquet(rows, filepath, attribution='last', goals_ids=None,
+                           row_group_size=PARQUET_ROW_GROUP_SIZE, trace=None):
+    """
+    Сохранение потока строк в Parquet: строки копятся пачками по
+    row_group_size и записываются отдельными группами строк.
+    Категориальные поля (CATEGORY_FIELDS) хранятся со словарным кодированием.
+    Столбцы целей (bool) добавляются, если передан список целей goals_ids.
+    trace - PipelineTrace для замера этапа save (rows, columns).
+    Возвращает количество сохраненных строк.
+    """
+    load_pyarrow()
+    
+    span = start_span(trace, 'save', format='parquet')
+    if trace is not None:
+        rows = timed_iter(rows, span, exclude=True)
+    try:
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            logger.warning("Нет данных для сохранения")
+            return 0
+        
+        headers = list(first_row.keys())
+        schema = parquet_schema(headers, attribution, goals_ids)
+        goal_index = goal_columns(goals_ids)[1] if goals_ids is not None else None
+        dictionary_columns = [
+            clean_header(header, attribution) for header in headers if field_type(header) == 'category'
+        ]
+        
+        row_count = 0
+        with pq.ParquetWriter(filepath, schema, use_dictionary=dictionary_columns or False) as writer:
+            batch = []
+            for row in itertools.chain([first_row], rows):
+                batch.append(row)
+                if len(batch) >= row_group_size:
+                    writer.write_table(_parquet_table(batch, headers, schema, goal_index))
+                    row_count += len(batch)
+                    batch = []
+            if batch:
+                writer.write_table(_parquet_table(batch, headers, schema, goal_index))
+                row_count += len(batch)
+        
+        logger.info(f"Данные успешно сохранены в {filepath}")
+        logger.info(f"Количество столбцов в файле: {len(schema)}, строк: {row_count}")
+        span.set(rows=row_count, columns=len(schema))
+        return row_count
+        
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении в Parquet: {str(e)}")
+        span.finish(error=type(e).__name__)
+        raise
+    finally:
+        span.finish()
+
+# Потоковая выгрузка отчета в Parquet
+def export_report_to_parquet(filepath, login, token, counter_id, report_type, metrics, date1="7daysAgo",
+                             date2="today", attribution="last", goals_ids=None, use_counter_goals=False,
+                             **options):
+    """
+    Выгрузка отчета напрямую в Parquet, группы строк пишутся по мере загрузки.
+    Остальные параметры (max_workers, chunk_days, ...) передаются в fetch_report_stream.
+    """
+    if goals_ids is None and use_counter_goals:
+        goals_ids = get_counter_goals(token, counter_id)
+    
+    rows = fetch_report_stream(
+        login, token, counter_id, report_type, metrics,
+        date1=date1, date2=date2, attribution=attribution, **options
+    )
+    try:
+        return save_stream_to_parquet(rows, filepath, attribution, goals_ids, trace=options.get('trace'))
+    finally:
+        rows.close()
+
+# Список счетчиков токена
+def get_counters(token):
+    """
+    Счетчики, доступные токену (id, name, site, time_zone_name).
+    Результат кешируется в metadata_cache и сбрасывается при ответе 401/403.
+    """
+    def load():
+        url = f"{API_BASE_URL}/counters"
         headers = {"Authorization": f"OAuth {token}"}
-        response = session.get(url, headers=headers, timeout=10)
+        response = session.get(url, headers=headers, timeout=30)
         response.raise_for_status()
+        return [
+            {key: counter.get(key) for key in ("id", "name", "site", "time_zone_name")}
+            for counter in response.json().get("counters", [])
+        ]
+    return metadata_cache.cached(token, "counters", load)
+
+def get_counter_timezone(token, counter_id):
+    """Часовой пояс счетчика (например, Europe/Moscow) или None"""
+    for counter in get_counters(token):
+        if str(counter.get("id")) == str(counter_id):
+            return counter.get("time_zone_name")
+    return None
+
+def counter_today(token, counter_id):
+    """
+    Текущая дата в часовом поясе счетчика: по ней определяется, какие дни
+    уже закрыты. Если пояс неизвестен (или нет zoneinfo), берется локальная дата.
+    """
+    try:
+        from zoneinfo import ZoneInfo
+        timezone_name = get_counter_timezone(token, counter_id)
+        if timezone_name:
+            return datetime.now(ZoneInfo(timezone_name)).date()
+    except (ImportError, KeyError, ValueError, requests.exceptions.RequestException) as e:
+        logger.warning(f"Не удалось определить часовой пояс счетчика {counter_id}: {str(e)}")
+    return datetime.now().date()
+
+# Валидация токена
+def validate_token(token):
+    """Проверка токена; список счетчиков кешируется, поэтому повторные проверки не обращаются к API"""
+    try:
+        get_counters(token)
         logger.info("Токен валиден")
         return True
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка валидации токена: {str(e)}")
         return False
 
+# Разбор даты
+def parse_date(date_str):
+    """
+    Преобразует дату в datetime.date. Поддерживает форматы:
+    - YYYY-MM-DD
+    - today
+    - yesterday
+    - NdaysAgo (например, 7daysAgo)
+    """
+    if isinstance(date_str, datetime):
+        return date_str.date()
+    if isinstance(date_str, date):
+        return date_str
+    
+    if date_str == "today":
+        return datetime.now().date()
+    elif date_str == "yesterday":
+        return (datetime.now() - timedelta(days=1)).date()
+    elif isinstance(date_str, str) and date_str.endswith("daysAgo"):
+        try:
+            days = int(date_str.replace("daysAgo", ""))
+            return (datetime.now() - timedelta(days=days)).date()
+        except ValueError:
+            raise ValueError(f"Некорректный формат даты: {date_str}")
+    else:
+        try:
+            return datetime.strptime(date_str, "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError(f"Некорректный формат даты: {date_str}. Используйте формат YYYY-MM-DD")
+
 # Валидация дат
 def validate_dates(date1, date2):
     """
@@ -636,26 +2459,6 @@ def validate_dates(date1, date2):
     - yesterday
     - NdaysAgo (например, 7daysAgo)
     """
-    def parse_date(date_str):
-        if isinstance(date_str, datetime):
-            return date_str.date()
-        
-        if date_str == "today":
-            return datetime.now().date()
-        elif date_str == "yesterday":
-            return (datetime.now() - timedelta(days=1)).date()
-        elif isinstance(date_str, str) and date_str.endswith("daysAgo"):
-            try:
-                days = int(date_str.replace("daysAgo", ""))
-                return (datetime.now() - timedelta(days=days)).date()
-            except ValueError:
-                raise ValueError(f"Некорректный формат даты: {date_str}")
-        else:
-            try:
-                return datetime.strptime(date_str, "%Y-%m-%d").date()
-            except ValueError:
-                raise ValueError(f"Некорректный формат даты: {date_str}. Используйте формат YYYY-MM-DD")
-
     try:
         start_date = parse_date(date1)
         end_date = parse_date(date2)
@@ -0,0 +1,340 @@
+﻿import asyncio
+import time
+import logging
+
+import aiohttp
+
+import api_logic
+from rate_limit import parse_retry_after
+from api_logic import (
+    API_BASE_URL, ATTRIBUTION_TYPES, DOWNLOAD_WORKERS, STREAM_CHUNK_SIZE,
+    POLL_INITIAL_DELAY, POLL_BACKOFF, POLL_MAX_DELAY, POLL_TIMEOUT, rate_limiter, retry_strategy,
+    build_log_request, chunk_days_from_evaluation, find_log_request, format_api_error, make_row_parser,
+    next_poll_delay, parse_counter_goals, parse_date, sorted_part_numbers, split_date_range, split_tsv_chunk
+)
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество одновременных соединений клиента
+MAX_CONNECTIONS = 20
+
+
+class AsyncLogsClient:
+    """
+    Асинхронный клиент Logs API на aiohttp.
+
+    Операции те же, что в api_logic (создание запроса, ожидание, загрузка
+    частей, очистка), но в виде корутин: один цикл событий может вести
+    запросы, опрос и загрузку частей для многих счетчиков одновременно.
+    Формирование запросов и разбор ответов общие с api_logic.
+
+    Пример:
+        async with AsyncLogsClient(token) as client:
+            rows = await client.fetch_report(counter_id, fields, "7daysAgo", "today")
+    """
+
+    def __init__(self, token, max_connections=MAX_CONNECTIONS, session=None, base_url=API_BASE_URL):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self._session = session
+        self._own_session = session is None
+
+    async def __aenter__(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Закрытие собственной сессии клиента"""
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _headers(self, **extra):
+        headers = {"Authorization": f"OAuth {self.token}"}
+        headers.update(extra)
+        return headers
+
+    async def _request(self, method, url, **kwargs):
+        """
+        HTTP-запрос с повторами при сетевых ошибках и кодах из retry_strategy
+        (те же правила, что у синхронной сессии). Частота запросов ограничена
+        общим с синхронной сессией ограничителем токена (rate_limiter). Ответ нужно прочитать или закрыть.
+        При ответе 401/403 сбрасывается кеш метаданных токена.
+        """
+        # Ограничитель и кеш метаданных работают с файлами под блокировкой,
+        # поэтому вызываются в пуле потоков, а не в цикле событий
+        loop = asyncio.get_running_loop()
+        limiter = rate_limiter.for_token(self.token)
+        attempts = retry_strategy.total + 1
+        for attempt in range(attempts):
+            retry_after = None
+            status = None
+            wait = await loop.run_in_executor(None, limiter.reserve)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                response = await self._session.request(method, url, **kwargs)
+            except aiohttp.ClientConnectionError as e:
+                if attempt == attempts - 1:
+                    raise
+                logger.warning(f"Ошибка сети: {str(e)}, повтор {attempt + 1}/{attempts - 1}")
+            else:
+                await loop.run_in_executor(None, limiter.update_quota, response.headers)
+                if response.status in (401, 403):
+                    # Токен отозван или потерял доступ: кешированные метаданные больше не верны
+                    # (api_logic.metadata_cache читается при вызове - его могут подменить)
+                    await loop.run_in_executor(None, api_logic.metadata_cache.invalidate, self.token)
+                if response.status not in retry_strategy.status_forcelist or attempt == attempts - 1:
+                    return response
+                status = response.status
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                response.release()
+                logger.warning(f"Ответ API {response.status}, повтор {attempt + 1}/{attempts - 1}")
+
+            delay = retry_after
+            if delay is None:
+                delay = retry_strategy.backoff_factor * (2 ** attempt)
+            if status == 429:
+                # Пауза после 429 общая для всех запросов ограничителя
+                await loop.run_in_executor(None, limiter.penalize, delay)
+            else:
+                await asyncio.sleep(delay)
+
+    async def _get_json(self, url, **kwargs):
+        response = await self._request("GET", url, headers=self._headers(), **kwargs)
+        async with response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    # Валидация токена
+    async def validate_token(self):
+        try:
+            await self._get_json(f"{self.base_url}/counters")
+            logger.info("Токен валиден")
+            return True
+        except aiohttp.ClientError as e:
+            logger.error(f"Ошибка валидации токена: {str(e)}")
+            return False
+
+    async def get_counter_goals(self, counter_id):
+        """Список ID целей счетчика из API управления"""
+        payload = await self._get_json(f"{self.base_url}/counter/{counter_id}/goals")
+        return parse_counter_goals(payload)
+
+    async def evaluate_log_request(self, counter_id, fields, date1, date2):
+        """Оценка запроса через logrequests/evaluate"""
+        params, _ = build_log_request(fields, date1, date2)
+        payload = await self._get_json(
+            f"{self.base_url}/counter/{counter_id}/logrequests/evaluate", params=params
+        )
+        return payload.get("log_request_evaluation", {})
+
+    async def create_log_request(self, counter_id, fields, date1, date2, attribution='last'):
+        """Создание запроса к Logs API, возвращает request_id"""
+        params, request_data = build_log_request(fields, date1, date2, attribution)
+        response = await self._request(
+            "POST", f"{self.base_url}/counter/{counter_id}/logrequests",
+            params=params, json=request_data,
+            headers=self._headers(**{"Content-Type": "application/json"})
+        )
+        async with response:
+            if response.status != 200:
+                text = await response.text()
+                try:
+                    error_msg = format_api_error(response.status, await response.json(content_type=None))
+                except ValueError:
+                    error_msg = format_api_error(response.status, text=text)
+                logger.error(error_msg)
+                raise ValueError(error_msg)
+            payload = await response.json(content_type=None)
+
+        request_id = payload.get("log_request", {}).get("request_id")
+        if not request_id:
+            raise ValueError("API не вернул request_id")
+        logger.info(f"Создан запрос с ID: {request_id}, атрибуция: {ATTRIBUTION_TYPES[attribution]}")
+        return request_id
+
+    async def get_log_request(self, counter_id, request_id):
+        """Описание запроса (статус, список частей)"""
+        payload = await self._get_json(f"{self.base_url}/counter/{counter_id}/logrequest/{request_id}")
+        return payload["log_request"]
+
+    async def list_log_requests(self, counter_id):
+        """Описания всех запросов счетчика, которые еще хранятся в API"""
+        payload = await self._get_json(f"{self.base_url}/counter/{counter_id}/logrequests")
+        return payload.get("requests", [])
+
+    async def wait_for_request_ready(self, counter_id, request_id, timeout=POLL_TIMEOUT,
+                                     initial_delay=POLL_INITIAL_DELAY, backoff=POLL_BACKOFF,
+                                     max_delay=POLL_MAX_DELAY):
+        """
+        Ожидание готовности запроса с тем же расписанием опроса, что у LogRequestPoller.
+        Несколько запросов ждутся одновременно через asyncio.gather.
+        """
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        pause = initial_delay
+        while True:
+            await asyncio.sleep(pause)
+            log_request = await self.get_log_request(counter_id, request_id)
+            status = log_request["status"]
+            logger.info(f"Статус запроса {request_id}: {status}")
+
+            if status == "processed":
+                return log_request
+            elif status == "created" or status == "processing":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Запрос {request_id} не готов за {timeout:.0f} секунд")
+                delay, pause = next_poll_delay(delay, backoff, max_delay)
+                pause = min(pause, remaining)
+            else:
+                logger.error(f"Неожиданный статус запроса: {status}")
+                raise Exception(f"Неожиданный статус запроса: {status}")
+
+    async def iter_part_rows(self, counter_id, request_id, part_number=0):
+        """Асинхронный генератор строк одной части отчета"""
+        url = f"{self.base_url}/counter/{counter_id}/logrequest/{request_id}/part/{part_number}/download"
+        response = await self._request("GET", url, headers=self._headers(**{"Accept-Encoding": "gzip"}))
+        async with response:
+            response.raise_for_status()
+            parse_line = None
+            tail = b''
+            # aiohttp распаковывает gzip по мере чтения блоков
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                lines, tail = split_tsv_chunk(tail, chunk)
+                for line in lines:
+                    if parse_line is None:
+                        # Первая строка - заголовки
+                        parse_line = make_row_parser(line.split('\t'))
+                        continue
+                    if line:
+                        row = parse_line(line)
+                        if row is not None:
+                            yield row
+            if tail and parse_line is not None:
+                row = parse_line(tail.decode('utf-8'))
+                if row is not None:
+                    yield row
+
+    async def download_part(self, counter_id, request_id, part_number=0):
+        """Загрузка одной части отчета в список строк"""
+        rows = [row async for row in self.iter_part_rows(counter_id, request_id, part_number)]
+        logger.info(f"Часть {part_number}: загружено {len(rows)} строк")
+        return rows
+
+    async def download_parts(self, counter_id, request_id, parts=None, max_workers=DOWNLOAD_WORKERS):
+        """Загрузка всех частей (не более max_workers одновременно), склейка в порядке номеров"""
+        if parts is None:
+            parts = (await self.get_log_request(counter_id, request_id)).get("parts")
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def download(part_number):
+            async with semaphore:
+                return await self.download_part(counter_id, request_id, part_number)
+
+        results = await asyncio.gather(*(download(n) for n in sorted_part_numbers(parts)))
+        all_rows = []
+        for rows in results:
+            all_rows.extend(rows)
+        return all_rows
+
+    async def clean_up_request(self, counter_id, request_id):
+        """Удаление запроса после загрузки"""
+        response = await self._request(
+            "DELETE", f"{self.base_url}/counter/{counter_id}/logrequest/{request_id}",
+            headers=self._headers()
+        )
+        async with response:
+            if response.status != 204:
+                logger.warning("Не удалось удалить запрос.")
+
+    async def cancel_log_request(self, counter_id, request_id):
+        """Отмена запроса, который еще готовится"""
+        response = await self._request(
+            "POST", f"{self.base_url}/counter/{counter_id}/logrequest/{request_id}/cancel",
+            headers=self._headers()
+        )
+        async with response:
+            if response.status != 200:
+                logger.warning("Не удалось отменить запрос.")
+
+    async def fetch_report(self, counter_id, fields, date1="7daysAgo", date2="today", attribution="last",
+                           max_workers=DOWNLOAD_WORKERS, reuse_requests=True, clean_up_reused=False,
+                           chunk_days="auto"):
+        """
+        Выгрузка отчета за период, возвращает список строк.
+        chunk_days - разбить период на интервалы, по каждому создается свой
+        запрос (по очереди): "auto" - размер интервала по оценке API
+        (logrequests/evaluate, как plan_chunk_days), None - один запрос
+        на весь период без оценки.
+        Остальные параметры - как у fetch_request.
+        """
+        # Относительные даты фиксируются один раз для всех интервалов
+        date1 = parse_date(date1).strftime("%Y-%m-%d")
+        date2 = parse_date(date2).strftime("%Y-%m-%d")
+        if chunk_days == "auto":
+            try:
+                evaluation = await self.evaluate_log_request(counter_id, fields, date1, date2)
+                chunk_days, _ = chunk_days_from_evaluation(evaluation)
+            except aiohttp.ClientError as e:
+                # Без оценки пробуем выгрузить период одним запросом
+                logger.warning(f"Не удалось оценить запрос: {str(e)}")
+                chunk_days = None
+        chunks = split_date_range(date1, date2, chunk_days) if chunk_days else [(date1, date2)]
+        logger.info(f"Количество запросов для периода {date1} - {date2}: {len(chunks)}")
+
+        rows = []
+        for chunk_date1, chunk_date2 in chunks:
+            rows.extend(await self.fetch_request(
+                counter_id, fields, chunk_date1, chunk_date2, attribution, max_workers, reuse_requests,
+                clean_up_reused
+            ))
+        return rows
+
+    async def fetch_request(self, counter_id, fields, date1, date2, attribution="last",
+                            max_workers=DOWNLOAD_WORKERS, reuse_requests=True, clean_up_reused=False):
+        """
+        Один запрос за период: создание, ожидание, загрузка всех частей и очистка запроса.
+        reuse_requests - загрузить подходящий существующий запрос вместо создания нового.
+        Если задачу отменить (asyncio.CancelledError) до готовности запроса,
+        запрос отменяется на стороне API, после готовности - очищается.
+        Найденный существующий запрос не очищается и не отменяется,
+        если не передан clean_up_reused=True.
+        """
+        request_id = None
+        if reuse_requests:
+            try:
+                log_requests = await self.list_log_requests(counter_id)
+                request_id = find_log_request(log_requests, fields, date1, date2, attribution)
+            except aiohttp.ClientError as e:
+                logger.warning(f"Не удалось получить список запросов счетчика: {str(e)}")
+            if request_id is not None:
+                logger.info(f"Используется существующий запрос {request_id}")
+        created = request_id is None
+        if created:
+            request_id = await self.create_log_request(counter_id, fields, date1, date2, attribution)
+        processed = False
+        try:
+            log_request = await self.wait_for_request_ready(counter_id, request_id)
+            processed = True
+            return await self.download_parts(counter_id, request_id, log_request.get("parts"), max_workers)
+        finally:
+            if created or clean_up_reused:
+                await self._release_request(counter_id, request_id, processed)
+
+    async def _release_request(self, counter_id, request_id, processed):
+        """Очистка готового запроса или отмена готовящегося"""
+        # Освобождение запроса не должно прерываться повторной отменой задачи
+        release = self.clean_up_request if processed else self.cancel_log_request
+        try:
+            await asyncio.shield(release(counter_id, request_id))
+        except aiohttp.ClientError as e:
+            logger.warning(f"Ошибка при освобождении запроса: {str(e)}")
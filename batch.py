@@ -0,0 +1,231 @@
+﻿import os
+import sys
+import json
+import time
+import logging
+import argparse
+import contextlib
+from collections import Counter
+from datetime import date, datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from api_logic import (
+    CancelToken, ReportCancelled, export_report_to_csv, export_report_to_parquet, report_source, setup_logging
+)
+from sinks import export_report_to_sink, mask_password
+from timings import PipelineTrace, profiled
+
+logger = logging.getLogger(__name__)
+
+# Количество заданий, выполняемых одновременно
+BATCH_WORKERS = 8
+# Сколько заданий с одним токеном выполняется одновременно
+PER_TOKEN_CONCURRENCY = 3
+
+# Форматы выгрузки и функции, которые их пишут
+EXPORTERS = {
+    'csv': export_report_to_csv,
+    'parquet': export_report_to_parquet,
+    'sink': export_report_to_sink,
+}
+
+
+def normalize_job(spec, defaults=None):
+    """
+    Задание выгрузки из описания (словаря). Обязательные ключи:
+    counter_id, fields и output (или sink - адрес базы данных, см. sinks.open_sink);
+    token, date1, date2, attribution, format и остальные параметры берутся
+    из defaults, если не заданы в задании.
+    Токен по умолчанию читается из переменной окружения METRIKA_TOKEN.
+    """
+    job = dict(defaults or {})
+    job.update(spec)
+
+    if not job.get('token'):
+        job['token'] = os.environ.get('METRIKA_TOKEN')
+    missing = [key for key in ('token', 'counter_id', 'fields') if not job.get(key)]
+    if not job.get('output') and not job.get('sink'):
+        missing.append('output')
+    if missing:
+        raise ValueError(f"В задании не заданы параметры: {', '.join(missing)}")
+
+    if isinstance(job['fields'], str):
+        job['fields'] = [field.strip() for field in job['fields'].split(',') if field.strip()]
+    job.setdefault('date1', '7daysAgo')
+    job.setdefault('date2', 'today')
+    for key in ('date1', 'date2'):
+        # YAML читает даты вида 2024-01-01 как объекты date
+        if isinstance(job[key], (date, datetime)):
+            job[key] = job[key].strftime("%Y-%m-%d")
+    job.setdefault('attribution', 'last')
+    if job.get('sink'):
+        job['format'] = 'sink'
+    job.setdefault('format', 'parquet' if str(job.get('output', '')).endswith('.parquet') else 'csv')
+    job.setdefault('report_type', report_source(job['fields']))
+    job.setdefault('login', '')
+    if job['format'] not in EXPORTERS:
+        raise ValueError(f"Неподдерживаемый формат выгрузки: {job['format']}")
+    return job
+
+
+def job_target(job):
+    """Куда пишет задание: файл output или адрес приемника sink (без пароля)"""
+    return mask_password(job['sink']) if job['format'] == 'sink' else job['output']
+
+
+def run_job(job, cancel=None):
+    """
+    Выполнение одного задания, возвращает количество выгруженных строк.
+    Ключ trace - файл замеров этапов (.jsonl - JSON Lines, .prom - метрики
+    Prometheus), profile - файл статистики cProfile.
+    """
+    options = {
+        key: value for key, value in job.items()
+        if key not in ('token', 'login', 'counter_id', 'fields', 'output', 'sink', 'format', 'report_type',
+                       'date1', 'date2', 'attribution', 'name', 'trace', 'profile')
+    }
+    exporter = EXPORTERS[job['format']]
+    trace = None
+    if job.get('trace'):
+        labels = {'counter_id': str(job['counter_id'])}
+        if job.get('name'):
+            labels['job'] = job['name']
+        trace = PipelineTrace(**labels)
+    target = job['sink'] if job['format'] == 'sink' else job['output']
+    try:
+        with profiled(job['profile']) if job.get('profile') else contextlib.nullcontext():
+            return exporter(
+                target, job['login'], job['token'], job['counter_id'], job['report_type'], job['fields'],
+                date1=job['date1'], date2=job['date2'], attribution=job['attribution'], cancel=cancel, trace=trace,
+                **options
+            )
+    finally:
+        if trace is not None:
+            trace.log_summary()
+            trace.write(job['trace'])
+
+
+def run_batch(jobs, max_workers=BATCH_WORKERS, per_token_limit=PER_TOKEN_CONCURRENCY, cancel=None):
+    """
+    Выполнение списка заданий общим пулом потоков.
+
+    Задания с одним токеном выполняются не более чем по per_token_limit
+    одновременно (квоты API считаются на токен): задание отдается пулу,
+    только когда у его токена есть свободный слот, поэтому задания,
+    ждущие своего токена, не занимают потоки пула. Ошибка одного задания
+    не останавливает остальные. Возвращает результаты в порядке заданий:
+    словари с ключами job, status ("ok", "error" или "cancelled"), rows, error, seconds.
+
+    cancel - CancelToken, общий для всех заданий. При прерывании (Ctrl+C)
+    задания отменяются, а их запросы освобождаются в API.
+    """
+    cancel = cancel or CancelToken()
+
+    def execute(job):
+        name = job.get('name') or f"{job['counter_id']} -> {job_target(job)}"
+        started = time.monotonic()
+        logger.info(f"Задание {name}: начало выгрузки")
+        try:
+            rows = run_job(job, cancel)
+            result = {'job': job, 'status': 'ok', 'rows': rows, 'error': None}
+            logger.info(f"Задание {name}: выгружено {rows} строк")
+        except ReportCancelled as e:
+            result = {'job': job, 'status': 'cancelled', 'rows': 0, 'error': str(e)}
+            logger.info(f"Задание {name}: отменено")
+        except Exception as e:
+            result = {'job': job, 'status': 'error', 'rows': 0, 'error': str(e)}
+            logger.error(f"Задание {name}: ошибка: {str(e)}")
+        result['seconds'] = time.monotonic() - started
+        return result
+
+    workers = max(1, min(max_workers, len(jobs)))
+    limit = max(1, per_token_limit)
+    results = [None] * len(jobs)
+    pending = list(range(len(jobs)))  # номера заданий, еще не отданных пулу
+    running = {}                      # future -> номер задания
+    token_running = Counter()         # токен -> количество выполняемых заданий
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            waiting = []
+            for index in pending:
+                token = jobs[index]['token']
+                if len(running) < workers and token_running[token] < limit:
+                    token_running[token] += 1
+                    running[executor.submit(execute, jobs[index])] = index
+                else:
+                    waiting.append(index)
+            pending = waiting
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                token_running[jobs[index]['token']] -= 1
+                results[index] = future.result()
+        return results
+    except KeyboardInterrupt:
+        logger.warning("Пакетная выгрузка прервана, задания отменяются")
+        cancel.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+
+def read_config(path):
+    """Чтение JSON- или YAML-файла (для YAML нужен пакет PyYAML)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Для чтения YAML установите пакет PyYAML")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def load_jobs(path):
+    """
+    Чтение заданий из JSON- или YAML-файла: список заданий или объект
+    {"defaults": {...}, "jobs": [...]}.
+    """
+    config = read_config(path)
+    if isinstance(config, list):
+        config = {'jobs': config}
+    defaults = config.get('defaults', {})
+    return [normalize_job(spec, defaults) for spec in config.get('jobs', [])]
+
+
+def main(argv=None, log_dir='logs'):
+    parser = argparse.ArgumentParser(description="Пакетная выгрузка логов Яндекс.Метрики по нескольким счетчикам")
+    parser.add_argument('jobs_file', help="JSON- или YAML-файл с заданиями")
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS,
+                        help="количество заданий, выполняемых одновременно")
+    parser.add_argument('--per-token', type=int, default=PER_TOKEN_CONCURRENCY,
+                        help="количество одновременных заданий на один токен")
+    args = parser.parse_args(argv)
+
+    if log_dir:
+        setup_logging(log_dir)
+    jobs = load_jobs(args.jobs_file)
+    try:
+        results = run_batch(jobs, max_workers=args.workers, per_token_limit=args.per_token)
+    except KeyboardInterrupt:
+        print("Прервано")
+        return 130
+
+    failed = 0
+    for result in results:
+        job = result['job']
+        name = job.get('name') or job['counter_id']
+        if result['status'] == 'ok':
+            print(f"OK     {name}: {result['rows']} строк, {result['seconds']:.1f} с -> {job_target(job)}")
+        elif result['status'] == 'cancelled':
+            failed += 1
+            print(f"CANCEL {name}")
+        else:
+            failed += 1
+            print(f"ERROR  {name}: {result['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
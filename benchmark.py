@@ -0,0 +1,211 @@
+﻿"""
+Замеры производительности выгрузки на локальной имитации Logs API (mock_server.py).
+
+    python benchmark.py --rows 200000 --parts 4
+    python benchmark.py --scenario hits --format parquet --repeat 3 --json results.json
+
+Каждый прогон выполняется в отдельном процессе (чтобы пиковая память не
+накапливалась между прогонами, а сервер не делил GIL с клиентом): оценка
+и создание запроса, ожидание, загрузка частей и запись файла. Результат -
+строки/с, МБ/с (распакованный TSV), пиковая память процесса и время до
+первой строки.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+# Пиковая память процесса (в Windows модуля resource нет)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from mock_server import add_server_arguments, server_settings, start_mock_server
+from timings import PipelineTrace
+
+# Наборы полей сценариев
+SCENARIOS = {
+    'visits': [
+        'ym:s:visitID', 'ym:s:date', 'ym:s:dateTime', 'ym:s:clientID', 'ym:s:isNewUser', 'ym:s:startURL',
+        'ym:s:referer', 'ym:s:<attribution>TrafficSource', 'ym:s:deviceCategory', 'ym:s:browser',
+        'ym:s:pageViews', 'ym:s:visitDuration', 'ym:s:bounce', 'ym:s:goalsID',
+    ],
+    'hits': [
+        'ym:pv:watchID', 'ym:pv:date', 'ym:pv:dateTime', 'ym:pv:clientID', 'ym:pv:URL', 'ym:pv:referer',
+        'ym:pv:title', 'ym:pv:deviceCategory', 'ym:pv:browser', 'ym:pv:goalsID',
+    ],
+}
+# Период выгрузки в прогоне
+BENCH_DATE1 = '2024-01-01'
+BENCH_DATE2 = '2024-01-07'
+# Первая проверка статуса на локальном сервере (секунд)
+BENCH_POLL_DELAY = 0.05
+
+
+def peak_rss_mb():
+    """Пиковая память процесса (МБ) или None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в КБ, в macOS - в байтах
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_once(spec):
+    """
+    Один прогон в текущем процессе (METRIKA_API_URL уже указывает на имитацию).
+    Возвращает словарь с результатами замеров.
+    """
+    import api_logic
+    from rate_limit import TokenBuckets
+    from metadata_cache import MetadataCache
+
+    # Отдельные ограничитель и кеш метаданных: прогон не расходует общую квоту
+    # и не читает кеш настоящих токенов
+    api_logic.adapter.limiter = TokenBuckets(api_logic.API_RATE_LIMIT, api_logic.API_RATE_BURST, state_dir=None)
+    api_logic.metadata_cache = MetadataCache(os.path.join(spec['work_dir'], 'metadata'))
+    api_logic.POLL_INITIAL_DELAY = BENCH_POLL_DELAY
+
+    fields = SCENARIOS[spec['scenario']]
+    output = os.path.join(spec['work_dir'], f"{spec['scenario']}.{spec['format']}")
+    downloaded = [0]
+    downloaded_lock = threading.Lock()
+    first_row = [None]
+
+    def progress(size):
+        with downloaded_lock:
+            downloaded[0] += size
+
+    trace = PipelineTrace(scenario=spec['scenario'])
+    started = time.perf_counter()
+
+    def timed(rows):
+        for row in rows:
+            if first_row[0] is None:
+                first_row[0] = time.perf_counter() - started
+            yield row
+
+    rows = api_logic.fetch_report_stream(
+        '', 'benchmark', 1, api_logic.report_source(fields), fields, BENCH_DATE1, BENCH_DATE2, 'last',
+        max_workers=spec['workers'], parse_workers=spec['parse_workers'], spool=spec['spool'],
+        journal_dir=os.path.join(spec['work_dir'], 'journal'), reuse_requests=False, progress=progress, trace=trace
+    )
+    try:
+        if spec['format'] == 'parquet':
+            count = api_logic.save_stream_to_parquet(timed(rows), output, trace=trace)
+        else:
+            count = api_logic.save_stream_to_csv(timed(rows), output, trace=trace)
+    finally:
+        rows.close()
+    seconds = time.perf_counter() - started
+
+    return {
+        'scenario': spec['scenario'],
+        'format': spec['format'],
+        'rows': count,
+        'seconds': seconds,
+        'rows_per_second': count / seconds if seconds else 0.0,
+        'mb_per_second': downloaded[0] / (1024 * 1024) / seconds if seconds else 0.0,
+        'downloaded_mb': downloaded[0] / (1024 * 1024),
+        'output_mb': os.path.getsize(output) / (1024 * 1024),
+        'time_to_first_row': first_row[0],
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {stage: totals['seconds'] for stage, totals in trace.summary().items()},
+    }
+
+
+def run_in_subprocess(spec, api_url):
+    """Прогон в отдельном процессе, результат передается через stdout"""
+    env = dict(os.environ, METRIKA_API_URL=api_url)
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-once', json.dumps(spec)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+        cwd=spec['work_dir']
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Прогон {spec['scenario']} завершился с ошибкой:\n{completed.stderr.strip()}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(results):
+    """Медианы замеров по сценарию"""
+    summary = dict(results[0])
+    for key in ('seconds', 'rows_per_second', 'mb_per_second', 'time_to_first_row', 'peak_rss_mb'):
+        values = [result[key] for result in results if result[key] is not None]
+        summary[key] = statistics.median(values) if values else None
+    summary['stages'] = {
+        stage: statistics.median(result['stages'].get(stage, 0.0) for result in results)
+        for stage in results[0]['stages']
+    }
+    summary['runs'] = len(results)
+    return summary
+
+
+def format_value(value, digits=2):
+    return '-' if value is None else f"{value:,.{digits}f}".replace(',', ' ')
+
+
+def print_table(summaries, server_stats):
+    print(f"{'сценарий':<10} {'формат':<8} {'строк':>10} {'время, с':>9} {'строк/с':>12} "
+          f"{'МБ/с':>8} {'1-я строка, с':>14} {'пик памяти, МБ':>15}")
+    for summary in summaries:
+        print(f"{summary['scenario']:<10} {summary['format']:<8} {summary['rows']:>10} "
+              f"{format_value(summary['seconds']):>9} {format_value(summary['rows_per_second'], 0):>12} "
+              f"{format_value(summary['mb_per_second']):>8} {format_value(summary['time_to_first_row'], 3):>14} "
+              f"{format_value(summary['peak_rss_mb'], 1):>15}")
+    for summary in summaries:
+        stages = ', '.join(f"{stage} {format_value(seconds, 3)}" for stage, seconds in summary['stages'].items())
+        print(f"{summary['scenario']}: этапы, с (загрузка и разбор - сумма по частям): {stages}")
+    print(f"Сервер: запросов {server_stats['requests']}, ответов 429 {server_stats['throttled']}, "
+          f"частей {server_stats['parts']}, отдано {server_stats['bytes'] / (1024 * 1024):.1f} МБ")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности выгрузки на имитации Logs API")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                        help="сценарий (можно несколько, по умолчанию все)")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--workers', type=int, default=4, help="потоков загрузки частей")
+    parser.add_argument('--parse-workers', type=int, default=0, help="процессов разбора TSV (0 - в потоках загрузки)")
+    parser.add_argument('--spool', choices=['gzip', 'plain'], help="сохранять части на диск перед разбором")
+    parser.add_argument('--repeat', type=int, default=1, help="прогонов каждого сценария")
+    parser.add_argument('--json', help="сохранить результаты в JSON-файл")
+    parser.add_argument('--run-once', help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.run_once:
+        print(json.dumps(run_once(json.loads(args.run_once))))
+        return 0
+
+    server = start_mock_server(**server_settings(args))
+    work_dir = tempfile.mkdtemp(prefix='metrika_bench_')
+    summaries = []
+    try:
+        for scenario in args.scenario or sorted(SCENARIOS):
+            server.api.prepare(SCENARIOS[scenario], BENCH_DATE1, BENCH_DATE2)
+            spec = {'scenario': scenario, 'format': args.format, 'workers': args.workers,
+                    'parse_workers': args.parse_workers, 'spool': args.spool, 'work_dir': work_dir}
+            results = [run_in_subprocess(spec, server.url) for _ in range(max(1, args.repeat))]
+            summaries.append(summarize(results))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(summaries, server.api.stats)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': server_settings(args), 'results': summaries}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+﻿"""
+Консольный запуск выгрузок без GUI (для cron, Airflow и т.п.).
+
+    python cli.py export 12345 --fields ym:s:date,ym:s:clientID --date1 yesterday --date2 yesterday -o out.csv
+    python cli.py export --job job.yaml -o -
+    python cli.py export 12345 --fields ym:s:date,ym:s:clientID --sink sqlite:///metrika.db --table visits
+    python cli.py batch jobs.yaml --workers 8
+    python cli.py sync 12345 data/12345 --fields ym:s:clientID
+
+Модуль не импортирует tkinter, а API загружается только после разбора
+аргументов. Логи пишутся в stderr, в файл - только с --log-dir.
+"""
+import io
+import sys
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+# Команды, которые выполняются модулями со своими аргументами
+DELEGATED_COMMANDS = {
+    'batch': "пакетная выгрузка по файлу заданий (см. batch.py)",
+    'sync': "инкрементальная синхронизация набора данных (см. sync.py)",
+}
+
+
+def parse_chunk_days(value):
+    """Значение --chunk-days: auto, none или число дней"""
+    if value == 'auto':
+        return 'auto'
+    if value == 'none':
+        return None
+    try:
+        days = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("ожидается auto, none или число дней")
+    if days < 1:
+        raise argparse.ArgumentTypeError("размер интервала должен быть не меньше одного дня")
+    return days
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Выгрузка логов Яндекс.Метрики без GUI")
+    parser.add_argument('-v', '--verbose', action='store_true', help="подробные логи в stderr")
+    parser.add_argument('--log-dir', help="дополнительно писать логи в файл в этом каталоге")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="выгрузка одного отчета в файл или stdout")
+    export.add_argument('counter_id', nargs='?', help="ID счетчика")
+    export.add_argument('--job', help="JSON- или YAML-файл с описанием задания (аргументы его дополняют)")
+    export.add_argument('--fields', help="поля через запятую")
+    export.add_argument('--token', help="OAuth-токен (по умолчанию из METRIKA_TOKEN)")
+    export.add_argument('--login')
+    export.add_argument('--date1')
+    export.add_argument('--date2')
+    export.add_argument('--attribution')
+    export.add_argument('-o', '--output', help="файл результата, '-' - stdout (по умолчанию)")
+    export.add_argument('--format', choices=['csv', 'parquet'], help="по умолчанию по расширению файла")
+    export.add_argument('--sink', help="загрузить в базу вместо файла: sqlite:///file.db, postgresql://..., clickhouse://...")
+    export.add_argument('--table', help="таблица для --sink (по умолчанию metrika_visits или metrika_hits)")
+    export.add_argument('--if-exists', choices=['append', 'replace'],
+                        help="таблица уже есть: дописать строки (по умолчанию) или пересоздать")
+    export.add_argument('--counter-goals', action='store_true',
+                        help="столбцы целей по списку целей счетчика, без предварительного прохода")
+    export.add_argument('--keep-empty-columns', action='store_true',
+                        help="не удалять пустые столбцы (с --counter-goals CSV пишется за один проход)")
+    export.add_argument('--chunk-days', type=parse_chunk_days, help="auto, none или число дней")
+    export.add_argument('--workers', type=int, help="потоков загрузки частей")
+    export.add_argument('--parse-workers', type=int, help="процессов разбора TSV (по умолчанию - в потоках загрузки)")
+    export.add_argument('--resume', action='store_true', help="вести журнал и продолжать выгрузку после сбоя")
+    export.add_argument('--spool', choices=['gzip', 'plain'],
+                        help="сначала сохранить части на диск без распаковки, затем разобрать (plain - через mmap)")
+    export.add_argument('--journal-dir', help="каталог журнала и файлов частей для --resume и --spool")
+    export.add_argument('--cache', action='store_true', help="использовать локальный кеш закрытых дней")
+    export.add_argument('--trace', help="файл замеров этапов: .jsonl (JSON Lines) или .prom (Prometheus)")
+    export.add_argument('--profile', help="файл статистики cProfile (профилируется поток записи, см. --workers 1)")
+
+    for command, description in DELEGATED_COMMANDS.items():
+        commands.add_parser(command, help=description, add_help=False)
+    return parser
+
+
+def export_spec(args):
+    """Описание задания из файла --job, дополненное аргументами командной строки"""
+    spec = {}
+    if args.job:
+        from batch import read_config
+        spec = read_config(args.job) or {}
+    values = {
+        'counter_id': args.counter_id,
+        'fields': args.fields,
+        'token': args.token,
+        'login': args.login,
+        'date1': args.date1,
+        'date2': args.date2,
+        'attribution': args.attribution,
+        'output': args.output,
+        'sink': args.sink,
+        'table': args.table,
+        'if_exists': args.if_exists,
+        'format': args.format,
+        'chunk_days': args.chunk_days,
+        'max_workers': args.workers,
+        'parse_workers': args.parse_workers,
+        'spool': args.spool,
+        'journal_dir': args.journal_dir,
+        'trace': args.trace,
+        'profile': args.profile,
+    }
+    spec.update({key: value for key, value in values.items() if value is not None})
+    for flag, key in ((args.counter_goals, 'use_counter_goals'), (args.resume, 'resume'), (args.cache, 'use_cache')):
+        if flag:
+            spec[key] = True
+    if args.keep_empty_columns:
+        spec['drop_empty_columns'] = False
+    if not spec.get('sink'):
+        spec.setdefault('output', '-')
+    return spec
+
+
+def run_export(args):
+    from batch import normalize_job, run_job
+
+    job = normalize_job(export_spec(args))
+    if job['format'] != 'csv':
+        job.pop('drop_empty_columns', None)
+    to_stdout = job['format'] != 'sink' and job['output'] == '-'
+    if to_stdout:
+        if job['format'] == 'csv':
+            job['output'] = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+        else:
+            job['output'] = sys.stdout.buffer
+    try:
+        rows = run_job(job)
+    finally:
+        if to_stdout:
+            job['output'].flush()
+    print(f"Выгружено строк: {rows}", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+
+    # Уровень задается обработчику stderr, чтобы файл из --log-dir получал все сообщения
+    console = logging.StreamHandler(sys.stderr)
+    console.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[console])
+
+    if args.command in DELEGATED_COMMANDS:
+        # У парсеров команд нет своих аргументов, поэтому все аргументы после
+        # команды остаются в rest в исходном порядке и разбираются самой командой
+        if args.command == 'batch':
+            from batch import main as command_main
+        else:
+            from sync import main as command_main
+        return command_main(rest, log_dir=args.log_dir)
+
+    if rest:
+        parser.error(f"неизвестные аргументы: {' '.join(rest)}")
+    if args.log_dir:
+        from api_logic import setup_logging
+        setup_logging(args.log_dir)
+    try:
+        return run_export(args)
+    except KeyboardInterrupt:
+        print("Прервано", file=sys.stderr)
+        return 130
+    except Exception as e:
+        # Обработчик stderr (и файл из --log-dir) выводит ошибку один раз
+        logger.error(f"Ошибка: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
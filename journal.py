@@ -0,0 +1,138 @@
+﻿import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Каталог журнала выгрузок - не зависит от текущего каталога, чтобы запуск
+# из cron или CLI в другом каталоге нашел журнал и продолжил выгрузку
+JOURNAL_DIR = os.path.join(tempfile.gettempdir(), 'metrika_journal')
+
+# Файл состояния задания внутри его каталога
+STATE_FILE = 'state.json'
+
+
+def job_key(counter_id, fields, date1, date2, attribution):
+    """Ключ задания: хеш счетчика, полей, дат и атрибуции"""
+    payload = json.dumps(
+        [str(counter_id), list(fields), str(date1), str(date2), attribution],
+        ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class JobJournal:
+    """
+    Журнал одного задания выгрузки на диске: request_id, статус запроса
+    и состояние частей (загружена ли часть, сколько байт уже записано).
+    Данные частей лежат в том же каталоге, что и состояние, поэтому после
+    перезапуска можно не создавать запрос заново и докачать только
+    недостающие части.
+    """
+
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+        # Части загружаются параллельно, состояние пишется под блокировкой
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, counter_id, fields, date1, date2, attribution, journal_dir=JOURNAL_DIR):
+        """Открыть журнал задания (существующий или новый)"""
+        path = os.path.join(journal_dir, job_key(counter_id, fields, date1, date2, attribution))
+        state = {
+            'counter_id': str(counter_id),
+            'fields': list(fields),
+            'date1': str(date1),
+            'date2': str(date2),
+            'attribution': attribution,
+            'request_id': None,
+            'created': True,
+            'status': None,
+            'parts': {},
+        }
+        state_path = os.path.join(path, STATE_FILE)
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, 'r', encoding='utf-8') as f:
+                    state.update(json.load(f))
+                logger.info(f"Найден журнал выгрузки {path}, запрос {state['request_id']}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Журнал {state_path} поврежден и будет перезаписан: {str(e)}")
+        return cls(path, state)
+
+    @property
+    def request_id(self):
+        return self.state['request_id']
+
+    def save(self):
+        """Атомарная запись состояния"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.state_', dir=self.path)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, os.path.join(self.path, STATE_FILE))
+
+    @property
+    def request_created(self):
+        """Запрос создан выгрузкой (False - использован чужой существующий запрос)"""
+        return self.state.get('created', True)
+
+    def set_request(self, request_id, status='created', created=True):
+        """Новый запрос: состояние частей сбрасывается"""
+        with self._lock:
+            if request_id != self.state['request_id']:
+                self.state['parts'] = {}
+                for name in os.listdir(self.path) if os.path.isdir(self.path) else []:
+                    if name.startswith('part_'):
+                        os.remove(os.path.join(self.path, name))
+            self.state['request_id'] = request_id
+            self.state['created'] = created
+            self.state['status'] = status
+            self.save()
+
+    def set_status(self, status):
+        with self._lock:
+            self.state['status'] = status
+            self.save()
+
+    def part_path(self, part_number):
+        """Файл с данными части"""
+        return os.path.join(self.path, f"part_{part_number}.tsv")
+
+    def part_state(self, part_number):
+        return self.state['parts'].get(str(part_number), {})
+
+    def is_part_done(self, part_number):
+        return bool(self.part_state(part_number).get('done')) and os.path.exists(self.part_path(part_number))
+
+    def update_part(self, part_number, **values):
+        """Обновление состояния части (done, offset, encoding)"""
+        with self._lock:
+            self.state['parts'].setdefault(str(part_number), {}).update(values)
+            self.save()
+
+    def remove(self):
+        """Удаление журнала вместе с загруженными частями"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def discard_request(counter_id, request_id, journal_dir=JOURNAL_DIR):
+    """Удаление журналов, относящихся к запросу (вызывается при очистке запроса)"""
+    if not os.path.isdir(journal_dir):
+        return
+    for name in os.listdir(journal_dir):
+        state_path = os.path.join(journal_dir, name, STATE_FILE)
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if state.get('counter_id') == str(counter_id) and state.get('request_id') == request_id:
+            shutil.rmtree(os.path.join(journal_dir, name), ignore_errors=True)
+            logger.info(f"Журнал запроса {request_id} удален")
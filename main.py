@@ -5,6 +5,8 @@ import os
 import logging
 from datetime import datetime
 import json
+import queue
+import threading
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,9 +19,67 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from api_logic import fetch_report, get_available_metrics, save_to_csv, ATTRIBUTION_TYPES
+from api_logic import (
+    fetch_report_stream, get_available_metrics, save_stream_to_csv, setup_logging, ATTRIBUTION_TYPES,
+    CancelToken, ReportCancelled
+)
 from datetime import timedelta
 
+# Как часто окно проверяет состояние фоновых выгрузок (мс)
+JOBS_POLL_INTERVAL = 200
+
+class ReportJob(threading.Thread):
+    """
+    Выгрузка отчета в CSV в фоновом потоке, чтобы окно не зависало.
+    Статус, завершение и ошибки передаются в окно через очередь events,
+    счетчики строк и байт окно читает само при опросе.
+    """
+    def __init__(self, job_id, events, filepath, params):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.events = events
+        self.filepath = filepath
+        self.params = params
+        self.rows = 0
+        self.bytes = 0
+        self._bytes_lock = threading.Lock()
+        self.cancel_token = CancelToken()
+
+    def cancel(self):
+        """Отмена выгрузки: поток остановится и освободит запросы в API"""
+        self.cancel_token.cancel()
+
+    def add_bytes(self, count):
+        # Вызывается из потоков загрузки частей
+        with self._bytes_lock:
+            self.bytes += count
+
+    def count_rows(self, rows):
+        for row in rows:
+            if not self.rows:
+                self.events.put((self.job_id, 'status', "Загрузка данных"))
+            self.rows += 1
+            yield row
+        self.events.put((self.job_id, 'status', "Сохранение файла"))
+
+    def run(self):
+        self.events.put((self.job_id, 'status', "Подготовка отчета"))
+        try:
+            rows = fetch_report_stream(progress=self.add_bytes, cancel=self.cancel_token, **self.params)
+            try:
+                row_count = save_stream_to_csv(self.count_rows(rows), self.filepath, self.params['attribution'])
+            finally:
+                rows.close()
+        except ReportCancelled:
+            logger.info(f"Выгрузка в {self.filepath} отменена")
+            self.events.put((self.job_id, 'cancelled', None))
+            return
+        except Exception as e:
+            logger.error(f"Ошибка при получении отчета: {str(e)}")
+            self.events.put((self.job_id, 'error', str(e)))
+            return
+        self.events.put((self.job_id, 'done', row_count))
+
 class MetrikaApp:
     def __init__(self, root):
         self.root = root
@@ -180,6 +240,36 @@ class MetrikaApp:
         ttk.Button(inner_buttons_frame, text="Загрузить отчет", 
                   command=self.download_report).pack(side=tk.LEFT, padx=5)
 
+        # Frame для списка выгрузок (несколько отчетов могут загружаться одновременно)
+        jobs_frame = ttk.LabelFrame(main_container, text="Выгрузки", padding=5)
+        jobs_frame.grid(row=4, column=0, padx=10, pady=5, sticky='ew')
+        jobs_frame.grid_columnconfigure(0, weight=1)
+
+        self.jobs_view = ttk.Treeview(
+            jobs_frame,
+            columns=('file', 'status', 'rows', 'size'),
+            show='headings',
+            height=4
+        )
+        for column, title, width in (('file', "Файл", 260), ('status', "Статус", 200),
+                                     ('rows', "Строк", 90), ('size', "Загружено", 90)):
+            self.jobs_view.heading(column, text=title)
+            self.jobs_view.column(column, width=width, anchor='w' if column in ('file', 'status') else 'e')
+        self.jobs_view.grid(row=0, column=0, sticky='ew')
+
+        self.progress = ttk.Progressbar(jobs_frame, mode='indeterminate')
+        self.progress.grid(row=1, column=0, pady=(5, 0), sticky='ew')
+
+        ttk.Button(jobs_frame, text="Отменить выгрузку",
+                   command=self.cancel_selected_jobs).grid(row=2, column=0, pady=(5, 0))
+
+        # Фоновые выгрузки и очередь их событий
+        self.jobs = {}
+        self.job_events = queue.Queue()
+        self.next_job_id = 1
+        self.closing = False
+        self.root.after(JOBS_POLL_INTERVAL, self.poll_jobs)
+
         # Загружаем сохраненные настройки
         self.load_settings()
         
@@ -317,42 +407,96 @@ class MetrikaApp:
         """Get list of selected metrics"""
         return list(self.selected_metrics.get(0, tk.END))
 
-    def save_report(self, data):
-        """Сохранение отчета с выбором папки и имени файла"""
-        try:
-            if not data:
-                messagebox.showwarning("Предупреждение", "Нет данных для сохранения")
-                return
-                
-            # Получаем текущую дату для имени файла по умолчанию
-            default_filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            
-            # Открываем диалог сохранения файла
-            filepath = filedialog.asksaveasfilename(
-                defaultextension=".csv",
-                initialfile=default_filename,
-                filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-                title="Сохранить отчет как"
-            )
-            
-            if not filepath:  # Если пользователь отменил выбор
+    def ask_report_path(self):
+        """Выбор файла для сохранения отчета (до начала выгрузки)"""
+        # Получаем текущую дату для имени файла по умолчанию
+        default_filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        
+        # Открываем диалог сохранения файла
+        return filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            initialfile=default_filename,
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            title="Сохранить отчет как"
+        )
+
+    def start_job(self, filepath, params):
+        """Запуск выгрузки в фоновом потоке и добавление ее в список"""
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        job = ReportJob(job_id, self.job_events, filepath, params)
+        self.jobs[job_id] = job
+        self.jobs_view.insert('', tk.END, iid=str(job_id),
+                              values=(os.path.basename(filepath), "В очереди", 0, "0.0 МБ"))
+        self.progress.start(10)
+        job.start()
+
+    def poll_jobs(self):
+        """Обновление списка выгрузок: события из очереди и счетчики строк и байт"""
+        while True:
+            try:
+                job_id, kind, value = self.job_events.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == 'status':
+                self.jobs_view.set(str(job_id), 'status', value)
+            elif kind == 'done':
+                del self.jobs[job_id]
+                self.update_job_row(job)
+                self.jobs_view.set(str(job_id), 'status', "Готово" if value else "Нет данных")
+                if not self.closing:
+                    self.report_done(job, value)
+            elif kind == 'cancelled':
+                del self.jobs[job_id]
+                self.jobs_view.set(str(job_id), 'status', "Отменено")
+            elif kind == 'error':
+                del self.jobs[job_id]
+                self.jobs_view.set(str(job_id), 'status', "Ошибка")
+                if not self.closing:
+                    messagebox.showerror("Ошибка", value)
+
+        for job in self.jobs.values():
+            self.update_job_row(job)
+        if not self.jobs:
+            self.progress.stop()
+            if self.closing:
+                # Все выгрузки остановлены, запросы освобождены
+                self.root.destroy()
                 return
-                
-            # Сохраняем файл
-            save_to_csv(data, filepath)
-            
-            # Показываем сообщение об успехе
-            messagebox.showinfo(
-                "Успех", 
-                f"Отчет сохранен в файл:\n{filepath}"
-            )
-            
-            # Открываем папку с файлом
-            os.startfile(os.path.dirname(filepath))
-            
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка при сохранении файла:\n{str(e)}")
-            logger.error(f"Ошибка сохранения: {str(e)}")
+        self.root.after(JOBS_POLL_INTERVAL, self.poll_jobs)
+
+    def cancel_selected_jobs(self):
+        """Отмена выгрузок, выбранных в списке"""
+        for item in self.jobs_view.selection():
+            job = self.jobs.get(int(item))
+            if job is not None:
+                job.cancel()
+                self.jobs_view.set(item, 'status', "Отмена...")
+
+    def update_job_row(self, job):
+        self.jobs_view.set(str(job.job_id), 'rows', job.rows)
+        self.jobs_view.set(str(job.job_id), 'size', f"{job.bytes / (1024 * 1024):.1f} МБ")
+
+    def report_done(self, job, row_count):
+        """Сообщение о завершении выгрузки"""
+        if not row_count:
+            messagebox.showwarning("Предупреждение", "Нет данных для сохранения")
+            return
+        
+        # Показываем сообщение об успехе
+        messagebox.showinfo(
+            "Успех", 
+            f"Отчет сохранен в файл:\n{job.filepath}\nСтрок: {row_count}"
+        )
+        
+        # Открываем папку с файлом
+        try:
+            os.startfile(os.path.dirname(job.filepath))
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Не удалось открыть папку с отчетом: {str(e)}")
 
     def download_report(self):
         try:
@@ -389,25 +533,21 @@ class MetrikaApp:
             # Получаем выбранный тип атрибуции
             attribution = self.attribution.get().split(' - ')[0]
 
-            # Выполнение запроса с дополнительной проверкой
-            try:
-                data = fetch_report(
-                    login=login,
-                    token=token,
-                    counter_id=counter_id,
-                    report_type=self.report_type.get(),
-                    metrics=selected_metrics,
-                    date1=date1,
-                    date2=date2,
-                    attribution=attribution
-                )
-
-                # Вместо автоматического сохранения вызываем диалог
-                self.save_report(data)
-
-            except Exception as e:
-                logger.error(f"Ошибка при получении отчета: {str(e)}")
-                raise
+            # Файл выбирается до начала выгрузки, сама выгрузка идет в фоне
+            filepath = self.ask_report_path()
+            if not filepath:  # Если пользователь отменил выбор
+                return
+
+            self.start_job(filepath, {
+                'login': login,
+                'token': token,
+                'counter_id': counter_id,
+                'report_type': self.report_type.get(),
+                'metrics': selected_metrics,
+                'date1': date1,
+                'date2': date2,
+                'attribution': attribution,
+            })
 
         except Exception as e:
             messagebox.showerror("Ошибка", str(e))
@@ -453,10 +593,21 @@ class MetrikaApp:
 
     def on_closing(self):
         """Обработчик закрытия окна"""
+        if self.jobs:
+            if not messagebox.askokcancel("Выход", "Не все выгрузки завершены. Отменить их и закрыть приложение?"):
+                return
+            # Окно закроется в poll_jobs, когда выгрузки освободят запросы в API
+            self.save_settings()
+            self.closing = True
+            for job_id, job in self.jobs.items():
+                job.cancel()
+                self.jobs_view.set(str(job_id), 'status', "Отмена...")
+            return
         self.save_settings()
         self.root.destroy()
 
 def main():
+    setup_logging()
     root = tk.Tk()
     app = MetrikaApp(root)
     root.mainloop()
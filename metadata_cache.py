@@ -0,0 +1,73 @@
+﻿import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Каталог кеша метаданных (список счетчиков, цели) по токенам - общий для всех
+# процессов на машине, как файл ограничителя частоты, и не зависит от текущего каталога
+METADATA_DIR = os.path.join(tempfile.gettempdir(), 'metrika_metadata')
+# Время жизни записей кеша (секунд)
+METADATA_TTL = 60 * 60
+
+
+def token_key(token):
+    """Имя каталога токена: хеш, сам токен на диск не пишется"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+
+class MetadataCache:
+    """
+    Кеш метаданных API управления на диске с временем жизни ttl.
+    Записи хранятся по токенам (cache_dir/<хеш токена>/<имя>.json), поэтому
+    кеш общий для всех заданий и процессов, а при ответе 401/403 все записи
+    токена удаляются (invalidate).
+    """
+
+    def __init__(self, cache_dir=METADATA_DIR, ttl=METADATA_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _path(self, token, name):
+        return os.path.join(self.cache_dir, token_key(token), f"{name}.json")
+
+    def get(self, token, name):
+        """Значение записи или None, если ее нет или она устарела"""
+        path = self._path(token, name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('saved_at', 0) > self.ttl:
+            return None
+        return entry.get('value')
+
+    def put(self, token, name, value):
+        """Атомарная запись значения"""
+        path = self._path(token, name)
+        # Каталог токена доступен только владельцу
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.meta_', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': time.time(), 'value': value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def cached(self, token, name, load):
+        """Значение из кеша или результат load(), который сохраняется в кеш"""
+        value = self.get(token, name)
+        if value is None:
+            value = load()
+            self.put(token, name, value)
+        return value
+
+    def invalidate(self, token):
+        """Удаление всех записей токена"""
+        path = os.path.join(self.cache_dir, token_key(token))
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info("Кеш метаданных токена сброшен")
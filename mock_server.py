@@ -0,0 +1,422 @@
+﻿"""
+Локальная имитация Logs API Яндекс.Метрики: проверка выгрузки без доступа
+к API и замеры производительности (benchmark.py).
+
+    python mock_server.py --port 8080 --parts 4 --rows 100000 --polls 2
+    METRIKA_API_URL=http://127.0.0.1:8080/management/v1 python cli.py export 1 --fields ym:s:date,ym:s:clientID
+
+Сервер хранит запросы в памяти и проходит те же статусы, что и API
+(created -> processing -> processed, canceled, cleaned_by_user), отдает
+части TSV (в gzip, если клиент его принимает) и по настройкам отвечает 429
+и медленно отдает выбранные части.
+"""
+import re
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+MOCK_HOST = '127.0.0.1'
+MOCK_PORT = 8080
+# Путь API управления, как у настоящего API
+API_PREFIX = '/management/v1'
+# Размер блока при отправке части (байт)
+SEND_CHUNK_SIZE = 256 * 1024
+
+# Значения категориальных полей
+MOCK_TRAFFIC_SOURCES = ('organic', 'direct', 'ad', 'internal', 'referral', 'social')
+MOCK_DEVICES = ('desktop', 'mobile', 'tablet')
+MOCK_BROWSERS = ('chrome', 'yandex_browser', 'safari', 'firefox', 'edge')
+
+
+def mock_value(field, row_number, day):
+    """Значение поля для строки row_number за день day (по окончанию имени поля)"""
+    name = field.split(':')[-1]
+    lower = name.lower()
+    if name == 'date':
+        return day.strftime("%Y-%m-%d")
+    if name == 'dateTime':
+        return f"{day.strftime('%Y-%m-%d')} {row_number // 3600 % 24:02d}:{row_number // 60 % 60:02d}:{row_number % 60:02d}"
+    if name == 'goalsID':
+        return '[' + ','.join(str(goal_id) for goal_id in range(1, row_number % 4 + 1)) + ']'
+    if name == 'goalsDateTime':
+        return '[' + ','.join(f"'{day.strftime('%Y-%m-%d')} 12:00:00'" for _ in range(row_number % 4)) + ']'
+    if lower.endswith('id'):
+        return str(10 ** 15 + row_number * 7919)
+    if lower.endswith(('url', 'referer')):
+        return f"https://example.com/page/{row_number % 1000}?utm_source=mock&n={row_number}"
+    if lower.endswith('trafficsource'):
+        return MOCK_TRAFFIC_SOURCES[row_number % len(MOCK_TRAFFIC_SOURCES)]
+    if lower.endswith('devicecategory'):
+        return MOCK_DEVICES[row_number % len(MOCK_DEVICES)]
+    if lower.endswith('browser'):
+        return MOCK_BROWSERS[row_number % len(MOCK_BROWSERS)]
+    if lower.startswith('is') or lower == 'bounce':
+        return str(row_number % 2)
+    if lower in ('pageviews', 'visitduration', 'hits'):
+        return str(row_number % 50)
+    return f"{name}_{row_number % 100}"
+
+
+def tsv_escape(value):
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+class MockLogsAPI:
+    """
+    Состояние имитации Logs API и обработка запросов (без HTTP).
+
+    parts и rows_per_part - количество частей готового запроса и строк
+    в каждой; polls - сколько проверок статуса запрос остается в обработке;
+    throttle_every - каждый N-й запрос к API получает 429 с Retry-After
+    retry_after секунд (0 - не отвечать 429); slow_parts - номера частей,
+    которые отдаются со скоростью slow_bandwidth байт/с; max_days -
+    ограничение периода в оценке запроса (None - любой период возможен).
+    """
+
+    def __init__(self, parts=2, rows_per_part=10000, polls=1, use_gzip=True, throttle_every=0, retry_after=1,
+                 slow_parts=(), slow_bandwidth=1024 * 1024, max_days=None, counter_id=1, goals=3,
+                 time_zone_name='Europe/Moscow'):
+        self.parts = parts
+        self.rows_per_part = rows_per_part
+        self.polls = polls
+        self.use_gzip = use_gzip
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.slow_parts = set(slow_parts)
+        self.slow_bandwidth = slow_bandwidth
+        self.max_days = max_days
+        self.counter_id = counter_id
+        self.goals = goals
+        self.time_zone_name = time_zone_name
+        self.requests = {}  # request_id -> описание запроса
+        self.stats = {'requests': 0, 'throttled': 0, 'created': 0, 'polls': 0, 'parts': 0, 'bytes': 0}
+        self._next_id = 1000
+        self._bodies = {}   # (поля, date1, date2, номер части, gzip) -> тело части
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def throttled(self):
+        """Нужно ли ответить 429 на очередной запрос"""
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.throttle_every and self.stats['requests'] % self.throttle_every == 0:
+                self.stats['throttled'] += 1
+                return True
+        return False
+
+    def part_body(self, log_request, part_number, compressed):
+        """TSV части (строится один раз для набора полей и периода)"""
+        key = (tuple(log_request['fields']), log_request['date1'], log_request['date2'], part_number, compressed)
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is not None:
+            return body
+        if compressed:
+            body = gzip.compress(self.part_body(log_request, part_number, False), compresslevel=1)
+        else:
+            fields = log_request['fields']
+            date1 = datetime.strptime(log_request['date1'], "%Y-%m-%d").date()
+            days = (datetime.strptime(log_request['date2'], "%Y-%m-%d").date() - date1).days + 1
+            first_row = part_number * self.rows_per_part
+            lines = ['\t'.join(fields)]
+            for row_number in range(first_row, first_row + self.rows_per_part):
+                day = date1 + timedelta(days=row_number % days)
+                lines.append('\t'.join(tsv_escape(mock_value(field, row_number, day)) for field in fields))
+            body = ('\n'.join(lines) + '\n').encode('utf-8')
+        with self._lock:
+            self._bodies[key] = body
+        return body
+
+    def prepare(self, fields, date1, date2):
+        """Заранее построить части, чтобы их генерация не попадала в замеры"""
+        log_request = {'fields': list(fields), 'date1': date1, 'date2': date2}
+        for part_number in range(self.parts):
+            for compressed in (False, True):
+                self.part_body(log_request, part_number, compressed)
+
+    def new_request(self, counter_id, params):
+        fields = [field for field in params.get('fields', '').split(',') if field]
+        if not fields or not params.get('date1') or not params.get('date2'):
+            return 400, error_payload(400, "Не заданы fields, date1 или date2")
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+        log_request = {
+            'request_id': request_id,
+            'counter_id': int(counter_id),
+            'source': params.get('source', 'visits'),
+            'date1': params['date1'],
+            'date2': params['date2'],
+            'fields': fields,
+            'attribution': params.get('attribution', 'last'),
+            'status': 'created',
+            'size': 0,
+            'polls': 0,
+        }
+        self.requests[request_id] = log_request
+        self.count('created')
+        return 200, {'log_request': public_request(log_request)}
+
+    def poll(self, log_request):
+        """Описание запроса; статус меняется по числу проверок"""
+        self.count('polls')
+        if log_request['status'] in ('created', 'processing'):
+            log_request['polls'] += 1
+            if log_request['polls'] > self.polls:
+                log_request['status'] = 'processed'
+                log_request['parts'] = [
+                    {'part_number': part_number, 'size': len(self.part_body(log_request, part_number, False))}
+                    for part_number in range(self.parts)
+                ]
+                log_request['size'] = sum(part['size'] for part in log_request['parts'])
+            else:
+                log_request['status'] = 'processing'
+        return {'log_request': public_request(log_request)}
+
+    def evaluate(self, params):
+        try:
+            days = (datetime.strptime(params['date2'], "%Y-%m-%d") - datetime.strptime(params['date1'], "%Y-%m-%d")).days + 1
+        except (KeyError, ValueError):
+            return 400, error_payload(400, "Неверные даты")
+        max_days = self.max_days if self.max_days is not None else 1000
+        return 200, {'log_request_evaluation': {'possible': days <= max_days, 'max_possible_day_quantity': max_days}}
+
+    def handle(self, method, path, params):
+        """
+        Ответ на запрос к API: (код, JSON-объект), (204, None) или
+        (200, (номер части, запрос)) для загрузки части.
+        """
+        if not path.startswith(API_PREFIX):
+            return 404, error_payload(404, "Неизвестный путь")
+        path = path[len(API_PREFIX):].rstrip('/')
+
+        if method == 'GET' and path == '/counters':
+            return 200, {'counters': [{
+                'id': self.counter_id, 'name': 'Mock counter', 'site': 'example.com',
+                'time_zone_name': self.time_zone_name,
+            }]}
+        match = re.fullmatch(r'/counter/(\d+)/goals', path)
+        if method == 'GET' and match:
+            return 200, {'goals': [{'id': goal_id, 'name': f"Goal {goal_id}"} for goal_id in range(1, self.goals + 1)]}
+        match = re.fullmatch(r'/counter/(\d+)/logrequests/evaluate', path)
+        if method == 'GET' and match:
+            return self.evaluate(params)
+        match = re.fullmatch(r'/counter/(\d+)/logrequests', path)
+        if match:
+            if method == 'POST':
+                return self.new_request(match.group(1), params)
+            return 200, {'requests': [
+                public_request(log_request) for log_request in list(self.requests.values())
+                if log_request['counter_id'] == int(match.group(1))
+            ]}
+
+        match = re.fullmatch(r'/counter/(\d+)/logrequest/(\d+)(/[a-z]+)?(?:/(\d+)/download)?', path)
+        log_request = self.requests.get(int(match.group(2))) if match else None
+        if log_request is None:
+            return 404, error_payload(404, "Запрос не найден")
+        action = match.group(3)
+        if action is None and method == 'GET':
+            return 200, self.poll(log_request)
+        if (action == '/clean' and method == 'POST') or (action is None and method == 'DELETE'):
+            if log_request['status'] != 'processed':
+                return 400, error_payload(400, "Очистить можно только готовый запрос")
+            log_request['status'] = 'cleaned_by_user'
+            del self.requests[log_request['request_id']]
+            if method == 'DELETE':
+                return 204, None
+            return 200, {'log_request': public_request(log_request)}
+        if action == '/cancel' and method == 'POST':
+            if log_request['status'] not in ('created', 'processing'):
+                return 400, error_payload(400, "Отменить можно только готовящийся запрос")
+            log_request['status'] = 'canceled'
+            del self.requests[log_request['request_id']]
+            return 200, {'log_request': public_request(log_request)}
+        if action == '/part' and method == 'GET' and match.group(4) is not None:
+            part_number = int(match.group(4))
+            if log_request['status'] != 'processed' or part_number >= self.parts:
+                return 400, error_payload(400, "Часть недоступна")
+            return 200, (part_number, log_request)
+        return 405, error_payload(405, "Метод не поддерживается")
+
+
+def public_request(log_request):
+    """Описание запроса в формате API (без служебных полей)"""
+    return {key: value for key, value in log_request.items() if key != 'polls'}
+
+
+def error_payload(code, message):
+    return {'errors': [{'error_type': 'invalid_parameter', 'message': message}], 'code': code, 'message': message}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def send_body(self, status, body, content_type='application/json', extra_headers=None, bandwidth=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        for start in range(0, len(body), SEND_CHUNK_SIZE):
+            chunk = body[start:start + SEND_CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+
+    def dispatch(self):
+        api = self.server.api
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        if not self.headers.get('Authorization', '').startswith('OAuth '):
+            self.send_body(401, json.dumps(error_payload(401, "Нет токена")).encode('utf-8'))
+            return
+        if api.throttled():
+            self.send_body(429, json.dumps(error_payload(429, "Превышен лимит запросов")).encode('utf-8'),
+                           extra_headers={'Retry-After': str(api.retry_after)})
+            return
+
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            payload = json.loads(data) if data else {}
+        except ValueError:
+            payload = {}
+        if isinstance(payload, dict):
+            # Параметры создания запроса передаются и в URL, и в теле
+            for key, value in payload.items():
+                params.setdefault(key, ','.join(value) if isinstance(value, list) else str(value))
+        status, payload = api.handle(self.command, url.path, params)
+        if payload is None:
+            self.send_body(status, b'')
+            return
+        if not isinstance(payload, tuple):
+            self.send_body(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+            return
+
+        part_number, log_request = payload
+        compressed = api.use_gzip and 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = api.part_body(log_request, part_number, compressed)
+        extra_headers = {'Content-Encoding': 'gzip'} if compressed else {}
+        status = 200
+        # Докачка: Range bytes=N- (N за концом части - 416, как у API)
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            if start >= len(body):
+                self.send_body(416, b'', extra_headers={'Content-Range': f"bytes */{len(body)}"})
+                return
+            status = 206
+            extra_headers['Content-Range'] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            body = body[start:]
+        api.count('parts')
+        api.count('bytes', len(body))
+        self.send_body(
+            status, body, content_type='text/tab-separated-values; charset=utf-8', extra_headers=extra_headers,
+            bandwidth=api.slow_bandwidth if part_number in api.slow_parts else None
+        )
+
+    do_GET = dispatch
+    do_POST = dispatch
+    do_DELETE = dispatch
+
+
+class MockServer(ThreadingHTTPServer):
+    """HTTP-сервер имитации: api - состояние (MockLogsAPI), url - базовый URL для METRIKA_API_URL"""
+    daemon_threads = True
+
+    def __init__(self, address, api):
+        self.api = api
+        super().__init__(address, MockRequestHandler)
+
+    def handle_error(self, request, client_address):
+        # Клиент может закрыть соединение сам (например, после ответа 429)
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+
+def start_mock_server(host=MOCK_HOST, port=0, **settings):
+    """
+    Запуск сервера в фоновом потоке (port=0 - свободный порт).
+    settings передаются в MockLogsAPI. Остановка - server.shutdown().
+    """
+    server = MockServer((host, port), MockLogsAPI(**settings))
+    threading.Thread(target=server.serve_forever, name='mock-logs-api', daemon=True).start()
+    logger.info(f"Имитация Logs API запущена: {server.url}")
+    return server
+
+
+def add_server_arguments(parser):
+    """Параметры имитации (общие для mock_server.py и benchmark.py)"""
+    parser.add_argument('--parts', type=int, default=2, help="частей в готовом запросе")
+    parser.add_argument('--rows', type=int, default=10000, help="строк в каждой части")
+    parser.add_argument('--polls', type=int, default=1, help="сколько проверок статуса запрос готовится")
+    parser.add_argument('--no-gzip', action='store_true', help="отдавать части без сжатия")
+    parser.add_argument('--throttle-every', type=int, default=0, help="отвечать 429 на каждый N-й запрос")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After в ответах 429 (секунд)")
+    parser.add_argument('--slow-parts', type=lambda value: [int(part) for part in value.split(',') if part],
+                        default=[], help="номера медленных частей через запятую")
+    parser.add_argument('--slow-bandwidth', type=int, default=1024 * 1024,
+                        help="скорость отдачи медленных частей (байт/с)")
+    parser.add_argument('--max-days', type=int, help="максимальный период одного запроса в оценке (дней)")
+
+
+def server_settings(args):
+    return {
+        'parts': args.parts,
+        'rows_per_part': args.rows,
+        'polls': args.polls,
+        'use_gzip': not args.no_gzip,
+        'throttle_every': args.throttle_every,
+        'retry_after': args.retry_after,
+        'slow_parts': args.slow_parts,
+        'slow_bandwidth': args.slow_bandwidth,
+        'max_days': args.max_days,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная имитация Logs API Яндекс.Метрики")
+    parser.add_argument('--host', default=MOCK_HOST)
+    parser.add_argument('--port', type=int, default=MOCK_PORT)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    server = MockServer((args.host, args.port), MockLogsAPI(**server_settings(args)))
+    print(f"METRIKA_API_URL={server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Статистика: {server.api.stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
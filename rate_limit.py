@@ -0,0 +1,226 @@
+﻿import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from requests.adapters import HTTPAdapter
+
+# Блокировка файла состояния между процессами
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Каталог файлов общего состояния ограничителей для всех процессов на машине (по файлу на токен)
+RATE_LIMIT_DIR = tempfile.gettempdir()
+
+# Заголовки с остатком квоты и временем ее восстановления (если API их возвращает)
+QUOTA_REMAINING_HEADERS = ('X-RateLimit-Remaining', 'RateLimit-Remaining')
+QUOTA_RESET_HEADERS = ('X-RateLimit-Reset', 'RateLimit-Reset')
+
+
+def parse_retry_after(value):
+    """Пауза в секундах из заголовка Retry-After (число секунд или HTTP-дата), None если не разобрать"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_quota_reset(value):
+    """
+    Пауза до восстановления квоты: значение - число секунд или
+    unix-время (если оно больше текущего времени).
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if value > time.time():
+        value -= time.time()
+    return max(0.0, value)
+
+
+def rate_limit_file(token, state_dir=RATE_LIMIT_DIR):
+    """Файл состояния ограничителя токена: имя по хешу, сам токен на диск не пишется"""
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(state_dir, f"metrika_rate_limit_{digest}.json")
+
+
+def request_token(request):
+    """OAuth-токен из заголовка Authorization запроса ('' если заголовка нет)"""
+    authorization = request.headers.get('Authorization', '')
+    return authorization[len('OAuth '):] if authorization.startswith('OAuth ') else ''
+
+
+@contextmanager
+def _file_lock(path):
+    """Монопольная блокировка файла (fcntl в Linux/macOS, msvcrt в Windows)"""
+    with open(path, 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов "корзина токенов": в среднем rate
+    запросов в секунду, пачкой не больше capacity.
+
+    Если задан state_path, состояние корзины хранится в файле под
+    блокировкой, и лимит общий для всех процессов, использующих этот файл.
+    После ответа 429 или исчерпания квоты (penalize) запросы всех потоков
+    и процессов приостанавливаются до указанного времени.
+    """
+
+    def __init__(self, rate, capacity, state_path=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {'tokens': self.capacity, 'updated': time.time(), 'blocked_until': 0.0}
+
+    @contextmanager
+    def _shared_state(self):
+        """Состояние корзины на время изменения (из файла, если он задан)"""
+        with self._lock:
+            if self.state_path is None:
+                yield self._state
+                return
+            with _file_lock(self.state_path + '.lock'):
+                state = dict(self._state)
+                try:
+                    with open(self.state_path, 'r', encoding='utf-8') as f:
+                        state.update(json.load(f))
+                except (OSError, ValueError):
+                    pass
+                yield state
+                tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+
+    def for_token(self, token):
+        """Ограничитель для запросов с токеном token: одна корзина на все токены"""
+        return self
+
+    def reserve(self):
+        """Занять токен, возвращает паузу (секунд) перед отправкой запроса"""
+        with self._shared_state() as state:
+            now = time.time()
+            tokens = min(self.capacity, state['tokens'] + (now - state['updated']) * self.rate)
+            tokens -= 1
+            state['tokens'] = tokens
+            state['updated'] = now
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+            return max(wait, state['blocked_until'] - now)
+
+    def acquire(self):
+        """Дождаться разрешения на запрос"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def penalize(self, delay):
+        """Приостановить все запросы на delay секунд"""
+        with self._shared_state() as state:
+            state['blocked_until'] = max(state['blocked_until'], time.time() + delay)
+            # Накопленные токены сгорают, чтобы после паузы не было всплеска запросов
+            state['tokens'] = min(state['tokens'], 0.0)
+
+    def update_quota(self, headers):
+        """Учесть заголовки квоты из ответа: при нулевом остатке ждать ее восстановления"""
+        remaining = next((headers[name] for name in QUOTA_REMAINING_HEADERS if name in headers), None)
+        if remaining is None:
+            return
+        try:
+            if float(remaining) > 0:
+                return
+        except ValueError:
+            return
+        reset = next((headers[name] for name in QUOTA_RESET_HEADERS if name in headers), None)
+        delay = parse_quota_reset(reset)
+        if delay:
+            logger.warning(f"Квота API исчерпана, запросы приостановлены на {delay:.0f} с")
+            self.penalize(delay)
+
+
+class TokenBuckets:
+    """
+    Ограничители по OAuth-токенам: квоты API считаются на токен, поэтому
+    у каждого токена своя корзина (TokenBucket) со своим файлом состояния
+    в state_dir (rate_limit_file), общим для всех процессов на машине.
+    Пауза после 429 одного токена не задерживает запросы других.
+    state_dir=None - состояние только в памяти процесса.
+    """
+
+    def __init__(self, rate, capacity, state_dir=RATE_LIMIT_DIR):
+        self.rate = rate
+        self.capacity = capacity
+        self.state_dir = state_dir
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def for_token(self, token):
+        """Корзина токена (создается при первом запросе)"""
+        with self._lock:
+            bucket = self._buckets.get(token)
+            if bucket is None:
+                state_path = rate_limit_file(token, self.state_dir) if self.state_dir is not None else None
+                bucket = self._buckets[token] = TokenBucket(self.rate, self.capacity, state_path)
+            return bucket
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, который перед каждым запросом ждет разрешения ограничителя
+    токена запроса (limiter - TokenBucket или TokenBuckets), а ответы 429
+    повторяет сам: пауза из Retry-After применяется ко всем запросам,
+    использующим тот же ограничитель (и файл состояния).
+    Остальные повторы (ошибки сети, 5xx) выполняет urllib3 по max_retries.
+    """
+
+    def __init__(self, limiter, rate_limit_retries=3, rate_limit_delay=10.0, **kwargs):
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+        self.rate_limit_delay = rate_limit_delay
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        limiter = self.limiter.for_token(request_token(request))
+        for attempt in range(self.rate_limit_retries + 1):
+            limiter.acquire()
+            response = super().send(request, **kwargs)
+            limiter.update_quota(response.headers)
+            if response.status_code != 429 or attempt == self.rate_limit_retries:
+                return response
+            delay = parse_retry_after(response.headers.get('Retry-After'))
+            if delay is None:
+                delay = self.rate_limit_delay * (2 ** attempt)
+            logger.warning(f"Ответ API 429, пауза {delay:.1f} с, повтор {attempt + 1}/{self.rate_limit_retries}")
+            limiter.penalize(delay)
+            response.close()
@@ -0,0 +1,140 @@
+﻿import os
+import io
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+
+# zstandard сжимает быстрее и лучше gzip, но не обязателен
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Каталог локального кеша выгруженных дней (не зависит от текущего каталога)
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'metrika_cache')
+# Максимальный размер кеша, при превышении удаляются давно не использованные дни
+CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+CACHE_EXTENSIONS = ('.tsv.zst', '.tsv.gz')
+
+
+def cache_key(counter_id, fields, day, attribution):
+    """Ключ дня в кеше: хеш счетчика, набора полей (без учета порядка), даты и атрибуции"""
+    payload = json.dumps(
+        [str(counter_id), sorted(set(fields)), str(day), attribution],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CacheWriter:
+    """Запись одного дня в кеш: данные пишутся во временный файл и публикуются в commit()"""
+
+    def __init__(self, cache_dir, final_path):
+        self.final_path = final_path
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.cache_', dir=os.path.dirname(final_path))
+        self._raw = os.fdopen(fd, 'wb')
+        if final_path.endswith('.zst'):
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        self.lines = 0
+
+    def write_line(self, line):
+        """Запись строки TSV (без перевода строки)"""
+        self._stream.write(line.encode('utf-8') + b'\n')
+        self.lines += 1
+
+    def _close(self):
+        self._stream.close()
+        self._raw.close()
+
+    def commit(self):
+        """Публикация дня в кеше"""
+        self._close()
+        os.replace(self.tmp_path, self.final_path)
+
+    def discard(self):
+        """Отмена записи (например, если загрузка прервалась)"""
+        self._close()
+        os.remove(self.tmp_path)
+
+
+class DayCache:
+    """
+    Локальный кеш выгруженных дней. Каждый день хранится отдельным сжатым
+    TSV-файлом, имя файла - ключ cache_key. При чтении время изменения
+    файла обновляется, и при превышении max_bytes удаляются дни, которые
+    дольше всего не использовались (LRU).
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key, extension):
+        return os.path.join(self.cache_dir, key[:2], key + extension)
+
+    def find(self, counter_id, fields, day, attribution):
+        """Путь к файлу дня в кеше или None"""
+        key = cache_key(counter_id, fields, day, attribution)
+        for extension in CACHE_EXTENSIONS:
+            path = self._path(key, extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def iter_lines(self, path):
+        """Строки TSV из файла кеша (первая строка - заголовки)"""
+        # Отметка использования для LRU
+        os.utime(path)
+        with open(path, 'rb') as raw:
+            if path.endswith('.zst'):
+                stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+            else:
+                stream = gzip.GzipFile(fileobj=raw, mode='rb')
+            with stream:
+                for line in stream:
+                    yield line.rstrip(b'\n').decode('utf-8')
+
+    def writer(self, counter_id, fields, day, attribution):
+        """Запись дня в кеш"""
+        key = cache_key(counter_id, fields, day, attribution)
+        extension = CACHE_EXTENSIONS[0] if zstandard is not None else CACHE_EXTENSIONS[1]
+        return CacheWriter(self.cache_dir, self._path(key, extension))
+
+    def evict(self):
+        """Удаление давно не использованных дней, пока кеш больше max_bytes"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(CACHE_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Из кеша удалено дней: {removed}, размер кеша: {total} байт")
+        return removed
@@ -0,0 +1,236 @@
+﻿import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from api_logic import (
+    GOALS_FIELD, counter_today, fetch_report_stream, format_tsv_value, get_counter_goals, iter_tsv_rows,
+    parse_date, report_source, save_stream_to_csv, save_stream_to_parquet, setup_logging
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних дней Метрика еще может пересчитать: они загружаются повторно
+REVISION_DAYS = 3
+# Начало периода при первой синхронизации
+SYNC_START = '30daysAgo'
+# Файл состояния синхронизации в каталоге набора данных
+SYNC_STATE_FILE = 'sync.json'
+# Сколько файлов дней держать открытыми при раскладке строк
+SPOOL_OPEN_FILES = 64
+
+SAVERS = {
+    'csv': lambda rows, path, attribution, goals_ids: save_stream_to_csv(
+        rows, path, attribution, goals_ids, drop_empty_columns=False
+    ),
+    'parquet': save_stream_to_parquet,
+}
+
+
+def date_field(fields):
+    """Поле даты для источника полей (ym:s:date или ym:pv:date)"""
+    return 'ym:s:date' if report_source(fields) == 'visits' else 'ym:pv:date'
+
+
+def load_state(dataset_dir):
+    """Состояние синхронизации набора данных или None"""
+    path = os.path.join(dataset_dir, SYNC_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(dataset_dir, state):
+    """Атомарная запись состояния синхронизации"""
+    fd, tmp_path = tempfile.mkstemp(prefix='.sync_', dir=dataset_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(dataset_dir, SYNC_STATE_FILE))
+
+
+def sync_window(state, start_date=SYNC_START, revision_days=REVISION_DAYS, today=None):
+    """
+    Период, который нужно загрузить: новые дни после last_date плюс последние
+    revision_days дней, которые Метрика еще может изменить. Сегодняшний
+    (незавершенный) день не загружается. Возвращает (date1, date2) или None.
+    """
+    today = today or datetime.now().date()
+    date2 = today - timedelta(days=1)
+    if state is None or not state.get('last_date'):
+        date1 = parse_date(start_date)
+    else:
+        first_date = parse_date(state['first_date'])
+        next_date = parse_date(state['last_date']) + timedelta(days=1)
+        date1 = max(first_date, min(next_date, today - timedelta(days=revision_days)))
+    if date1 > date2:
+        return None
+    return date1, date2
+
+
+def spool_rows_by_day(rows, day_field, spool_dir):
+    """
+    Раскладка строк по дням во временные TSV-файлы spool_dir/YYYY-MM-DD.tsv.
+    Столбцы идут в порядке первой строки, значения берутся по имени столбца
+    (строки из кеша и из API могут отличаться порядком полей).
+    Возвращает количество строк по дням.
+    """
+    handles = {}
+    counts = {}
+    headers = None
+    try:
+        for row in rows:
+            if headers is None:
+                headers = list(row)
+            day = format_tsv_value(row[day_field])
+            handle = handles.get(day)
+            if handle is None:
+                if len(handles) >= SPOOL_OPEN_FILES:
+                    for opened in handles.values():
+                        opened.close()
+                    handles.clear()
+                handle = open(os.path.join(spool_dir, f"{day}.tsv"), 'a', encoding='utf-8')
+                handles[day] = handle
+                if day not in counts:
+                    handle.write('\t'.join(headers) + '\n')
+                    counts[day] = 0
+            handle.write('\t'.join(format_tsv_value(row[header]) for header in headers) + '\n')
+            counts[day] += 1
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return counts
+
+
+def iter_spool_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def sync_counter(token, counter_id, fields, dataset_dir, start_date=SYNC_START, attribution='last',
+                 output_format='csv', revision_days=REVISION_DAYS, login='', **options):
+    """
+    Инкрементальная синхронизация набора данных счетчика в dataset_dir.
+
+    Набор данных - файлы по дням (YYYY-MM-DD.csv или .parquet) и файл
+    состояния sync.json с последней полностью загруженной датой. Каждый
+    запуск загружает только новые дни (до вчерашнего включительно) и
+    последние revision_days дней, а файлы этих дней перезаписываются.
+    Первый запуск загружает период с start_date.
+
+    Вчерашний день определяется по часовому поясу счетчика.
+    Поле даты добавляется к полям автоматически. Столбцы целей берутся из
+    API управления, чтобы у всех файлов набора был одинаковый состав столбцов.
+    Остальные параметры (max_workers, chunk_days, use_cache, ...)
+    передаются в fetch_report_stream.
+    Возвращает словарь с ключами date1, date2, rows, days (или None, если
+    загружать нечего).
+    """
+    if output_format not in SAVERS:
+        raise ValueError(f"Неподдерживаемый формат выгрузки: {output_format}")
+    fields = list(fields)
+    day_field = date_field(fields)
+    if day_field not in fields:
+        fields.insert(0, day_field)
+
+    os.makedirs(dataset_dir, exist_ok=True)
+    state = load_state(dataset_dir)
+    if state is not None:
+        if (state['counter_id'] != str(counter_id) or state['fields'] != fields
+                or state['attribution'] != attribution or state['format'] != output_format):
+            raise ValueError(
+                f"Набор данных {dataset_dir} создан с другими параметрами "
+                f"(счетчик, поля, атрибуция или формат), выберите другой каталог"
+            )
+
+    window = sync_window(state, start_date, revision_days, today=counter_today(token, counter_id))
+    if window is None:
+        logger.info(f"Набор данных {dataset_dir} актуален, загружать нечего")
+        return None
+    date1, date2 = window
+    logger.info(f"Синхронизация счетчика {counter_id}: период {date1} - {date2}")
+
+    goals_ids = get_counter_goals(token, counter_id) if GOALS_FIELD in fields else None
+    save = SAVERS[output_format]
+
+    spool_dir = tempfile.mkdtemp(prefix='.sync_', dir=dataset_dir)
+    try:
+        rows = fetch_report_stream(
+            login, token, counter_id, report_source(fields), fields,
+            date1.strftime("%Y-%m-%d"), date2.strftime("%Y-%m-%d"), attribution, **options
+        )
+        try:
+            counts = spool_rows_by_day(rows, day_field, spool_dir)
+        finally:
+            rows.close()
+
+        day = date1
+        while day <= date2:
+            day_name = day.strftime("%Y-%m-%d")
+            target = os.path.join(dataset_dir, f"{day_name}.{output_format}")
+            spool_path = os.path.join(spool_dir, f"{day_name}.tsv")
+            if os.path.exists(spool_path):
+                tmp_path = os.path.join(spool_dir, f"{day_name}.{output_format}")
+                save(iter_tsv_rows(iter_spool_lines(spool_path)), tmp_path, attribution, goals_ids)
+                os.replace(tmp_path, target)
+            elif os.path.exists(target):
+                # За день больше нет данных
+                os.remove(target)
+            day += timedelta(days=1)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    if state is None:
+        state = {
+            'counter_id': str(counter_id),
+            'fields': fields,
+            'attribution': attribution,
+            'format': output_format,
+            'first_date': date1.strftime("%Y-%m-%d"),
+        }
+    state['last_date'] = date2.strftime("%Y-%m-%d")
+    state['synced_at'] = datetime.now().isoformat(timespec='seconds')
+    save_state(dataset_dir, state)
+
+    row_count = sum(counts.values())
+    logger.info(f"Синхронизация счетчика {counter_id} завершена: {row_count} строк, дней с данными: {len(counts)}")
+    return {'date1': date1, 'date2': date2, 'rows': row_count, 'days': len(counts)}
+
+
+def main(argv=None, log_dir='logs'):
+    parser = argparse.ArgumentParser(description="Инкрементальная синхронизация логов Яндекс.Метрики по дням")
+    parser.add_argument('counter_id', help="ID счетчика")
+    parser.add_argument('dataset_dir', help="каталог набора данных")
+    parser.add_argument('--fields', required=True, help="поля через запятую")
+    parser.add_argument('--token', default=os.environ.get('METRIKA_TOKEN'),
+                        help="OAuth-токен (по умолчанию из METRIKA_TOKEN)")
+    parser.add_argument('--start', default=SYNC_START, help="начало периода при первой синхронизации")
+    parser.add_argument('--attribution', default='last')
+    parser.add_argument('--format', choices=sorted(SAVERS), default='csv')
+    parser.add_argument('--revision-days', type=int, default=REVISION_DAYS,
+                        help="сколько последних дней загружать повторно")
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error("не задан токен (--token или METRIKA_TOKEN)")
+
+    if log_dir:
+        setup_logging(log_dir)
+    fields = [field.strip() for field in args.fields.split(',') if field.strip()]
+    result = sync_counter(
+        args.token, args.counter_id, fields, args.dataset_dir, start_date=args.start,
+        attribution=args.attribution, output_format=args.format, revision_days=args.revision_days
+    )
+    if result is None:
+        print("Набор данных актуален")
+    else:
+        print(f"Загружено {result['rows']} строк за {result['date1']} - {result['date2']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
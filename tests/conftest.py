@@ -0,0 +1,38 @@
+﻿import os
+import sys
+import datetime as _datetime
+
+import pytest
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_logic
+from mock_server import start_mock_server
+from rate_limit import TokenBucket
+from metadata_cache import MetadataCache
+
+
+@pytest.fixture
+def mock_api(monkeypatch, tmp_path):
+    """
+    Локальная имитация Logs API (mock_server.py): api_logic направляется на нее,
+    ограничитель частоты и кеш метаданных - свои для теста.
+    """
+    server = start_mock_server(rows_per_part=50, parts=2, polls=1)
+    monkeypatch.setattr(api_logic, 'API_BASE_URL', server.url)
+    monkeypatch.setattr(api_logic, 'POLL_INITIAL_DELAY', 0.01)
+    monkeypatch.setattr(api_logic.adapter, 'limiter', TokenBucket(1000, 1000))
+    monkeypatch.setattr(api_logic, 'metadata_cache', MetadataCache(str(tmp_path / 'metadata')))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def frozen_datetime(year, month, day):
+    """Подмена datetime, у которой now() возвращает заданный день"""
+    class FrozenDatetime(_datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(year, month, day, 12, 0, 0)
+    return FrozenDatetime
@@ -0,0 +1,33 @@
+﻿import asyncio
+
+import api_logic
+import async_api
+from rate_limit import TokenBucket
+
+
+def test_auth_error_invalidates_metadata_cache(mock_api, monkeypatch):
+    monkeypatch.setattr(async_api, 'rate_limiter', TokenBucket(1000, 1000))
+    api_logic.metadata_cache.put('revoked', 'counters', [{'id': 1}])
+
+    async def validate():
+        async with async_api.AsyncLogsClient('revoked', base_url=mock_api.url) as client:
+            # Без заголовка Authorization имитация API отвечает 401
+            monkeypatch.setattr(client, '_headers', lambda **extra: dict(extra))
+            return await client.validate_token()
+
+    assert asyncio.run(validate()) is False
+    assert api_logic.metadata_cache.get('revoked', 'counters') is None
+
+
+def test_fetch_report_splits_long_period(mock_api, monkeypatch):
+    monkeypatch.setattr(async_api, 'rate_limiter', TokenBucket(1000, 1000))
+    monkeypatch.setattr(async_api, 'POLL_INITIAL_DELAY', 0.01)
+    mock_api.api.max_days = 2
+
+    async def fetch():
+        async with async_api.AsyncLogsClient('token', base_url=mock_api.url) as client:
+            return await client.fetch_report(1, ['ym:s:visitID', 'ym:s:date'], '2024-01-01', '2024-01-05')
+
+    rows = asyncio.run(fetch())
+    assert mock_api.api.stats['created'] == 3
+    assert {str(row['ym:s:date']) for row in rows} == {f'2024-01-0{day}' for day in range(1, 6)}
@@ -0,0 +1,26 @@
+﻿import threading
+
+import batch
+
+
+def test_token_at_limit_does_not_block_other_tokens(monkeypatch):
+    other_started = threading.Event()
+    waited = []
+
+    def run_job(job, cancel=None):
+        if job['token'] == 'other':
+            other_started.set()
+        else:
+            # Задание занятого токена ждет, пока начнется задание другого токена
+            waited.append(other_started.wait(5))
+        return 1
+
+    monkeypatch.setattr(batch, 'run_job', run_job)
+    jobs = [{'token': 'busy', 'counter_id': n, 'output': f'{n}.csv', 'format': 'csv'} for n in range(3)]
+    jobs.append({'token': 'other', 'counter_id': 9, 'output': '9.csv', 'format': 'csv'})
+
+    results = batch.run_batch(jobs, max_workers=2, per_token_limit=1)
+
+    assert [result['status'] for result in results] == ['ok'] * 4
+    assert [result['job']['counter_id'] for result in results] == [0, 1, 2, 9]
+    assert waited == [True, True, True]
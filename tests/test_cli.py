@@ -0,0 +1,37 @@
+﻿import os
+import sys
+import subprocess
+
+import pytest
+
+import batch
+import cli
+import metadata_cache
+
+
+@pytest.mark.parametrize('argv, command_argv', [
+    (['batch', 'jobs.yaml', '--workers', '8'], ['jobs.yaml', '--workers', '8']),
+    # Значение общего аргумента совпадает с именем команды
+    (['--log-dir', 'batch', 'batch', 'batch', '--per-token', '2'], ['batch', '--per-token', '2']),
+])
+def test_delegated_command_gets_its_arguments(monkeypatch, argv, command_argv):
+    calls = []
+    monkeypatch.setattr(batch, 'main', lambda argv, log_dir=None: calls.append((argv, log_dir)) or 0)
+
+    assert cli.main(argv) == 0
+    assert calls == [(command_argv, 'batch' if argv[0] == '--log-dir' else None)]
+
+
+def test_metadata_dir_does_not_depend_on_cwd():
+    assert os.path.isabs(metadata_cache.METADATA_DIR)
+
+
+def test_export_error_is_printed_once():
+    env = {key: value for key, value in os.environ.items() if key != 'METRIKA_TOKEN'}
+    result = subprocess.run(
+        [sys.executable, 'cli.py', 'export', '12345', '--fields', 'ym:s:date'],
+        cwd=os.path.dirname(os.path.abspath(cli.__file__)), env=env, capture_output=True, text=True
+    )
+
+    assert result.returncode == 1
+    assert result.stderr.count('не заданы параметры: token') == 1
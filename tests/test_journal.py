@@ -0,0 +1,64 @@
+﻿import os
+from datetime import date
+
+import api_logic
+from conftest import frozen_datetime
+from journal import JobJournal
+
+FIELDS = ['ym:s:visitID', 'ym:s:date']
+
+
+def test_resume_rerun_on_other_day_uses_new_period(mock_api, monkeypatch, tmp_path):
+    journal_dir = str(tmp_path / 'journal')
+
+    # Первый запуск 2024-01-10 прерывается посреди загрузки, журнал остается
+    monkeypatch.setattr(api_logic, 'datetime', frozen_datetime(2024, 1, 10))
+    rows = api_logic.iter_report_rows('token', 1, FIELDS, '2daysAgo', 'yesterday', chunk_days=None,
+                                      resume=True, journal_dir=journal_dir, reuse_requests=False)
+    next(rows)
+    rows.close()
+    stale = JobJournal.open(1, FIELDS, '2024-01-08', '2024-01-09', 'last', journal_dir)
+    assert stale.request_id is not None
+
+    # Повторный запуск 2024-01-12 выгружает 10-11 января, а не данные из старого журнала
+    monkeypatch.setattr(api_logic, 'datetime', frozen_datetime(2024, 1, 12))
+    rows = list(api_logic.iter_report_rows('token', 1, FIELDS, '2daysAgo', 'yesterday', chunk_days=None,
+                                           resume=True, journal_dir=journal_dir, reuse_requests=False))
+    assert rows
+    assert {row['ym:s:date'] for row in rows} == {date(2024, 1, 10), date(2024, 1, 11)}
+    assert mock_api.api.stats['created'] == 2
+
+
+def test_job_key_depends_on_dates():
+    assert JobJournal.open(1, FIELDS, '2024-01-08', '2024-01-09', 'last', 'unused').path != \
+        JobJournal.open(1, FIELDS, '2024-01-10', '2024-01-11', 'last', 'unused').path
+
+
+def test_resume_after_full_part_without_done_mark(mock_api, tmp_path):
+    request_id = api_logic.create_log_request('token', 1, FIELDS, '2024-01-08', '2024-01-09', 'last')
+    api_logic.wait_for_request_ready('token', 1, request_id)
+    journal = JobJournal.open(1, FIELDS, '2024-01-08', '2024-01-09', 'last', str(tmp_path))
+    journal.set_request(request_id)
+    api_logic.download_part_to_file('token', 1, request_id, 0, journal)
+    size = os.path.getsize(journal.part_path(0))
+
+    # Процесс остановился после записи последнего блока, но до отметки done
+    journal.update_part(0, done=False)
+    api_logic.download_part_to_file('token', 1, request_id, 0, journal)
+    assert journal.is_part_done(0)
+    assert os.path.getsize(journal.part_path(0)) == size
+
+    # Файл длиннее части (поврежден) - часть загружается заново
+    with open(journal.part_path(0), 'ab') as f:
+        f.write(b'garbage')
+    journal.update_part(0, done=False)
+    api_logic.download_part_to_file('token', 1, request_id, 0, journal)
+    assert journal.is_part_done(0)
+    assert os.path.getsize(journal.part_path(0)) == size
+
+
+def test_state_dirs_do_not_depend_on_cwd():
+    import journal
+    import report_cache
+    assert os.path.isabs(journal.JOURNAL_DIR)
+    assert os.path.isabs(report_cache.CACHE_DIR)
@@ -0,0 +1,28 @@
+﻿import pyarrow as pa
+import pyarrow.parquet as pq
+
+import api_logic
+from api_logic import LogRow
+
+BIG_ID = 2 ** 63 + 5
+
+
+def test_parquet_keeps_uint64_ids(tmp_path):
+    path = str(tmp_path / 'report.parquet')
+    index = {'ym:s:visitID': 0, 'ym:s:pageViews': 1, 'ym:s:dateTime': 2}
+    rows = [LogRow(index, (str(BIG_ID), '3', '2024-01-10 12:30:00')),
+            LogRow(index, ('1', 'x', 'bad'))]
+
+    api_logic.save_stream_to_parquet(rows, path)
+
+    table = pq.read_table(path)
+    assert table.schema.field('visitID').type == pa.uint64()
+    assert table.column('visitID').to_pylist() == [BIG_ID, 1]
+    assert table.column('pageViews').to_pylist() == [3, None]
+    assert table.column('dateTime').to_pylist()[1] is None
+
+
+def test_parquet_column_out_of_range_is_empty():
+    api_logic.load_pyarrow()
+    column = api_logic._parquet_column([BIG_ID, 1], 'int', pa.int64(), 'pageViews')
+    assert column.to_pylist() == [None, 1]
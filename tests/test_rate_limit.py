@@ -0,0 +1,34 @@
+﻿import os
+
+import requests
+
+from rate_limit import RateLimitedAdapter, TokenBuckets, request_token
+
+
+def test_tokens_have_separate_buckets(tmp_path):
+    limiters = TokenBuckets(1, 1, state_dir=str(tmp_path))
+    first, second = limiters.for_token('first'), limiters.for_token('second')
+
+    assert limiters.for_token('first') is first
+    assert first.state_path != second.state_path
+    assert os.path.dirname(first.state_path) == str(tmp_path)
+    assert 'first' not in os.path.basename(first.state_path)
+
+    # Исчерпанная корзина одного токена не задерживает другой
+    assert first.reserve() == 0
+    assert first.reserve() > 0
+    assert second.reserve() == 0
+
+
+def test_adapter_uses_bucket_of_request_token(mock_api):
+    limiters = TokenBuckets(0.001, 1, state_dir=None)
+    session = requests.Session()
+    session.mount('http://', RateLimitedAdapter(limiters))
+
+    response = session.get(f"{mock_api.url}/counters", headers={'Authorization': 'OAuth secret'})
+
+    assert response.status_code == 200
+    assert request_token(response.request) == 'secret'
+    # Запрос занял единственный токен корзины secret, корзина other полна
+    assert limiters.for_token('secret').reserve() > 0
+    assert limiters.for_token('other').reserve() == 0
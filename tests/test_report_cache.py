@@ -0,0 +1,43 @@
+﻿import api_logic
+from conftest import frozen_datetime
+from report_cache import DayCache
+
+
+def test_cached_rows_follow_requested_field_order(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api_logic, 'datetime', frozen_datetime(2024, 1, 20))
+    cache = DayCache(str(tmp_path / 'cache'))
+    fields = ['ym:s:date', 'ym:s:visitID']
+    reordered = ['ym:s:visitID', 'ym:s:date']
+
+    # 1-2 января попадают в кеш с порядком столбцов fields
+    list(api_logic.iter_cached_report_rows('token', 1, fields, '2024-01-01', '2024-01-02', cache=cache,
+                                           chunk_days=None, reuse_requests=False))
+    created = mock_api.api.stats['created']
+
+    # Выгрузка с другим порядком полей: 1-2 января из кеша, 3 января из API
+    rows = list(api_logic.iter_cached_report_rows('token', 1, reordered, '2024-01-01', '2024-01-03', cache=cache,
+                                                  chunk_days=None, reuse_requests=False))
+    assert mock_api.api.stats['created'] == created + 1
+    assert {str(row['ym:s:date']) for row in rows} == {'2024-01-01', '2024-01-02', '2024-01-03'}
+    assert all(list(row.keys()) == reordered for row in rows)
+    assert all(row.values_tuple()[0] == row['ym:s:visitID'] for row in rows)
+
+
+def test_reused_request_with_other_field_order_is_cached_by_name(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api_logic, 'datetime', frozen_datetime(2024, 1, 20))
+    cache = DayCache(str(tmp_path / 'cache'))
+    fields = ['ym:s:date', 'ym:s:visitID']
+    # Существующий запрос за 1 января с другим порядком полей будет использован повторно
+    api_logic.create_log_request('token', 1, ['ym:s:visitID', 'ym:s:date'], '2024-01-01', '2024-01-01', 'last')
+
+    rows = list(api_logic.iter_cached_report_rows('token', 1, fields, '2024-01-01', '2024-01-02', cache=cache,
+                                                  chunk_days=1, max_concurrent_requests=1))
+    assert mock_api.api.stats['created'] == 2
+    assert all(list(row.keys()) == fields for row in rows)
+
+    # Столбцы дня в кеше соответствуют заголовку
+    cached = list(api_logic.iter_cached_report_rows('token', 1, fields, '2024-01-01', '2024-01-02', cache=cache,
+                                                    chunk_days=1))
+    assert mock_api.api.stats['created'] == 2
+    assert [row.values_tuple() for row in cached] == [row.values_tuple() for row in rows]
+    assert {str(row['ym:s:date']) for row in cached} == {'2024-01-01', '2024-01-02'}
@@ -0,0 +1,80 @@
+﻿import asyncio
+
+import pytest
+
+import api_logic
+import async_api
+from rate_limit import TokenBucket
+
+FIELDS = ['ym:s:visitID', 'ym:s:date']
+
+
+def foreign_request(mock_api):
+    """Запрос, созданный не выгрузкой (например, коллегой)"""
+    request_id = api_logic.create_log_request('token', 1, FIELDS, '2024-01-08', '2024-01-09', 'last')
+    assert request_id in mock_api.api.requests
+    return request_id
+
+
+def test_reused_request_is_left_alone(mock_api):
+    request_id = foreign_request(mock_api)
+
+    rows = list(api_logic.iter_report_rows('token', 1, FIELDS, '2024-01-08', '2024-01-09', chunk_days=None))
+
+    assert rows
+    assert mock_api.api.stats['created'] == 1
+    assert request_id in mock_api.api.requests
+
+
+@pytest.mark.parametrize('resume', [False, True])
+def test_reused_request_cleaned_on_request(mock_api, tmp_path, resume):
+    request_id = foreign_request(mock_api)
+
+    rows = list(api_logic.iter_report_rows('token', 1, FIELDS, '2024-01-08', '2024-01-09', chunk_days=None,
+                                           resume=resume, journal_dir=str(tmp_path), clean_up_reused=True))
+
+    assert rows
+    assert request_id not in mock_api.api.requests
+
+
+def test_created_request_is_cleaned(mock_api):
+    rows = list(api_logic.iter_report_rows('token', 1, FIELDS, '2024-01-08', '2024-01-09', chunk_days=None))
+
+    assert rows
+    assert mock_api.api.stats['created'] == 1
+    assert not mock_api.api.requests
+
+
+@pytest.mark.parametrize('clean_up_reused', [False, True])
+def test_async_reused_request(mock_api, monkeypatch, clean_up_reused):
+    monkeypatch.setattr(async_api, 'rate_limiter', TokenBucket(1000, 1000))
+    monkeypatch.setattr(async_api, 'POLL_INITIAL_DELAY', 0.01)
+    request_id = foreign_request(mock_api)
+
+    async def fetch():
+        async with async_api.AsyncLogsClient('token', base_url=mock_api.url) as client:
+            return await client.fetch_report(1, FIELDS, '2024-01-08', '2024-01-09', clean_up_reused=clean_up_reused)
+
+    assert asyncio.run(fetch())
+    assert mock_api.api.stats['created'] == 1
+    assert (request_id in mock_api.api.requests) is not clean_up_reused
+
+
+@pytest.mark.parametrize('max_days, planned', [(6, (2, 3)), (7, (2, 3)), (2, (1, 2)), (1000, (None, 3))])
+def test_plan_chunk_days_splits_quota_between_concurrent_requests(mock_api, max_days, planned):
+    mock_api.api.max_days = max_days
+    assert api_logic.plan_chunk_days('token', 1, FIELDS, '2024-01-01', '2024-01-31', concurrency=3) == planned
+
+
+def test_poller_error_is_raised_only_for_its_request(mock_api):
+    healthy = api_logic.create_log_request('token', 1, FIELDS, '2024-01-08', '2024-01-09', 'last')
+    poller = api_logic.LogRequestPoller('token')
+    # Несуществующий запрос опрашивается первым и завершается ошибкой
+    missing = poller.add(1, 999999)
+    key = poller.add(1, healthy)
+
+    assert poller.wait([key])[key]['status'] == 'processed'
+    assert missing in poller.errors
+    with pytest.raises(Exception):
+        poller.wait([missing])
+    assert missing not in poller.errors
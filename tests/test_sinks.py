@@ -0,0 +1,38 @@
+﻿import sqlite3
+from datetime import datetime
+
+import pytest
+
+from api_logic import LogRow
+from sinks import Sink, SQLiteSink, save_stream_to_sink
+
+BIG_ID = 2 ** 63 + 5
+
+
+def test_sqlite_round_trip(tmp_path):
+    path = str(tmp_path / 'report.db')
+    headers = ['ym:s:visitID', 'ym:s:dateTime', 'ym:s:pageViews']
+    index = {header: position for position, header in enumerate(headers)}
+    # Вторая часть отчета пришла с другим порядком полей
+    other_index = {'ym:s:pageViews': 0, 'ym:s:visitID': 1, 'ym:s:dateTime': 2}
+    rows = [
+        LogRow(index, (str(BIG_ID), '2024-01-10 12:30:00', '3')),
+        LogRow(other_index, ('7', '42', '2024-01-11 08:00:00')),
+    ]
+
+    assert save_stream_to_sink(rows, SQLiteSink(path, 'visits', 'replace')) == 2
+
+    connection = sqlite3.connect(path)
+    try:
+        columns = {name: kind for _, name, kind, *_ in connection.execute('PRAGMA table_info(visits)')}
+        stored = connection.execute('SELECT visitID, dateTime, pageViews FROM visits ORDER BY dateTime').fetchall()
+    finally:
+        connection.close()
+    assert columns == {'visitID': 'TEXT', 'dateTime': 'TEXT', 'pageViews': 'INTEGER'}
+    assert stored == [(str(BIG_ID), str(datetime(2024, 1, 10, 12, 30)), 3), ('42', '2024-01-11 08:00:00', 7)]
+    assert int(stored[0][0]) == BIG_ID
+
+
+def test_sink_base_is_abstract():
+    with pytest.raises(TypeError):
+        Sink('visits')
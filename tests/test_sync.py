@@ -0,0 +1,18 @@
+﻿from datetime import date
+
+from api_logic import LogRow
+from sync import iter_spool_lines, spool_rows_by_day
+
+
+def test_spool_writes_values_by_column_name(tmp_path):
+    first = LogRow({'ym:s:date': 0, 'ym:s:visitID': 1}, (date(2024, 1, 5), 1))
+    # Та же строка с другим порядком полей (например, день из кеша)
+    second = LogRow({'ym:s:visitID': 0, 'ym:s:date': 1}, (2, date(2024, 1, 5)))
+    counts = spool_rows_by_day([first, second], 'ym:s:date', str(tmp_path))
+
+    assert counts == {'2024-01-05': 2}
+    assert list(iter_spool_lines(str(tmp_path / '2024-01-05.tsv'))) == [
+        'ym:s:date\tym:s:visitID',
+        '2024-01-05\t1',
+        '2024-01-05\t2',
+    ]
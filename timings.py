@@ -0,0 +1,268 @@
+﻿import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Этапы выгрузки в порядке выполнения
+STAGES = ('create', 'poll', 'download', 'parse', 'save')
+# Префикс имен метрик в формате Prometheus
+PROMETHEUS_PREFIX = 'metrika_export'
+# Сколько функций профиля выводится в лог
+PROFILE_TOP = 25
+
+# Запись в общий файл замеров из нескольких заданий (batch.py)
+_write_lock = threading.Lock()
+
+
+class Span:
+    """
+    Замер одного этапа выгрузки (stage): метки (request_id, part, format ...),
+    числовые значения (bytes, rows, polls ...) и длительность seconds.
+    Время, проведенное в исходном итераторе (timed_iter с exclude=True),
+    вычитается из длительности этапа.
+    """
+
+    def __init__(self, trace, stage, labels):
+        self.trace = trace
+        self.stage = stage
+        self.labels = labels
+        self.values = {}
+        self.seconds = None
+        self.error = None
+        self.excluded = 0.0
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+
+    def add(self, name, value):
+        self.values[name] = self.values.get(name, 0) + value
+
+    def set(self, **values):
+        self.values.update(values)
+
+    def label(self, **labels):
+        self.labels.update(labels)
+
+    def finish(self, seconds=None, error=None):
+        """Завершить замер и передать его в трассировку (повторный вызов ничего не делает)"""
+        if self.seconds is not None:
+            return
+        if seconds is None:
+            seconds = time.perf_counter() - self._started - self.excluded
+        self.seconds = max(0.0, seconds)
+        self.error = error
+        self.trace.record(self)
+
+    def as_dict(self):
+        record = {'time': self.started_at, 'stage': self.stage, 'seconds': round(self.seconds, 6)}
+        record.update(self.trace.labels)
+        record.update(self.labels)
+        record.update(self.values)
+        if self.error:
+            record['error'] = self.error
+        return record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Ошибкой считается только Exception (закрытие генератора - не ошибка)
+        self.finish(error=exc_type.__name__ if exc_type is not None and issubclass(exc_type, Exception) else None)
+        return False
+
+
+class NullSpan:
+    """Замер-заглушка, когда трассировка не включена"""
+
+    def add(self, name, value):
+        pass
+
+    def set(self, **values):
+        pass
+
+    def label(self, **labels):
+        pass
+
+    def finish(self, seconds=None, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def start_span(trace, stage, **labels):
+    """Замер этапа в трассировке trace или заглушка, если trace=None"""
+    if trace is None:
+        return NULL_SPAN
+    return trace.span(stage, **labels)
+
+
+def timed_iter(iterable, span, seconds_name=None, count_name=None, exclude=False):
+    """
+    Обертка итератора: время внутри next() добавляется в значение
+    seconds_name замера span (exclude=True - вычитается из длительности
+    этапа, например ожидание строк при сохранении), количество элементов -
+    в значение count_name.
+    """
+    iterator = iter(iterable)
+    elapsed = 0.0
+    count = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            count += 1
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        if seconds_name:
+            span.add(seconds_name, elapsed)
+        if count_name:
+            span.add(count_name, count)
+        if exclude:
+            span.excluded += elapsed
+
+
+class PipelineTrace:
+    """
+    Трассировка выгрузки: замеры этапов create (создание запроса), poll
+    (ожидание, число проверок), download (байты по частям), parse (строки)
+    и save (строки, столбцы). labels - метки всей выгрузки (например,
+    counter_id). Замеры можно добавлять из нескольких потоков.
+
+    Результат сохраняется в JSON Lines (по строке на замер, write_jsonl)
+    или в текстовый файл метрик Prometheus (суммы по этапам, write_prometheus).
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def span(self, stage, **labels):
+        return Span(self, stage, labels)
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Суммы по этапам: {stage: {'count', 'seconds', <значения>}}"""
+        with self._lock:
+            spans = list(self.spans)
+        result = {}
+        for span in spans:
+            totals = result.setdefault(span.stage, {'count': 0, 'seconds': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += span.seconds
+            for name, value in span.values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[name] = totals.get(name, 0) + value
+        return dict(sorted(result.items(), key=lambda item: stage_order(item[0])))
+
+    def log_summary(self):
+        for stage, totals in self.summary().items():
+            values = ', '.join(f"{name}={format_number(value)}" for name, value in totals.items()
+                               if name not in ('count', 'seconds'))
+            logger.info(f"Этап {stage}: {totals['count']} замеров, {totals['seconds']:.3f} с" +
+                        (f", {values}" if values else ""))
+
+    def write_jsonl(self, path):
+        """Дописать замеры в файл JSON Lines"""
+        with self._lock:
+            records = [span.as_dict() for span in self.spans]
+        with _write_lock, open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def write_prometheus(self, path):
+        """
+        Атомарная запись сумм по этапам в текстовый формат Prometheus
+        (подходит для textfile collector node_exporter).
+        """
+        lines = []
+        summary = self.summary()
+        value_names = sorted({name for totals in summary.values() for name in totals if name not in ('count', 'seconds')})
+        metrics = [('seconds', 'Длительность этапов выгрузки, секунд'), ('count', 'Количество замеров этапа')]
+        metrics += [(name, f"Сумма значения {name} по этапу") for name in value_names]
+        for name, description in metrics:
+            metric = f"{PROMETHEUS_PREFIX}_stage_{name}_total"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for stage, totals in summary.items():
+                if name in totals:
+                    labels = prometheus_labels(dict(self.labels, stage=stage))
+                    lines.append(f"{metric}{{{labels}}} {format_number(totals[name])}")
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.metrics_', dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+    def write(self, path):
+        """Сохранение по расширению: .prom - Prometheus, иначе JSON Lines"""
+        if path.endswith('.prom'):
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path)
+        logger.info(f"Замеры этапов сохранены в {path}")
+
+
+def stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+def format_number(value):
+    if isinstance(value, float):
+        return f"{value:.6f}".rstrip('0').rstrip('.')
+    return str(value)
+
+
+def prometheus_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+@contextmanager
+def profiled(path):
+    """
+    Профилирование cProfile потока, который выполняет блок. Статистика
+    сохраняется в path (открывается pstats или snakeviz), самые затратные
+    функции выводятся в лог. Потоки загрузки частей в профиль не попадают.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Профилировщик уже включен (например, в другом задании пакета)
+        logger.warning(f"Профилирование не включено: {str(e)}")
+        yield None
+        return
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        logger.info(f"Профиль сохранен в {path}\n{report.getvalue()}")